@@ -0,0 +1,472 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRIPTS_DIR = os.path.join(BASE_DIR, 'src', 'scripts')
+if SCRIPTS_DIR not in sys.path:
+	sys.path.insert(0, SCRIPTS_DIR)
+
+from synthetic_edinet import FakeEdinetServer, build_day, make_instance  # noqa: E402  scripts を sys.path に加えた後に読む
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+# レポート形式を変えたら上げる（比較は同じ形式のレポート同士でのみ行う）
+REPORT_SCHEMA = 1
+DEFAULT_SCALES = (10, 50, 200)
+DATE = '20250402'
+# 旧実装（総当たりの類似度）は件数に比例して遅いため、計測する件数を抑える
+REFERENCE_RESOLVE_LIMIT = 50
+# 会社名・証券コードの正規化結果の正解（変更前の実装の出力）
+NORMALIZE_GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'normalize_golden.json')
+# CSVとXBRLのインスタンス文書の読込を比べる実書類（XBRL_TO_CSVのみのため、同じファクトのインスタンス文書を合成する）
+SAMPLES_DIR = os.path.join(BASE_DIR, 'data', DATE)
+# 合成したインスタンス文書はCSVの値から作るため、csv_matched は解析器がその変換を往復できることしか確かめない
+SAMPLES_FIDELITY_NOTE = ('csv_matched はXBRL_TO_CSVから合成したインスタンス文書との比較（循環的）であり、'
+	'実際のtype=1のインスタンス文書での一致は検証していない')
+
+
+def timed(func: Callable[[], Dict[str, Any]], memory: bool = False) -> Dict[str, Any]:
+	"""funcを実行し、返した件数・バイト数に所要時間とスループットを加える。
+	memoryなら計測後にもう一度tracemalloc下で実行し、ピークのメモリ確保量（peak_bytes）を加える"""
+	start = time.perf_counter()
+	result = dict(func() or {})
+	seconds = time.perf_counter() - start
+	result['seconds'] = round(seconds, 4)
+	if 'items' in result:
+		result['items_per_sec'] = round(result['items'] / seconds, 2) if seconds else 0.0
+	if 'bytes' in result:
+		result['mb_per_sec'] = round(result['bytes'] / seconds / 1e6, 2) if seconds else 0.0
+	if memory:
+		tracemalloc.start()
+		try:
+			func()
+			result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	return result
+
+
+def git_commit() -> Optional[str]:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+			text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def check_normalize_golden() -> List[str]:
+	"""normalize_name / normalize_code とSeries版の出力が正解と一致しない入力を返す"""
+	import pandas as pd
+	from code_master import normalize_name, normalize_names, normalize_code, normalize_codes
+	with open(NORMALIZE_GOLDEN, encoding='utf-8') as f:
+		golden = json.load(f)
+	mismatches = []
+	for key, scalar, series in (('names', normalize_name, normalize_names), ('codes', normalize_code, normalize_codes)):
+		inputs = [value for value, _expected in golden[key]]
+		vectorized = list(series(pd.Series(inputs, dtype=object)))
+		for (value, expected), got_scalar, got_series in zip(golden[key], map(scalar, inputs), vectorized):
+			if got_scalar != expected or got_series != expected:
+				mismatches.append(f'{key}: {value!r} → {expected!r} (scalar {got_scalar!r}, series {got_series!r})')
+	return mismatches
+
+
+def check_watch_conditional_poll() -> List[str]:
+	"""監視モードの書類一覧の確認で、件数に変化がない（304）ときにtype=2の一覧を取りに行かないことを確かめる。
+	書類のない日を2回ポーリングし、想定と異なるリクエストの列を返す"""
+	from edinet_downloader import EdinetClient
+	from edinet_watch import DocumentWatcher
+	from stage_state import StageState
+	fake = FakeEdinetServer([], {}).start()
+	previous = os.environ.get('EDINET_API_BASE')
+	os.environ['EDINET_API_BASE'] = fake.api_base
+	work_dir = tempfile.mkdtemp(prefix='edinet_bench_watch_')
+	client = EdinetClient(workers=1, rate=0)
+	state = StageState(os.path.join(work_dir, 'stage_state.sqlite'))
+	try:
+		watcher = DocumentWatcher(client, 'dummy', state)
+		first = len(watcher.poll(DATE))
+		start = len(fake.document_requests)
+		second = len(watcher.poll(DATE))
+		polled = fake.document_requests[start:]
+	finally:
+		state.close()
+		client.close()
+		fake.stop()
+		shutil.rmtree(work_dir, ignore_errors=True)
+		if previous is None:
+			os.environ.pop('EDINET_API_BASE', None)
+		else:
+			os.environ['EDINET_API_BASE'] = previous
+	if first or second or polled != [('1', 304)]:
+		return [f'2回目のポーリング: {polled}（想定 [(\'1\', 304)]）']
+	return []
+
+
+def bench_scale(docs_count: int, work_dir: str, companies: int, workers: int) -> Dict[str, Dict[str, float]]:
+	"""1つの規模（書類数）について各ステージを順に計測する"""
+	import csv_loader
+	import pandas as pd
+	import edinet2data2zipdata
+	import yyyymmddallcsv2tickersymbol2data as mapping
+	import deleteduplicatefiletickersymbolandTondata as dedup
+	from code_master import normalize_name, normalize_names, parse_company_code_map
+	from edinet_downloader import EdinetClient, DownloadTask
+	from download_manifest import DownloadManifest
+	from hash_index import HashIndex
+	from data_catalog import DataCatalog
+	from xbrl_facts_store import iter_xbrl_csv_rows
+	from zipdata2allcsv import extract_zip, verify_zip
+	import filing_archive
+
+	results: Dict[str, Dict[str, float]] = {}
+	day = build_day(os.path.join(work_dir, 'fixtures'), DATE, docs_count, companies_count=companies, packages=True)
+	day_dir = os.path.join(work_dir, 'data', DATE)
+	os.makedirs(day_dir, exist_ok=True)
+
+	# 1. ダウンロード（ローカルのEDINET互換サーバー、レート制限なし）
+	fake = FakeEdinetServer(day['docs'], day['zips']).start()
+	client = EdinetClient(workers=workers, rate=0)
+	manifest = DownloadManifest(os.path.join(work_dir, 'download_manifest.sqlite'))
+	tasks = [DownloadTask(
+		doc_id=str(doc['docID']),
+		url=f'{fake.api_base}/documents/{doc["docID"]}',
+		output_path=os.path.join(day_dir, edinet2data2zipdata.sanitize_filename(
+			f'{doc["filerName"]}_{doc["docDescription"]}_{doc["docID"]}') + '.zip'),
+		params={'type': '5'},
+	) for doc in day['docs']]
+
+	def download():
+		_results, stats = client.download_all(tasks, manifest=manifest)
+		return {'items': stats.docs, 'bytes': stats.bytes, 'failed': stats.failures}
+	try:
+		results['download'] = timed(download)
+	finally:
+		manifest.close()
+		client.close()
+		fake.stop()
+
+	# 2. 解凍せずにZIPから直接読む場合（検証・CSVの行読込・マニフェスト配置）。解凍でZIPが消える前に計測する
+	jobs = [(t.output_path, os.path.splitext(t.output_path)[0]) for t in tasks]
+
+	def verify():
+		with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+			verified = list(pool.map(verify_zip, *zip(*jobs)))
+		return {'items': len(verified), 'files': sum(r['files'] for r in verified),
+			'bytes': sum(r['bytes'] for r in verified), 'failed': sum(1 for r in verified if r['error'])}
+	results['in_place_verify'] = timed(verify)
+	zips = sorted(t.output_path for t in tasks if os.path.exists(t.output_path))
+	member_paths = [p for z in zips for p in filing_archive.iter_filing_csvs(z)]
+
+	def read_members():
+		csv_loader._cache.clear()
+		rows = sum(1 for p in member_paths for _row in iter_xbrl_csv_rows(p))
+		return {'items': len(member_paths), 'rows': rows}
+	results['in_place_rows'] = timed(read_members)
+
+	def place_members():
+		root = os.path.join(work_dir, 'placed_in_place')
+		placed = 0
+		for i, z in enumerate(zips):
+			copied, _skipped = mapping.copy_csvs_to_ticker_dir(z, os.path.join(root, f'{i % 100:04d}.T'), 'manifest')
+			placed += copied
+		return {'items': placed}
+	results['in_place_placement_manifest'] = timed(place_members)
+
+	# 3. 解凍（zipdata2allcsvと同じくプロセスプールでXBRL_TO_CSVのみ展開）
+
+	def extract():
+		with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+			extracted = list(pool.map(extract_zip, *zip(*jobs)))
+		return {'items': len(extracted), 'files': sum(r['files'] for r in extracted),
+			'bytes': sum(r['bytes'] for r in extracted), 'failed': sum(1 for r in extracted if r['error'])}
+	results['extract'] = timed(extract)
+	folders = sorted(os.path.join(day_dir, n) for n in os.listdir(day_dir) if os.path.isdir(os.path.join(day_dir, n)))
+	names = [mapping.parse_company_from_folder(os.path.basename(f)) for f in folders]
+
+	# 4. 証券コードの名寄せ（コードマスタ読込・旧実装・インデックス）
+	company2code: Dict[str, str] = {}
+
+	def load_master():
+		company2code.update(parse_company_code_map(day['master_path']))
+		return {'items': len(company2code)}
+	results['code_master_load'] = timed(load_master)
+
+	raw_names = list(day['companies']) + names
+	results['normalize_scalar'] = timed(lambda: {'items': len([normalize_name(n) for n in raw_names])})
+	results['normalize_series'] = timed(lambda: {'items': len(normalize_names(pd.Series(raw_names, dtype=object)))})
+
+	sample = names[:REFERENCE_RESOLVE_LIMIT]
+	results['resolve_similarity'] = timed(lambda: {
+		'items': len(sample),
+		'matched': sum(1 for n in sample if mapping.resolve_code_with_similarity(company2code, n)[0])})
+	index_holder = {}
+
+	def build_index():
+		index_holder['index'] = mapping.CompanyNameIndex(company2code)
+		return {'items': len(company2code)}
+	results['resolve_index_build'] = timed(build_index)
+	results['resolve_index'] = timed(lambda: {
+		'items': len(names),
+		'matched': sum(1 for n in names if index_holder['index'].resolve(n, threshold=0.5)[0])})
+
+	# 5. 証券コードディレクトリへの配置（方式ごと）
+	tickers = {}
+	for folder, name in zip(folders, names):
+		code = index_holder['index'].resolve(name, threshold=0.5)[0]
+		tickers[folder] = f'{code or "0000"}.T'
+	for mode in ('copy', 'link', 'manifest'):
+		root = os.path.join(work_dir, f'placed_{mode}')
+
+		def place(mode=mode, root=root):
+			placed = 0
+			for folder, ticker in tickers.items():
+				copied, _skipped = mapping.copy_csvs_to_ticker_dir(folder, os.path.join(root, ticker), mode)
+				placed += copied
+			return {'items': placed}
+		results[f'placement_{mode}'] = timed(place)
+
+	# 6. 重複検出（コピーで配置したツリーに重複を足し、索引なし・索引ありの2回）
+	copy_root = os.path.join(work_dir, 'placed_copy')
+	for ticker in sorted(os.listdir(copy_root))[::3]:
+		for fn in sorted(os.listdir(os.path.join(copy_root, ticker))):
+			shutil.copy2(os.path.join(copy_root, ticker, fn), os.path.join(copy_root, ticker, 'dup_' + fn))
+	index = HashIndex(os.path.join(work_dir, 'hash_index.sqlite'))
+	try:
+		for label in ('dedup_cold', 'dedup_warm'):
+			def scan():
+				entries = dedup.scan_ticker_files(copy_root)
+				digests = dedup.hash_candidates(entries, index, workers=workers)
+				duplicates, _cross = dedup.find_duplicates(entries, digests)
+				return {'items': len(entries), 'bytes': sum(e.size for e in entries), 'duplicates': len(duplicates)}
+			results[label] = timed(scan)
+	finally:
+		index.close()
+
+	# 6b. 目録（ディレクトリ走査の代わり）: 並列の再構築と、重複検出の列挙を走査と目録で比較
+	catalog = DataCatalog(os.path.join(work_dir, 'catalog.sqlite'), copy_root)
+	try:
+		def rebuild():
+			counts = catalog.rebuild(workers=workers)
+			return {'items': counts['tickers'], 'files': counts['files']}
+		results['catalog_rebuild'] = timed(rebuild)
+		results['list_scan'] = timed(lambda: {'items': len(dedup.scan_ticker_files(copy_root))})
+		results['list_catalog'] = timed(lambda: {'items': len(dedup.catalog_ticker_files(catalog))})
+	finally:
+		catalog.close()
+
+	# 7. CSV読込（文字コード判定を含むpandas読込と、ファクト取込用の行読込）
+	csv_paths = sorted(os.path.join(cur, fn) for folder in folders
+		for cur, _dirs, files in os.walk(folder) for fn in files if fn.endswith('.csv'))
+	total_bytes = sum(os.path.getsize(p) for p in csv_paths)
+
+	def load_pandas():
+		csv_loader._cache.clear()
+		rows = sum(len(csv_loader.read_csv(p)) for p in csv_paths)
+		return {'items': len(csv_paths), 'bytes': total_bytes, 'rows': rows}
+	results['csv_load_pandas'] = timed(load_pandas)
+	results['csv_load_rows'] = timed(lambda: {
+		'items': len(csv_paths), 'bytes': total_bytes,
+		'rows': sum(1 for p in csv_paths for _ in iter_xbrl_csv_rows(p))}, memory=True)
+
+	# 8. 同じファクトをtype=1のインスタンス文書から逐次解析（1プロセス、プロセスプール、ファクト取込）
+	from xbrl_instance import default_package_dir
+	package_dir = default_package_dir(DATE, work_dir)
+	os.makedirs(package_dir)
+	packages = []
+	for doc_id, body in sorted(day['packages'].items()):
+		packages.append(os.path.join(package_dir, f'{doc_id}.zip'))
+		with open(packages[-1], 'wb') as f:
+			f.write(body)
+	results.update(bench_xbrl_route(packages, work_dir, workers))
+	return results
+
+
+def bench_xbrl_route(packages: List[str], work_dir: str, workers: int) -> Dict[str, Dict[str, float]]:
+	"""type=1のZIPのインスタンス文書の解析（逐次読込のメモリ、プロセスプールでのスループット）と、
+	取込（--source xbrl）と同じ parse_package → 一時ファイル → SQLite の経路の親プロセスのピークメモリ。
+	packagesは default_package_dir(DATE, work_dir) に置いたZIP"""
+	from pipeline import process_pool
+	from xbrl_facts_store import FactStore
+	from xbrl_instance import iter_package_facts, iter_spool, parse_package
+	package_bytes = sum(os.path.getsize(p) for p in packages)
+	results = {'xbrl_load_rows': timed(lambda: {
+		'items': len(packages), 'bytes': package_bytes,
+		'rows': sum(1 for p in packages for _ in iter_package_facts(p))}, memory=True)}
+
+	def parse_pool():
+		spool_dir = tempfile.mkdtemp(prefix='spool_', dir=work_dir)
+		spools = [os.path.join(spool_dir, f'{i}.pickle') for i in range(len(packages))]
+		try:
+			with process_pool(min(workers, len(packages))) as pool:
+				parsed = list(pool.map(parse_package, packages, spools))
+			rows = sum(1 for r in parsed if not r['error'] for _ in iter_spool(str(r['spool'])))
+		finally:
+			shutil.rmtree(spool_dir, ignore_errors=True)
+		return {'items': len(parsed), 'bytes': package_bytes, 'rows': rows,
+			'failed': sum(1 for r in parsed if r['error'])}
+	results['xbrl_parse_pool'] = timed(parse_pool, memory=True)
+
+	store = FactStore(os.path.join(work_dir, 'xbrl_facts.sqlite'))
+	try:
+		results['xbrl_ingest'] = timed(lambda: {'items': len(packages), 'bytes': package_bytes,
+			'rows': store.ingest_day(DATE, base_dir=work_dir, force=True, source='xbrl', workers=workers)}, memory=True)
+	finally:
+		store.close()
+	return results
+
+
+def bench_samples(samples_dir: str, work_dir: str, workers: int) -> Dict[str, Dict[str, float]]:
+	"""実書類のXBRL_TO_CSVと、同じファクトから合成したインスタンス文書の読込を比べる。
+	csv_matchedは相対年度・連結個別・単位などが読込経路によらず一致したファクト数（テキストブロックの本文を除く）。
+	インスタンス文書はCSVから合成するため、実際のtype=1との一致は確かめられない（SAMPLES_FIDELITY_NOTE）"""
+	import zipfile
+	import filing_archive
+	from xbrl_facts_store import FACT_COLUMNS, XBRL_CSV_NAME, iter_xbrl_csv_rows
+	from xbrl_instance import default_package_dir, iter_package_facts
+
+	package_dir = default_package_dir(DATE, work_dir)
+	os.makedirs(package_dir)
+
+	csv_paths, packages = [], []
+	for name, source in filing_archive.list_filings(samples_dir).items():
+		csvs = [(fn, path) for fn, path in filing_archive.xbrl_csvs(source) if XBRL_CSV_NAME.match(fn)]
+		if not csvs:
+			continue
+		package = os.path.join(package_dir, f'{name}.zip')
+		with zipfile.ZipFile(package, 'w', zipfile.ZIP_DEFLATED) as z:
+			for fn, path in csvs:
+				m = XBRL_CSV_NAME.match(fn)
+				rows = [[fact[col] for col in FACT_COLUMNS] for fact in iter_xbrl_csv_rows(path)]
+				z.writestr(f'XBRL/PublicDoc/{fn[:-len(".csv")]}.xbrl',
+					make_instance(rows, m.group('period_end'), m.group('submitted')))
+		csv_paths.extend(path for _fn, path in csvs)
+		packages.append(package)
+	if not packages:
+		return {}
+	csv_bytes = sum(filing_archive.stat(p)[0] for p in csv_paths)
+	results = {'csv_load_rows': timed(lambda: {
+		'items': len(csv_paths), 'bytes': csv_bytes,
+		'rows': sum(1 for p in csv_paths for _ in iter_xbrl_csv_rows(p))}, memory=True)}
+	results.update(bench_xbrl_route(packages, work_dir, workers))
+
+	keys = [col for col in FACT_COLUMNS if col not in ('item_name', 'value_text')]
+	from_csv = [tuple(fact[k] for k in keys) for p in csv_paths for fact in iter_xbrl_csv_rows(p)]
+	from_xbrl = [tuple(fact[k] for k in keys) for p in packages for _fn, _m, fact in iter_package_facts(p)]
+	results['csv_load_rows']['csv_matched'] = sum(1 for a, b in zip(sorted(from_csv), sorted(from_xbrl)) if a == b)
+	return results
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+	"""スループット（items_per_sec）が閾値を超えて下がったステージを返す"""
+	regressions = []
+	for scale, stages in report['results'].items():
+		for stage, current in stages.items():
+			before = baseline.get('results', {}).get(scale, {}).get(stage)
+			if not before or not before.get('items_per_sec') or 'items_per_sec' not in current:
+				continue
+			ratio = current['items_per_sec'] / before['items_per_sec']
+			mark = ''
+			if ratio < 1 - threshold:
+				mark = '  ← 低下'
+				regressions.append(f'{scale}/{stage}')
+			print(f'{scale:>10} {stage:<22} {before["items_per_sec"]:>12.2f} → {current["items_per_sec"]:>12.2f} /s  x{ratio:.2f}{mark}')
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description='合成したEDINETデータで各ステージのスループットを計測し、JSONで出力する')
+	parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)), help='書類数（カンマ区切り）')
+	parser.add_argument('--companies', type=int, default=4000, help='コードマスタの銘柄数')
+	parser.add_argument('--workers', type=int, default=4, help='並列数（ダウンロード・解凍・ハッシュ計算）')
+	parser.add_argument('--output', default=None, help='レポートの出力先（既定: data/benchmarks/bench_<commit>.json）')
+	parser.add_argument('--compare', default=None, help='比較するベースラインのレポート')
+	parser.add_argument('--threshold', type=float, default=0.2, help='低下とみなすスループットの減少率')
+	parser.add_argument('--keep', action='store_true', help='作業ディレクトリを削除しない')
+	parser.add_argument('--samples', default=SAMPLES_DIR,
+		help='CSVとXBRLの読込を比べる実書類の日付ディレクトリ（空文字で省略）')
+	args = parser.parse_args()
+
+	mismatches = check_normalize_golden()
+	if mismatches:
+		print('会社名・証券コードの正規化結果が正解と一致しません:')
+		print('\n'.join(mismatches[:20]))
+		sys.exit(1)
+	mismatches = check_watch_conditional_poll()
+	if mismatches:
+		print('監視モードの条件付きリクエストが効いていません:')
+		print('\n'.join(mismatches))
+		sys.exit(1)
+
+	commit = git_commit()
+	report = {
+		'schema': REPORT_SCHEMA,
+		'meta': {
+			'commit': commit,
+			'created_at': datetime.now().isoformat(timespec='seconds'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpu_count': os.cpu_count(),
+			'workers': args.workers,
+			'companies': args.companies,
+		},
+		'results': {},
+	}
+	for scale in [int(s) for s in args.scales.split(',') if s]:
+		work_dir = tempfile.mkdtemp(prefix=f'edinet_bench_{scale}_')
+		try:
+			print(f'書類 {scale} 件: 計測中...', flush=True)
+			report['results'][f'docs_{scale}'] = bench_scale(scale, work_dir, args.companies, args.workers)
+		finally:
+			if args.keep:
+				print(f'作業ディレクトリ: {work_dir}')
+			else:
+				shutil.rmtree(work_dir, ignore_errors=True)
+
+	if args.samples and os.path.isdir(args.samples):
+		work_dir = tempfile.mkdtemp(prefix='edinet_bench_samples_')
+		try:
+			print(f'実書類 {args.samples}: 計測中...', flush=True)
+			samples = bench_samples(args.samples, work_dir, args.workers)
+			if samples:
+				report['results'][f'samples_{os.path.basename(os.path.normpath(args.samples))}'] = samples
+				report['meta']['notes'] = [SAMPLES_FIDELITY_NOTE]
+				print(f'注意: {SAMPLES_FIDELITY_NOTE}')
+		finally:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	output = args.output or os.path.join(BASE_DIR, 'data', 'benchmarks', f'bench_{commit or "unknown"}.json')
+	os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+	with open(output, 'w', encoding='utf-8') as f:
+		json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+	for scale, stages in report['results'].items():
+		for stage, r in stages.items():
+			peak = f'  ピーク {r["peak_bytes"] / 1e6:.1f} MB' if 'peak_bytes' in r else ''
+			print(f'{scale:>10} {stage:<22} {r["seconds"]:>9.3f} 秒  {r.get("items_per_sec", 0):>12.2f} 件/秒{peak}')
+	print(f'レポート: {output}')
+
+	if args.compare:
+		with open(args.compare, encoding='utf-8') as f:
+			baseline = json.load(f)
+		if baseline.get('schema') != REPORT_SCHEMA:
+			print(f'レポート形式が異なるため比較できません: {args.compare}')
+			sys.exit(1)
+		regressions = compare(report, baseline, args.threshold)
+		if regressions:
+			print(f'スループット低下: {", ".join(regressions)}')
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
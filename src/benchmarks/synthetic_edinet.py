@@ -0,0 +1,343 @@
+import io
+import os
+import csv
+import json
+import time
+import random
+import zipfile
+import threading
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape, quoteattr
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+
+# 社名の部品（data/20250402 の書類と同様に全角英字・中点・長音を含む）
+KATAKANA = ['ア', 'イ', 'ウ', 'エ', 'オ', 'カ', 'キ', 'ク', 'ケ', 'コ', 'サ', 'シ', 'ス', 'セ', 'ソ', 'タ', 'テ', 'ト',
+	'ナ', 'ニ', 'ネ', 'ハ', 'ヒ', 'フ', 'ヘ', 'ホ', 'マ', 'ミ', 'ム', 'メ', 'モ', 'ヤ', 'ユ', 'ヨ', 'ラ', 'リ', 'ル', 'レ',
+	'ロ', 'ワ', 'ン', 'ー', 'ッ', 'ディー', 'ジェイ', 'エス']
+KANJI = ['日本', '東京', '大阪', '西本', '北海', '中央', '第一', '三和', '新日', '富士', '太平', '関西', '九州', '明治']
+SUFFIXES = ['ホールディングス', '工業', '電機', '製作所', '商事', 'システムズ', 'アセットマネジメント', '化学', '建設', '']
+LATIN = ['HC', 'JP', 'DDS', 'Wismettac', 'NEXT', 'ABC', 'KDX', 'GMO', 'SBI', 'TKP']
+DOC_DESCRIPTIONS = ['有価証券報告書－第{n}期({y}/01/01－{y}/12/31)', '訂正有価証券報告書－第{n}期({y}/01/01－{y}/12/31)']
+
+HEADER = ['要素ID', '項目名', 'コンテキストID', '相対年度', '連結・個別', '期間・時点', 'ユニットID', '単位', '値']
+CONTEXTS = [('CurrentYearDuration', '当期', '期間'), ('Prior1YearDuration', '前期', '期間'),
+	('CurrentYearInstant', '当期末', '時点'), ('Prior1YearInstant', '前期末', '時点')]
+KEY_ELEMENTS = ['jpcrp_cor:NetSalesSummaryOfBusinessResults', 'jpcrp_cor:OrdinaryIncomeLossSummaryOfBusinessResults',
+	'jpcrp_cor:ProfitLossAttributableToOwnersOfParentSummaryOfBusinessResults', 'jpcrp_cor:TotalAssetsSummaryOfBusinessResults',
+	'jpcrp_cor:NetAssetsSummaryOfBusinessResults', 'jppfs_cor:OperatingIncome',
+	'jpcrp_cor:NetCashProvidedByUsedInOperatingActivitiesSummaryOfBusinessResults']
+
+
+def to_fullwidth(text: str) -> str:
+	"""英数字を全角にする（EDINETの提出者名と同じ表記）"""
+	return ''.join(chr(ord(c) + 0xFEE0) if '!' <= c <= '~' else c for c in text)
+
+
+def company_names(count: int, seed: int = 0) -> List[str]:
+	"""重複のない会社名（JPXのコードマスタ表記）を生成する"""
+	rng = random.Random(seed)
+	names, seen = [], set()
+	while len(names) < count:
+		kind = rng.random()
+		if kind < 0.3:
+			base = rng.choice(KANJI) + ''.join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 4)))
+		elif kind < 0.5:
+			base = rng.choice(LATIN) + ''.join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 3)))
+		else:
+			base = '・'.join(''.join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3)))
+		name = base + rng.choice(SUFFIXES)
+		if name not in seen:
+			seen.add(name)
+			names.append(name)
+	return names
+
+
+def filer_name(company: str, rng: random.Random, variant: bool = False) -> str:
+	"""書類一覧の filerName 表記（全角英字、株式会社の前後付き）。variantなら1文字欠けた表記揺れにする"""
+	name = to_fullwidth(company)
+	if variant and len(name) > 3:
+		drop = rng.randrange(1, len(name))
+		name = name[:drop] + name[drop + 1:]
+	return f'株式会社{name}' if rng.random() < 0.5 else f'{name}株式会社'
+
+
+def write_code_master(path: str, companies: List[str]) -> Dict[str, str]:
+	"""JPXの上場銘柄一覧と同じ列構成のCSV（Shift_JIS）を書き出し、会社名→コードを返す"""
+	codes = {}
+	with open(path, 'w', encoding='shift_jis', newline='') as f:
+		w = csv.writer(f)
+		w.writerow(['日付', 'コード', '銘柄名', '市場・商品区分', '33業種区分', '規模区分'])
+		for i, company in enumerate(companies):
+			code = str(1300 + i * 2)[:4]
+			codes[company] = code
+			w.writerow(['20250331', code, company, 'プライム（内国株式）', '電気機器', 'TOPIX Small 1'])
+	return codes
+
+
+def generate_documents(companies: List[str], codes: Dict[str, str], count: int, date: str,
+		seed: int = 0, sec_code_ratio: float = 0.7, variant_ratio: float = 0.2) -> List[Dict[str, object]]:
+	"""書類一覧APIの results と同じ形式の書類を生成する。一部はsecCodeなし（名寄せの対象）、
+	一部は会社名の表記揺れ（類似度での名寄せの対象）"""
+	rng = random.Random(seed)
+	day = datetime.strptime(date, '%Y%m%d')
+	docs = []
+	for i in range(count):
+		company = companies[rng.randrange(len(companies))]
+		year = rng.randint(2020, 2024)
+		docs.append({
+			'seqNumber': i + 1,
+			'docID': f'S1{i:06X}',
+			'edinetCode': f'E{10000 + i:05d}',
+			'secCode': f'{codes[company]}0' if rng.random() < sec_code_ratio else None,
+			'JCN': None,
+			'filerName': filer_name(company, rng, rng.random() < variant_ratio),
+			'fundCode': None,
+			'docTypeCode': '120',
+			'docDescription': rng.choice(DOC_DESCRIPTIONS).format(n=rng.randint(1, 80), y=year),
+			'submitDateTime': (day + timedelta(hours=9, minutes=i % 480)).strftime('%Y-%m-%d %H:%M'),
+		})
+	return docs
+
+
+def _xbrl_csv(rows: List[List[str]]) -> bytes:
+	"""XBRL_TO_CSVと同じUTF-16（BOM付き）・タブ区切り"""
+	buf = io.StringIO()
+	w = csv.writer(buf, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\r\n')
+	w.writerow(HEADER)
+	w.writerows(rows)
+	return buf.getvalue().encode('utf-16')
+
+
+def _filing_rows(doc: Dict[str, object], facts: int, text_blocks: int, seed: int) -> Tuple[List[List[str]], List[List[str]]]:
+	"""本体（jpcrp）・監査報告書（jpaud）のファクト（XBRL_TO_CSVの行）"""
+	rng = random.Random(f'{seed}:{doc["docID"]}')
+	rows = []
+	for element in KEY_ELEMENTS:
+		for ctx, year, period in CONTEXTS:
+			rows.append([element, '主要な経営指標等', ctx, year, '連結', period, 'JPY', '円', str(rng.randint(10 ** 8, 10 ** 12))])
+	for i in range(facts):
+		ctx, year, period = CONTEXTS[i % len(CONTEXTS)]
+		rows.append([f'jppfs_cor:Element{i:04d}', f'項目{i}', ctx, year, '連結', period, 'JPY', '円', str(rng.randint(-10 ** 9, 10 ** 10))])
+	for i in range(text_blocks):
+		rows.append([f'jpcrp_cor:Description{i:02d}TextBlock', f'注記{i} [テキストブロック]', 'FilingDateInstant',
+			'提出日時点', 'その他', '時点', '', '', '当社グループの事業の内容について説明します。' * rng.randint(20, 120)])
+	audit = [['jpaud_cor:IndependentAuditorsReportTextBlock', '監査報告書', 'FilingDateInstant', '提出日時点', 'その他',
+		'時点', '', '', '独立監査人の監査報告書。' * 400]]
+	return rows, audit
+
+
+def make_zip(doc: Dict[str, object], facts: int = 1200, text_blocks: int = 30, seed: int = 0) -> bytes:
+	"""書類取得API（type=5）相当のZIP。本体（jpcrp）・監査報告書（jpaud）のCSVと、展開対象外の大きなメンバーを含む"""
+	rows, audit = _filing_rows(doc, facts, text_blocks, seed)
+	edinet_code = doc['edinetCode']
+	submitted = str(doc['submitDateTime'])[:10]
+	buf = io.BytesIO()
+	with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+		z.writestr(f'XBRL_TO_CSV/jpcrp030000-asr-001_{edinet_code}-000_2024-12-31_01_{submitted}.csv', _xbrl_csv(rows))
+		z.writestr(f'XBRL_TO_CSV/jpaud-aai-cc-001_{edinet_code}-000_2024-12-31_01_{submitted}.csv', _xbrl_csv(audit))
+		z.writestr('PublicDoc/0101010_honbun.htm', ('<html>' + '本文' * 50000 + '</html>').encode('utf-8'))
+		z.writestr('XBRL/PublicDoc/manifest_PublicDoc.xml', b'<manifest/>' * 100)
+	return buf.getvalue()
+
+
+def _shift_years(date: str, years: int) -> str:
+	y, m, d = date.split('-')
+	if (m, d) == ('02', '29'):
+		d = '28'
+	return f'{int(y) - years:04d}-{m}-{d}'
+
+
+def _context_xml(context_id: str, period_end: str, filing_date: str, instant: bool) -> str:
+	"""コンテキストIDの命名規約（期間_メンバー_…）から期間とシナリオを組み立てる"""
+	base, *members = context_id.split('_')
+	base = base[:-len('Duration')] if base.endswith('Duration') else base[:-len('Instant')] if base.endswith('Instant') else base
+	if base == 'FilingDate':
+		end = filing_date
+	else:
+		end = _shift_years(period_end, 0 if base == 'CurrentYear' else int(base[len('Prior'):-len('Year')] or 0))
+	if instant:
+		period = f'<xbrli:instant>{end}</xbrli:instant>'
+	else:
+		period = f'<xbrli:startDate>{_shift_years(end, 1)}</xbrli:startDate><xbrli:endDate>{end}</xbrli:endDate>'
+	scenario = ''
+	if members:
+		dims = []
+		for member in members:
+			axis = 'jppfs_cor:ConsolidatedOrNonConsolidatedAxis' if member == 'NonConsolidatedMember' else 'jpcrp_cor:SegmentsAxis'
+			dims.append(f'<xbrldi:explicitMember dimension="{axis}">jpcrp_cor:{member}</xbrldi:explicitMember>')
+		scenario = f'<xbrli:scenario>{"".join(dims)}</xbrli:scenario>'
+	return (f'<xbrli:context id={quoteattr(context_id)}><xbrli:entity><xbrli:identifier scheme="http://disclosure.edinet-fsa.go.jp">'
+		f'E00000-000</xbrli:identifier></xbrli:entity><xbrli:period>{period}</xbrli:period>{scenario}</xbrli:context>')
+
+
+def make_instance(rows: List[List[str]], period_end: str, filing_date: str) -> bytes:
+	"""XBRL_TO_CSVの行と同じファクトを持つインスタンス文書（type=1のZIP内の .xbrl 相当）"""
+	prefixes = sorted({row[0].split(':', 1)[0] for row in rows} | {'jpcrp_cor', 'jppfs_cor'})
+	ns = ''.join(f' xmlns:{p}="http://disclosure.edinet-fsa.go.jp/taxonomy/{p}"' for p in prefixes)
+	out = [f'<?xml version="1.0" encoding="UTF-8"?>\n<xbrli:xbrl xmlns:xbrli="http://www.xbrl.org/2003/instance" '
+		f'xmlns:link="http://www.xbrl.org/2003/linkbase" xmlns:xlink="http://www.w3.org/1999/xlink" '
+		f'xmlns:xbrldi="http://xbrl.org/2006/xbrldi" xmlns:iso4217="http://www.xbrl.org/2003/iso4217" '
+		f'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"{ns}>',
+		'<link:schemaRef xlink:type="simple" xlink:href="jpcrp030000-asr-001.xsd"/>']
+	contexts: Dict[str, bool] = {}
+	units = set()
+	for row in rows:
+		contexts.setdefault(row[2], row[5] == '時点')
+		if row[6] and row[6] != '－':
+			units.add(row[6])
+	out.extend(_context_xml(cid, period_end, filing_date, instant) for cid, instant in contexts.items())
+	for unit in sorted(units):
+		if unit == 'JPYPerShares':
+			measure = ('<xbrli:divide><xbrli:unitNumerator><xbrli:measure>iso4217:JPY</xbrli:measure></xbrli:unitNumerator>'
+				'<xbrli:unitDenominator><xbrli:measure>xbrli:shares</xbrli:measure></xbrli:unitDenominator></xbrli:divide>')
+		else:
+			measure = f'<xbrli:measure>{"iso4217:JPY" if unit == "JPY" else "xbrli:" + unit}</xbrli:measure>'
+		out.append(f'<xbrli:unit id={quoteattr(unit)}>{measure}</xbrli:unit>')
+	for element, _name, context, _year, _consolidation, _period, unit, _label, value in rows:
+		attrs = f' contextRef={quoteattr(context)}'
+		if unit and unit != '－':
+			attrs += f' unitRef={quoteattr(unit)} decimals="0"'
+			if value == '－':
+				out.append(f'<{element}{attrs} xsi:nil="true"/>')
+				continue
+		if element.endswith('TextBlock'):
+			value = f'<p>{escape(value)}</p>'
+		out.append(f'<{element}{attrs}>{escape(value)}</{element}>')
+	out.append('</xbrli:xbrl>')
+	return '\n'.join(out).encode('utf-8')
+
+
+def make_xbrl_package(doc: Dict[str, object], facts: int = 1200, text_blocks: int = 30, seed: int = 0) -> bytes:
+	"""書類取得API（type=1）相当のZIP。make_zipと同じファクトをインスタンス文書（本文書・監査報告書）で持つ"""
+	rows, audit = _filing_rows(doc, facts, text_blocks, seed)
+	edinet_code = doc['edinetCode']
+	submitted = str(doc['submitDateTime'])[:10]
+	buf = io.BytesIO()
+	with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+		z.writestr(f'XBRL/PublicDoc/jpcrp030000-asr-001_{edinet_code}-000_2024-12-31_01_{submitted}.xbrl',
+			make_instance(rows, '2024-12-31', submitted))
+		z.writestr(f'XBRL/AuditDoc/jpaud-aai-cc-001_{edinet_code}-000_2024-12-31_01_{submitted}.xbrl',
+			make_instance(audit, '2024-12-31', submitted))
+		z.writestr('XBRL/PublicDoc/0101010_honbun.htm', ('<html>' + '本文' * 50000 + '</html>').encode('utf-8'))
+	return buf.getvalue()
+
+
+class FakeEdinetServer:
+	"""書類一覧API（type=1/2、ETag付き）と書類取得API（type=5、packagesを渡せばtype=1も）を返す
+	ローカルのEDINET互換サーバー。release_interval秒ごとに1件ずつ書類を公開すれば監視モードの確認にも使える"""
+
+	def __init__(self, docs: List[Dict[str, object]], zips: Dict[str, bytes], release_interval: float = 0.0,
+			host: str = '127.0.0.1', port: int = 0, packages: Optional[Dict[str, bytes]] = None):
+		self.docs = docs
+		self.zips = zips
+		self.packages = packages or {}
+		self.release_interval = release_interval
+		self.requests = 0
+		# 書類一覧APIへのリクエスト（type, ステータス）。監視モードの条件付きリクエストの確認用
+		self.document_requests: List[Tuple[str, int]] = []
+		self._started = 0.0
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def log_message(self, format, *args):
+				pass
+
+			def do_GET(self):
+				server.requests += 1
+				url = urlsplit(self.path)
+				if url.path.endswith('/documents.json'):
+					self._documents(parse_qs(url.query))
+				else:
+					bodies = server.packages if parse_qs(url.query).get('type') == ['1'] else server.zips
+					body = bodies.get(url.path.rsplit('/', 1)[-1])
+					if body is None:
+						self._send(200, json.dumps({'metadata': {'status': '404', 'message': 'Not Found'}}).encode(), 'application/json')
+					else:
+						self._send(200, body, 'application/octet-stream')
+
+			def _documents(self, query):
+				docs = server.visible()
+				etag = f'"{len(docs)}"'
+				doc_type = (query.get('type') or [''])[0]
+				if doc_type == '1' and self.headers.get('If-None-Match') == etag:
+					server.document_requests.append((doc_type, 304))
+					self._send(304, b'', None, etag)
+					return
+				server.document_requests.append((doc_type, 200))
+				payload: Dict[str, Any] = {'metadata': {'status': '200', 'message': 'OK', 'resultset': {'count': len(docs)}}}
+				if query.get('type') != ['1']:
+					payload['results'] = docs
+				self._send(200, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json', etag)
+
+			def _send(self, status, body, content_type, etag=None):
+				self.send_response(status)
+				if content_type:
+					self.send_header('Content-Type', content_type)
+				if etag:
+					self.send_header('ETag', etag)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		self.httpd = ThreadingHTTPServer((host, port), Handler)
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+	@property
+	def api_base(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return f'http://{host}:{port}/api/v2'
+
+	def visible(self) -> List[Dict[str, object]]:
+		if not self.release_interval:
+			return self.docs
+		count = int((time.monotonic() - self._started) / self.release_interval) + 1
+		return self.docs[:count]
+
+	def start(self) -> 'FakeEdinetServer':
+		self._started = time.monotonic()
+		self.thread.start()
+		return self
+
+	def stop(self) -> None:
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def build_day(root: str, date: str, docs_count: int, companies_count: int = 4000, seed: int = 0,
+		facts: int = 1200, packages: bool = False) -> Dict[str, Any]:
+	"""root配下に合成した1日分（コードマスタ・書類一覧・ZIP）を作り、その内容を返す。
+	packagesならtype=1のZIPも作る"""
+	os.makedirs(root, exist_ok=True)
+	companies = company_names(companies_count, seed)
+	master_path = os.path.join(root, 'data_j.csv')
+	codes = write_code_master(master_path, companies)
+	docs = generate_documents(companies, codes, docs_count, date, seed)
+	zips = {str(doc['docID']): make_zip(doc, facts=facts, seed=seed) for doc in docs}
+	xbrl = {str(doc['docID']): make_xbrl_package(doc, facts=facts, seed=seed) for doc in docs} if packages else {}
+	return {'companies': companies, 'codes': codes, 'master_path': master_path, 'docs': docs, 'zips': zips,
+		'packages': xbrl}
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='合成したEDINET互換データを返すローカルサーバーを起動する')
+	parser.add_argument('--docs', type=int, default=50, help='書類数')
+	parser.add_argument('--date', default=datetime.now().strftime('%Y%m%d'), help='提出日 yyyymmdd')
+	parser.add_argument('--port', type=int, default=8765, help='待受ポート')
+	parser.add_argument('--release-interval', type=float, default=0.0, help='書類を1件ずつ公開する間隔（秒、0は全件公開）')
+	parser.add_argument('--root', default=os.path.join('data', '.bench'), help='コードマスタの出力先')
+	args = parser.parse_args()
+	day = build_day(args.root, args.date, args.docs, packages=True)
+	fake = FakeEdinetServer(day['docs'], day['zips'], release_interval=args.release_interval, port=args.port,
+		packages=day['packages']).start()
+	print(f'EDINET_API_BASE={fake.api_base}  (コードマスタ: {day["master_path"]})')
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		fake.stop()
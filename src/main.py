@@ -1,37 +1,307 @@
+import os
 import sys
-import subprocess
+import time
+import queue
+import argparse
+import threading
 import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-def run_step(cmd, desc):
-	logging.info(f'--- {desc} ---')
-	result = subprocess.run(cmd, shell=True)
-	if result.returncode != 0:
-		logging.error(f'失敗: {desc}')
-		sys.exit(result.returncode)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(BASE_DIR, 'src', 'scripts')
 
-def main():
-	if len(sys.argv) < 2:
-		print('使い方: python main.py yyyymmdd')
+STAGE_DOWNLOAD = 'EDINETデータ取得・ZIP保存'
+STAGE_CODE_MAP = 'JPX証券コードマッピング読込'
+STAGE_EXTRACT = 'ZIP解凍・削除'
+STAGE_MAP = 'CSVを証券コードディレクトリに配置'
+STAGE_FACTS = 'XBRLファクト取込'
+STAGE_YAHOO = 'Yahoo Finance財務データ一括取得'
+STAGE_ANALYZE = 'AI財務分析一括処理'
+
+def import_stages():
+	# src/scripts 配下のスクリプトを同一プロセスにインポートして使う
+	if SCRIPTS_DIR not in sys.path:
+		sys.path.insert(0, SCRIPTS_DIR)
+
+def load_code_map():
+	# 名寄せ結果は会社名ごとにメモ化されるため、期間指定時は全日で同じインデックスを共有する
+	import yyyymmddallcsv2tickersymbol2data
+	return yyyymmddallcsv2tickersymbol2data.CompanyNameIndex(yyyymmddallcsv2tickersymbol2data.load_company_code_map(
+		yyyymmddallcsv2tickersymbol2data.default_code_map_path(BASE_DIR)))
+
+def build_day_pipeline(yyyymmdd, workers, download=None, company2code=None, placement='link', state=None,
+		in_place=False, facts_source='csv', catalog=None):
+	"""1日分のステージをDAGとして組み立てる。downloadを省略した場合は取得済みとみなす。
+	stateを渡すと、各ステージは前回から入力の変わっていない書類・ティッカーを処理しない。
+	catalogを渡すと、各ステージは書き込んだ範囲を目録に反映し、書類・CSVの一覧を目録から引く。
+	in_placeの場合はZIPを展開せず、後続のステージはZIP内のCSVを直接読む。
+	facts_source='xbrl' の場合、ファクトはtype=1のZIPのインスタンス文書から取り込む"""
+	import zipdata2allcsv
+	import yyyymmddallcsv2tickersymbol2data
+	import batch_yahoofinance
+	import yyyymmddaifinanceanalysisfortickersymbol
+	from pipeline import DagScheduler
+	from xbrl_facts_store import FactStore
+
+	assignments = {}
+
+	def map_stage(inputs):
+		code_map = company2code if company2code is not None else inputs[STAGE_CODE_MAP]
+		tickers = yyyymmddallcsv2tickersymbol2data.map_day(BASE_DIR, yyyymmdd, code_map, assignments=assignments,
+			placement=placement, state=state, catalog=catalog)
+		if tickers is None:
+			raise RuntimeError(f'対象ディレクトリが見つかりません: {yyyymmdd}')
+		return tickers
+
+	def facts_stage(_inputs):
+		store = FactStore()
+		try:
+			return store.ingest_day(yyyymmdd, tickers=assignments, state=state, source=facts_source, workers=workers)
+		finally:
+			store.close()
+
+	def yahoo_stage(inputs):
+		if not batch_yahoofinance.run(yyyymmdd, tickers=inputs[STAGE_MAP], workers=workers, catalog=catalog):
+			raise RuntimeError('Yahoo Finance取得対象の読込失敗')
+
+	def analyze_stage(inputs):
+		return yyyymmddaifinanceanalysisfortickersymbol.run(yyyymmdd, tickers=inputs[STAGE_MAP], workers=workers,
+			state=state, catalog=catalog)
+
+	dag = DagScheduler(workers=3)
+	extract_deps = ()
+	if download is not None:
+		dag.add(STAGE_DOWNLOAD, lambda _inputs: download(yyyymmdd))
+		extract_deps = (STAGE_DOWNLOAD,)
+	map_deps = (STAGE_EXTRACT,)
+	if company2code is None:
+		# コードマップの読込はダウンロード・解凍と並行して実行する
+		dag.add(STAGE_CODE_MAP, lambda _inputs: load_code_map())
+		map_deps = (STAGE_EXTRACT, STAGE_CODE_MAP)
+	dag.add(STAGE_EXTRACT, lambda _inputs: zipdata2allcsv.main(yyyymmdd, in_place=in_place, catalog=catalog),
+		extract_deps)
+	dag.add(STAGE_MAP, map_stage, map_deps)
+	dag.add(STAGE_FACTS, facts_stage, (STAGE_MAP,))
+	dag.add(STAGE_YAHOO, yahoo_stage, (STAGE_MAP,))
+	dag.add(STAGE_ANALYZE, analyze_stage, (STAGE_MAP, STAGE_YAHOO))
+	return dag
+
+def open_state(dates, force=False):
+	"""ステージごとの処理済み台帳を開く。forceの場合は対象日の記録を消して全件処理し直す"""
+	from stage_state import StageState, default_state_path
+	import yyyymmddaifinanceanalysisfortickersymbol
+	state = StageState(default_state_path(BASE_DIR))
+	if force:
+		for d in dates:
+			state.reset(date=d)
+		state.reset(yyyymmddaifinanceanalysisfortickersymbol.STATE_STAGE)
+	return state
+
+def open_catalog():
+	"""data配下の目録を開く（各ステージが書き込みのたびに更新する）"""
+	from data_catalog import DataCatalog, default_catalog_path
+	return DataCatalog(default_catalog_path(BASE_DIR))
+
+def run_day(yyyymmdd, workers, rate, placement='link', force=False, in_place=False, xbrl=False):
+	import_stages()
+	import edinet2data2zipdata
+	from edinet_downloader import EdinetClient
+	from download_manifest import DownloadManifest, default_manifest_path
+
+	api_key = os.environ.get('EDINET_API_KEY')
+	if not api_key:
+		logging.error('EDINET_API_KEY 環境変数が設定されていません。')
+		sys.exit(1)
+	date_str = edinet2data2zipdata.to_api_date(yyyymmdd)
+	if not date_str:
+		logging.error('日付はyyyymmdd形式で指定してください')
+		sys.exit(1)
+
+	client = EdinetClient(workers=workers, rate=rate)
+	manifest = DownloadManifest(default_manifest_path(BASE_DIR))
+	state = open_state([yyyymmdd], force)
+	catalog = open_catalog()
+	try:
+		dag = build_day_pipeline(
+			yyyymmdd, workers,
+			download=lambda d: edinet2data2zipdata.download_day(client, date_str, api_key, manifest, xbrl=xbrl),
+			placement=placement, state=state, in_place=in_place, facts_source='xbrl' if xbrl else 'csv',
+			catalog=catalog)
+		dag.run()
+	finally:
+		catalog.close()
+		state.close()
+		manifest.close()
+		client.close()
+	if dag.failed:
+		logging.error(f'失敗: {", ".join(dag.failed)}')
+		sys.exit(1)
+
+def iter_dates(date_from, date_to):
+	start = datetime.strptime(date_from, '%Y%m%d')
+	end = datetime.strptime(date_to, '%Y%m%d')
+	while start <= end:
+		yield start.strftime('%Y%m%d')
+		start += timedelta(days=1)
+
+def run_range(date_from, date_to, workers, rate, placement='link', force=False, in_place=False, xbrl=False):
+	"""期間内の各日を1プロセスで処理する。書類一覧は並列取得し、
+	N+1日目のダウンロードとN日目の解凍以降の処理を並行させる。"""
+	import_stages()
+	import edinet2data2zipdata
+	from edinet_downloader import EdinetClient
+	from download_manifest import DownloadManifest, default_manifest_path
+
+	try:
+		dates = list(iter_dates(date_from, date_to))
+	except ValueError:
+		logging.error('日付はyyyymmdd形式で指定してください')
+		sys.exit(1)
+	if not dates:
+		logging.error(f'期間が不正です: {date_from} - {date_to}')
+		sys.exit(1)
+
+	api_key = os.environ.get('EDINET_API_KEY')
+	if not api_key:
+		logging.error('EDINET_API_KEY 環境変数が設定されていません。')
 		sys.exit(1)
-	yyyymmdd = sys.argv[1]
 
-	# 1. EDINETデータ取得・ZIP保存
-	run_step(f'uv run src/scripts/edinet2data2zipdata.py {yyyymmdd}', 'EDINETデータ取得・ZIP保存')
+	# 証券コードマッピングは全日で共有
+	try:
+		company2code = load_code_map()
+	except Exception as e:
+		logging.error(f'マッピングExcel読込失敗: {e}')
+		sys.exit(1)
+
+	client = EdinetClient(workers=workers, rate=rate)
+	manifest = DownloadManifest(default_manifest_path(BASE_DIR))
+	state = open_state(dates, force)
+	catalog = open_catalog()
+	listing_pool = ThreadPoolExecutor(max_workers=workers)
+	# 書類一覧は全日分を先行して並列取得（レート制限はクライアント側で共有）
+	listings = {
+		d: listing_pool.submit(edinet2data2zipdata.fetch_document_list, client, edinet2data2zipdata.to_api_date(d), api_key)
+		for d in dates
+	}
+	downloaded = queue.Queue(maxsize=2)
+	# 処理側が例外・中断で先に抜けた場合に、ダウンロード側が満杯のキューで待ち続けないよう止める
+	stop = threading.Event()
+
+	def hand_over(item) -> bool:
+		while not stop.is_set():
+			try:
+				downloaded.put(item, timeout=0.5)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def download_worker():
+		for d in dates:
+			if stop.is_set():
+				return
+			try:
+				df = listings[d].result()
+				edinet2data2zipdata.download_day(client, edinet2data2zipdata.to_api_date(d), api_key, manifest, df=df,
+					xbrl=xbrl)
+				ok = True
+			except Exception as e:
+				logging.error(f'ダウンロード失敗: {d}: {e}')
+				ok = False
+			if not hand_over((d, ok)):
+				return
+		hand_over(None)
 
-	# 2. ZIP解凍（全ZIPを解凍して削除）
-	run_step(f'uv run src/scripts/zipdata2allcsv.py {yyyymmdd}', 'ZIP解凍・削除')
+	started = time.perf_counter()
+	failed_days = []
+	downloader = threading.Thread(target=download_worker, daemon=True)
+	downloader.start()
+	try:
+		done = 0
+		while True:
+			item = downloaded.get()
+			if item is None:
+				break
+			d, ok = item
+			if ok:
+				logging.info(f'=== {d} ===')
+				dag = build_day_pipeline(d, workers, company2code=company2code, placement=placement, state=state,
+					in_place=in_place, facts_source='xbrl' if xbrl else 'csv', catalog=catalog)
+				dag.run()
+				ok = not dag.failed
+			if not ok:
+				failed_days.append(d)
+			done += 1
+			elapsed = time.perf_counter() - started
+			eta = elapsed / done * (len(dates) - done)
+			logging.info(f'進捗: {done}/{len(dates)} 日 ({d}), 経過 {elapsed:.0f} 秒, 残り推定 {eta:.0f} 秒')
+	finally:
+		stop.set()
+		downloader.join()
+		listing_pool.shutdown(cancel_futures=True)
+		catalog.close()
+		state.close()
+		manifest.close()
+		client.close()
 
-	# 3. CSVを証券コードディレクトリにコピー
-	run_step(f'uv run src/scripts/yyyymmddallcsv2tickersymbol2data.py {yyyymmdd}', 'CSVを証券コードディレクトリにコピー')
+	if failed_days:
+		logging.error(f'失敗した日付: {", ".join(failed_days)}')
+		sys.exit(1)
+
+def run_watch(yyyymmdd, interval, workers, rate, placement='link'):
+	"""書類一覧を定期的に確認し、新着書類だけをダウンロード→解凍→割当→AI分析に流し続ける"""
+	import_stages()
+	import edinet_watch
 
+	api_key = os.environ.get('EDINET_API_KEY')
+	if not api_key:
+		logging.error('EDINET_API_KEY 環境変数が設定されていません。')
+		sys.exit(1)
+	edinet_watch.watch(api_key, date=yyyymmdd, interval=interval, workers=workers, rate=rate, placement=placement)
 
-	# 4. Yahoo Finance財務データ一括取得
-	run_step(f'python src/scripts/batch_yahoofinance.py {yyyymmdd}', 'Yahoo Finance財務データ一括取得')
+def main():
+	parser = argparse.ArgumentParser(description='EDINETデータ取得からAI分析までを日付指定で一括実行')
+	parser.add_argument('date', nargs='?', help='対象日 yyyymmdd')
+	parser.add_argument('--from', dest='date_from', help='期間指定の開始日 yyyymmdd')
+	parser.add_argument('--to', dest='date_to', help='期間指定の終了日 yyyymmdd（省略時は開始日と同じ）')
+	parser.add_argument('--workers', type=int, default=4, help='同時ダウンロード数・銘柄単位の並列数')
+	parser.add_argument('--rate', type=float, default=2.0, help='EDINETへの最大リクエスト数/秒')
+	parser.add_argument('--placement', choices=('link', 'copy', 'manifest'), default=None,
+		help='証券コードディレクトリへのCSVの配置方法（link: ハードリンク / copy: コピー / manifest: 参照のみ記録。'
+			'既定: link、--in-place指定時はmanifest）')
+	parser.add_argument('--in-place', action='store_true',
+		help='ZIPを展開せずに残し、以降の処理はZIP内のCSVを直接読む（監視モードでは未対応）')
+	parser.add_argument('--xbrl', action='store_true',
+		help='type=1のZIPも取得し、ファクトはXBRLのインスタンス文書から取り込む（監視モードでは未対応）')
+	parser.add_argument('--force', action='store_true', help='前回から変更のない書類・ティッカーも処理し直す')
+	parser.add_argument('--watch', action='store_true', help='新着書類を監視し、提出され次第取得・分析し続ける（日付省略時は当日）')
+	parser.add_argument('--interval', type=float, default=60.0, help='監視モードでの書類一覧の確認間隔（秒）')
+	import_stages()
+	import instrumentation
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+	# 展開しない場合は参照のみ記録すればCSVを一度も書き出さずに済む
+	placement = args.placement or ('manifest' if args.in_place else 'link')
 
-	# 5. AI財務分析一括処理
-	run_step(f'python src/scripts/yyyymmddaifinanceanalysisfortickersymbol.py {yyyymmdd}', 'AI財務分析一括処理')
+	try:
+		if args.watch:
+			if args.in_place or args.xbrl:
+				logging.warning('監視モードは --in-place / --xbrl に未対応のため、type=5のZIPを展開して処理します')
+			run_watch(args.date, args.interval, args.workers, args.rate, placement)
+		elif args.date_from:
+			run_range(args.date_from, args.date_to or args.date_from, args.workers, args.rate, placement, args.force,
+				args.in_place, args.xbrl)
+		elif args.date:
+			run_day(args.date, args.workers, args.rate, placement, args.force, args.in_place, args.xbrl)
+		else:
+			print('使い方: python main.py yyyymmdd | python main.py --from yyyymmdd --to yyyymmdd | python main.py --watch')
+			sys.exit(1)
+	finally:
+		instrumentation.log_summary()
 
 	logging.info('全処理完了')
 
@@ -0,0 +1,205 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from instrumentation import REGISTRY
+
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+SYSTEM_PROMPT = 'あなたは財務分析の専門家です。'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS analyses (
+	key TEXT PRIMARY KEY,
+	model TEXT NOT NULL,
+	result TEXT NOT NULL,
+	prompt_tokens INTEGER,
+	completion_tokens INTEGER,
+	created_at TEXT NOT NULL
+)
+'''
+
+
+def default_cache_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'ai_analysis_cache.sqlite')
+
+
+def cache_key(model: str, prompt: str) -> str:
+	return hashlib.sha256(f'{model}\0{SYSTEM_PROMPT}\0{prompt}'.encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+	"""トークン数の概算（英数字は約4文字で1トークン、日本語は1文字1トークン程度）"""
+	ascii_chars = sum(1 for c in text if ord(c) < 128)
+	return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+class AnalysisCache:
+	"""hash(model, prompt) をキーにした分析結果のキャッシュ（SQLite）"""
+
+	def __init__(self, path: str):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute(SCHEMA)
+		self._conn.commit()
+
+	def get(self, model: str, prompt: str) -> Optional[str]:
+		with self._lock:
+			row = self._conn.execute('SELECT result FROM analyses WHERE key = ?', (cache_key(model, prompt),)).fetchone()
+		return row[0] if row else None
+
+	def put(self, model: str, prompt: str, result: str, prompt_tokens: Optional[int] = None,
+			completion_tokens: Optional[int] = None) -> None:
+		with self._lock, self._conn:
+			self._conn.execute(
+				'INSERT OR REPLACE INTO analyses (key, model, result, prompt_tokens, completion_tokens, created_at) '
+				'VALUES (?, ?, ?, ?, ?, ?)',
+				(cache_key(model, prompt), model, result, prompt_tokens, completion_tokens,
+					datetime.now().isoformat(timespec='seconds')))
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+class MinuteLimiter:
+	"""1分あたりの上限（リクエスト数・トークン数）を守るトークンバケット（asyncio用）"""
+
+	def __init__(self, per_minute: float):
+		self.capacity = float(per_minute)
+		self.rate = per_minute / 60.0
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self._lock = asyncio.Lock()
+
+	async def acquire(self, amount: float = 1.0) -> None:
+		if self.capacity <= 0:
+			return
+		amount = min(amount, self.capacity)
+		async with self._lock:
+			while True:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= amount:
+					self.tokens -= amount
+					return
+				await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AnalysisEngine:
+	"""OpenAI互換APIで複数銘柄の分析を非同期に並列実行するエンジン。
+	base_url（または環境変数 OPENAI_BASE_URL）を指定するとローカルのモックサーバーにも接続できる。"""
+
+	def __init__(self, model: str = DEFAULT_MODEL, concurrency: int = 8, rpm: float = 500, tpm: float = 200000,
+			max_retries: int = 5, backoff: float = 1.0, completion_tokens: int = 1024,
+			cache: Optional[AnalysisCache] = None, api_key: Optional[str] = None, base_url: Optional[str] = None):
+		self.model = model
+		self.concurrency = max(1, concurrency)
+		self.rpm = rpm
+		self.tpm = tpm
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.completion_tokens = completion_tokens
+		self.cache = cache
+		self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+		self.base_url = base_url or os.getenv('OPENAI_BASE_URL')
+		self.stats = {'cached': 0, 'requested': 0, 'retries': 0, 'failed': 0}
+
+	async def _complete(self, client, prompt: str) -> Tuple[str, Optional[int], Optional[int]]:
+		import openai
+		retryable = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+		for attempt in range(self.max_retries + 1):
+			await self._rpm.acquire()
+			await self._tpm.acquire(estimate_tokens(SYSTEM_PROMPT + prompt) + self.completion_tokens)
+			start = time.perf_counter()
+			try:
+				response = await client.chat.completions.create(
+					model=self.model,
+					messages=[{'role': 'system', 'content': SYSTEM_PROMPT},
+							  {'role': 'user', 'content': prompt}])
+			except retryable as e:
+				REGISTRY.observe('ai_request_seconds', time.perf_counter() - start, model=self.model, status='retryable_error')
+				if attempt >= self.max_retries:
+					raise
+				self.stats['retries'] += 1
+				REGISTRY.inc('ai_retries_total', model=self.model)
+				wait = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+				retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('retry-after')
+				if retry_after:
+					try:
+						wait = max(wait, float(retry_after))
+					except ValueError:
+						pass
+				logging.warning(f'AI分析APIエラーのため {wait:.1f} 秒後に再試行 ({attempt + 1}/{self.max_retries}): {e}')
+				await asyncio.sleep(wait)
+				continue
+			REGISTRY.observe('ai_request_seconds', time.perf_counter() - start, model=self.model, status='ok')
+			usage = response.usage
+			if usage:
+				REGISTRY.inc('ai_tokens_total', usage.prompt_tokens or 0, model=self.model, kind='prompt')
+				REGISTRY.inc('ai_tokens_total', usage.completion_tokens or 0, model=self.model, kind='completion')
+			return (response.choices[0].message.content or '',
+				usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
+		raise RuntimeError('unreachable')
+
+	async def _analyze(self, client, semaphore, name: str, prompt: str) -> str:
+		if self.cache:
+			cached = self.cache.get(self.model, prompt)
+			if cached is not None:
+				self.stats['cached'] += 1
+				REGISTRY.inc('ai_cache_total', result='hit')
+				return cached
+			REGISTRY.inc('ai_cache_total', result='miss')
+		async with semaphore:
+			self.stats['requested'] += 1
+			result, prompt_tokens, completion_tokens = await self._complete(client, prompt)
+		if self.cache:
+			self.cache.put(self.model, prompt, result, prompt_tokens, completion_tokens)
+		logging.info(f'AI分析完了: {name}')
+		return result
+
+	async def analyze_many(self, prompts: Dict[str, str]) -> Dict[str, str]:
+		"""{名前: プロンプト} を並列に分析し、成功した分の {名前: 結果} を返す"""
+		if not self.api_key:
+			raise RuntimeError('OPENAI_API_KEYが環境変数に設定されていません')
+		import openai
+		self._rpm = MinuteLimiter(self.rpm)
+		self._tpm = MinuteLimiter(self.tpm)
+		semaphore = asyncio.Semaphore(self.concurrency)
+		# 再試行はエンジン側で行う
+		client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+		try:
+			names = list(prompts)
+			outcomes = await asyncio.gather(
+				*(self._analyze(client, semaphore, name, prompts[name]) for name in names), return_exceptions=True)
+		finally:
+			await client.close()
+		results = {}
+		for name, outcome in zip(names, outcomes):
+			if isinstance(outcome, BaseException):
+				self.stats['failed'] += 1
+				REGISTRY.inc('ai_analyses_total', status='failed')
+				logging.error(f'AI分析失敗: {name}: {outcome}')
+			else:
+				REGISTRY.inc('ai_analyses_total', status='ok')
+				results[name] = outcome
+		return results
+
+	def run(self, prompts: Dict[str, str]) -> Dict[str, str]:
+		start = time.perf_counter()
+		results = asyncio.run(self.analyze_many(prompts))
+		logging.info(f'AI財務分析: {len(results)}/{len(prompts)} 件成功 (キャッシュ {self.stats["cached"]} 件, '
+					 f'API {self.stats["requested"]} 件, 再試行 {self.stats["retries"]} 回), '
+					 f'{time.perf_counter() - start:.2f} 秒')
+		return results
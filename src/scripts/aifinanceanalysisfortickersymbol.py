@@ -1,58 +1,56 @@
 import os
-import pandas as pd
-import openai
 import argparse
 
-def read_all_csv_files(ticker_dir):
-	"""指定ディレクトリ内のすべてのCSVファイルをDataFrame化"""
+import instrumentation
+from ai_analysis_engine import AnalysisEngine, DEFAULT_MODEL
+from csv_loader import read_csv
+from prompt_builder import DEFAULT_TOKEN_BUDGET, build_ticker_prompt
+from ticker_placement import iter_ticker_csvs
+
+def read_all_csv_files(ticker_dir, nrows=None):
+	"""指定ディレクトリ内のすべてのCSVファイル（マニフェストで参照するCSVを含む）をDataFrame化（nrows指定時は先頭行のみ読む）"""
 	data = {}
-	encodings = ["utf-8", "utf-8-sig", "shift_jis", "cp932", "latin1"]
-	for fname in os.listdir(ticker_dir):
-		if fname.lower().endswith('.csv'):
-			path = os.path.join(ticker_dir, fname)
-			for enc in encodings:
-				try:
-					df = pd.read_csv(path, encoding=enc, on_bad_lines='skip')
-					data[fname] = df
-					break
-				except Exception as e:
-					last_error = e
-			else:
-				print(f"{path} の読み込み失敗: {last_error}")
+	for fname, path in iter_ticker_csvs(ticker_dir):
+		try:
+			data[fname] = read_csv(path, nrows=nrows)
+		except Exception as e:
+			print(f"{path} の読み込み失敗: {e}")
 	return data
 
-def analyze_with_gpt(prompt, model="gpt-3.5-turbo"):
+def analyze_with_gpt(prompt, model=DEFAULT_MODEL):
 	api_key = os.getenv("OPENAI_API_KEY")
 	if not api_key:
 		raise RuntimeError("OPENAI_API_KEYが環境変数に設定されていません")
-	openai.api_key = api_key
-	response = openai.ChatCompletion.create(
-		model=model,
-		messages=[{"role": "system", "content": "あなたは財務分析の専門家です。"},
-				  {"role": "user", "content": prompt}]
-	)
-	return response.choices[0].message.content
+	results = AnalysisEngine(model=model, concurrency=1, api_key=api_key).run({"prompt": prompt})
+	if "prompt" not in results:
+		raise RuntimeError("ChatGPT APIの呼び出しに失敗しました")
+	return results["prompt"]
+
+def load_ticker_prompt(ticker, data_dir="data", token_budget=DEFAULT_TOKEN_BUDGET, model=DEFAULT_MODEL, catalog=None):
+	"""data_dir/<ticker> の主要財務データから分析用のプロンプトを組み立てる（トークン上限内）"""
+	ticker_dir = os.path.join(data_dir, ticker)
+	if not os.path.isdir(ticker_dir):
+		raise FileNotFoundError(f"{ticker_dir} ディレクトリが存在しません")
+	return build_ticker_prompt(ticker, ticker_dir, token_budget=token_budget, model=model, catalog=catalog)
+
+def analyze_ticker(ticker, data_dir="data"):
+	"""data_dir/<ticker> のCSVをまとめてChatGPTで分析し、結果の文字列を返す"""
+	return analyze_with_gpt(load_ticker_prompt(ticker, data_dir))
 
 def main():
 		parser = argparse.ArgumentParser(description="指定ティッカーのCSVをChatGPTで財務分析")
 		parser.add_argument("ticker", type=str, nargs="?", default="2168.T", help="ティッカー名（例: 7203.T）")
+		instrumentation.add_arguments(parser)
 		args = parser.parse_args()
+		instrumentation.configure_from_args(args)
 
 		ticker_dir = os.path.join("data", args.ticker)
 		if not os.path.isdir(ticker_dir):
 			print(f"{ticker_dir} ディレクトリが存在しません")
 			return
 
-		data = read_all_csv_files(ticker_dir)
-
-		# すべてのCSVのプレビューをまとめて1つのプロンプトに
-		prompt_parts = []
-		for fname, df in data.items():
-			csv_preview = df.head(10).to_csv()
-			prompt_parts.append(f"--- {fname} ---\n{csv_preview}")
-		prompt = f"以下は{args.ticker}の複数財務データです。各CSVの内容を総合して財務分析を日本語で要約してください。\n\n" + '\n\n'.join(prompt_parts)
 		try:
-			result = analyze_with_gpt(prompt)
+			result = analyze_ticker(args.ticker)
 			print(result)
 		except Exception as e:
 			print(f"ChatGPT APIエラー: {e}")
@@ -1,42 +1,88 @@
 import os
 import sys
-import subprocess
 import logging
+import argparse
+
+import instrumentation
+from pipeline import map_parallel
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-def main():
-    if len(sys.argv) < 2:
-        print('使い方: python batch_yahoofinance.py yyyymmdd')
-        sys.exit(1)
-    yyyymmdd = sys.argv[1]
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    day_dir = os.path.join(base_dir, 'data', yyyymmdd)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def load_tickers(yyyymmdd):
+    """指定日付のcompany_code_map.csvから証券コードを取得（見つからなければNone）"""
+    day_dir = os.path.join(BASE_DIR, 'data', yyyymmdd)
     if not os.path.isdir(day_dir):
         logging.error(f'対象ディレクトリが見つかりません: {day_dir}')
-        sys.exit(1)
+        return None
 
-    # 指定日付のcompany_code_map.csvから証券コードを取得
     import pandas as pd
     csv_path = os.path.join(day_dir, 'company_code_map.csv')
     if not os.path.exists(csv_path):
         logging.error(f'company_code_map.csvが見つかりません: {csv_path}')
-        sys.exit(1)
+        return None
     df = pd.read_csv(csv_path)
     codes = df['証券コード'].astype(str).unique()
-    tickers = [f'{code}.T' for code in codes]
+    return [f'{code}.T' for code in codes]
+
+def fetch_tickers(tickers, workers=4, provider=None, ttl_hours=None, force=False, catalog=None):
+    """各ティッカーの財務データを1プロセス内のスレッドプールで取得する。
+    セッションは全銘柄で共有し、キャッシュ（保存済みCSV）がTTL内のデータセットは取得しない。
+    catalog（DataCatalog）を渡すと保存したティッカーディレクトリを目録に反映する"""
+    from yahoofinance2data import YFinanceProvider, fetch_fundamentals, stale_datasets
+    output_dir = os.path.join(BASE_DIR, 'data')
+    provider = provider or YFinanceProvider()
+
+    pending = [t for t in tickers if stale_datasets(os.path.join(output_dir, t), ttl_hours, force)]
+    logging.info(f'Yahoo Finance取得対象: {len(pending)}/{len(tickers)} 件（残りはキャッシュ有効）')
+    stocks = provider.tickers(pending) if hasattr(provider, 'tickers') else {}
+
+    def fetch(ticker):
+        logging.info(f'Yahoo Finance取得: {ticker}')
+        fetched = fetch_fundamentals(ticker, output_dir=output_dir, provider=provider, ttl_hours=ttl_hours,
+                                     force=force, stock=stocks.get(ticker))
+        if catalog is not None and fetched:
+            catalog.sync_ticker(os.path.join(output_dir, ticker))
+        return ticker
+
+    return map_parallel(fetch, pending, workers=workers, desc='Yahoo Finance取得')
+
+def run(yyyymmdd, tickers=None, workers=4, ttl_hours=None, force=False, catalog=None):
+    """指定日付の銘柄の財務データを取得する。tickersを渡した場合はcompany_code_map.csvを読まない"""
+    if tickers is None:
+        tickers = load_tickers(yyyymmdd)
+        if tickers is None:
+            return False
     if not tickers:
         logging.warning('証券コードが見つかりません')
-        sys.exit(0)
+        return True
+    fetch_tickers(tickers, workers=workers, ttl_hours=ttl_hours, force=force, catalog=catalog)
+    return True
 
-    for ticker in tickers:
-        logging.info(f'Yahoo Finance取得: {ticker}')
-        cmd = f'uv run src/scripts/yahoofinance2data.py {ticker}'
-        result = subprocess.run(cmd, shell=True)
-        if result.returncode != 0:
-            logging.error(f'取得失敗: {ticker}')
-        else:
-            logging.info(f'取得完了: {ticker}')
+def main():
+    from yahoofinance2data import parse_ttl
+    parser = argparse.ArgumentParser(description='指定日付の銘柄の財務データをYahoo Financeから一括取得')
+    parser.add_argument('date', help='対象日 yyyymmdd')
+    parser.add_argument('--workers', type=int, default=4, help='同時取得数')
+    parser.add_argument('--force', action='store_true', help='キャッシュの有効期間内でも取得し直す')
+    parser.add_argument('--ttl', action='append', help='データセットごとのキャッシュ有効期間（時間） 例: info=6')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    try:
+        ttl_hours = parse_ttl(args.ttl)
+    except ValueError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    from data_catalog import DataCatalog, default_catalog_path
+    catalog = DataCatalog(default_catalog_path(BASE_DIR))
+    try:
+        ok = run(args.date, workers=args.workers, ttl_hours=ttl_hours, force=args.force, catalog=catalog)
+    finally:
+        catalog.close()
+    if not ok:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,215 @@
+import os
+import json
+import pickle
+import re
+import hashlib
+import logging
+import unicodedata
+from typing import TYPE_CHECKING, Optional, Dict, Tuple
+
+if TYPE_CHECKING:
+	# 実行時のpandasの読込は使う関数の中で行う（型注釈のみ）
+	import pandas as pd
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.path.join(BASE_DIR, 'data', '.cache')
+
+# キャッシュ形式を変えたら上げる（古いキャッシュは再構築される）
+CACHE_VERSION = 2
+
+
+# 会社名の前後から除く表記（表記ごとに先頭→末尾の順で1回ずつ除く）
+_NAME_AFFIXES = ('株式会社', '(株)', '（株）')
+# 会社名から除く文字（空白類・アンダースコア・中点・ドット・ハイフン・スラッシュ等）を1回の置換で除く
+_NAME_REMOVE = re.compile('[' + re.escape(' \t\n\r_･・　.．-−/／') + ']')
+# str.isdigit() が真になる文字のうち、正規表現の \d（Unicodeの10進数字）に含まれずNFKCでも変わらないもの
+_EXTRA_DIGITS = ('\u1369-\u1371\u19da\u24f5-\u24fd\u24ff\u2776-\u277e\u2780-\u2788\u278a-\u2792'
+	'\U00010a40-\U00010a43\U00010e60-\U00010e68\U00011052-\U0001105a')
+_NON_DIGIT = re.compile(f'[^\\d{_EXTRA_DIGITS}]')
+
+
+def normalize_name(name: str) -> str:
+	"""会社名の比較用に正規化 (全角→半角、空白/記号除去、大小無視、(株)/株式会社の前後除去)"""
+	if name is None:
+		return ''
+	s = unicodedata.normalize('NFKC', str(name))
+	for mark in _NAME_AFFIXES:
+		if s.startswith(mark):
+			s = s[len(mark):]
+		if s.endswith(mark):
+			s = s[:-len(mark)]
+	return _NAME_REMOVE.sub('', s).lower()
+
+
+def normalize_code(code: str) -> Optional[str]:
+	"""コード文字列から最初の4桁の数字を抽出（全角数字にも対応）。"""
+	if not code:
+		return None
+	digits = _NON_DIGIT.sub('', unicodedata.normalize('NFKC', str(code)))
+	if len(digits) >= 4:
+		return digits[:4]
+	return None
+
+
+def _map_unique(values: 'pd.Series', func, missing) -> 'pd.Series':
+	"""値の種類ごとに1回だけfuncを適用し、元のindexのSeriesで返す（欠損値はmissing）"""
+	import numpy as np
+	import pandas as pd
+	codes, uniques = pd.factorize(values, use_na_sentinel=True)
+	# 欠損値のコード -1 は末尾の missing を指す
+	table = np.array([func(u) for u in uniques] + [missing], dtype=object)
+	return pd.Series(table[codes], index=values.index, dtype=object)
+
+
+def normalize_names(names: 'pd.Series') -> 'pd.Series':
+	"""normalize_name のSeries版。JPXマスタ全体やフォルダ名一覧を1回で正規化する（欠損値は空文字）"""
+	return _map_unique(names, normalize_name, '')
+
+
+def normalize_codes(codes: 'pd.Series') -> 'pd.Series':
+	"""normalize_code のSeries版（4桁に満たない値・欠損値はNone）"""
+	return _map_unique(codes, normalize_code, None)
+
+
+def parse_company_code_map(xls_path: str) -> Dict[str, str]:
+	"""会社名→4桁証券コードのマッピングをExcel（またはJPXのCSV）から読み込む。
+	列名は自動判定（証券コード・会社名）。"""
+	import pandas as pd
+	if xls_path.lower().endswith('.csv'):
+		df = pd.read_csv(xls_path, encoding='shift_jis', dtype=str)
+	else:
+		# Excel読み込み（JPX公式は1枚目のシート）
+		df = pd.read_excel(xls_path, sheet_name=0)
+	headers = [str(h).strip() for h in df.columns]
+
+	name_keys = [
+		'company', 'Company', 'company_name', 'CompanyName', 'name', 'Name', 'filerName', 'issuerName',
+		'発行体名', '提出者名', '銘柄名', '企業名', '会社名', '上場会社名', '上場銘柄名', '正式名称', '正式名', 'Company Name'
+	]
+	code_keys = [
+		'code', 'Code', 'secCode', '証券コード', '銘柄コード', 'コード', 'Local Code', '証券コード(4桁)'
+	]
+
+	def find_key(candidates):
+		for c in candidates:
+			for h in headers:
+				if c == h or c in h:
+					return h
+		return None
+
+	name_col = find_key(name_keys)
+	code_col = find_key(code_keys)
+	if not name_col or not code_col:
+		raise ValueError(f"Excelの列名が解釈できません。ヘッダー: {headers}")
+
+	# 全行をまとめて正規化する（会社名が空・コードが4桁に満たない行は除く。同じ会社名は後の行を優先）
+	companies = df[name_col].astype(object).where(df[name_col].notna(), '').astype(str).str.strip()
+	codes = normalize_codes(df[code_col].astype(object).where(df[code_col].notna(), '').astype(str).str.strip())
+	valid = (companies != '') & codes.notna()
+	return dict(zip(normalize_names(companies[valid]), codes[valid]))
+
+
+def file_sha256(path: str, block_size: int = 65536) -> str:
+	hasher = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			hasher.update(block)
+	return hasher.hexdigest()
+
+
+def cache_path_for(source_path: str) -> str:
+	name = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()[:16]
+	return os.path.join(CACHE_DIR, f'code_master_{name}.pickle')
+
+
+def load_company_code_map(xls_path: str, use_cache: bool = True) -> Dict[str, str]:
+	"""正規化済み会社名→証券コードのマッピング。
+	元ファイルの更新日時・サイズ（不一致時はSHA-256）が変わらない限りpickleキャッシュから読む。"""
+	if not os.path.exists(xls_path):
+		raise FileNotFoundError(f"マッピングExcelが見つかりません: {xls_path}")
+	if not use_cache:
+		return parse_company_code_map(xls_path)
+
+	st = os.stat(xls_path)
+	cache_path = cache_path_for(xls_path)
+	cached = None
+	try:
+		with open(cache_path, 'rb') as f:
+			cached = pickle.load(f)  # nosec B301: 自プロセスが書き出したローカルキャッシュ
+	except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+		cached = None
+
+	digest = None
+	if isinstance(cached, dict) and cached.get('version') == CACHE_VERSION:
+		if cached['mtime_ns'] == st.st_mtime_ns and cached['size'] == st.st_size:
+			return cached['mapping']
+		# 更新日時だけが変わった場合（コピー・touch等）は内容のハッシュで判定
+		digest = file_sha256(xls_path)
+		if cached['sha256'] == digest:
+			_write_cache(cache_path, st, digest, cached['mapping'])
+			return cached['mapping']
+
+	logging.info(f'証券コードマスタを再構築: {xls_path}')
+	mapping = parse_company_code_map(xls_path)
+	_write_cache(cache_path, st, digest or file_sha256(xls_path), mapping)
+	return mapping
+
+
+def _write_cache(cache_path: str, st: os.stat_result, digest: str, mapping: Dict[str, str]) -> None:
+	os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+	tmp_path = cache_path + '.part'
+	try:
+		with open(tmp_path, 'wb') as f:
+			pickle.dump({
+				'version': CACHE_VERSION,
+				'mtime_ns': st.st_mtime_ns,
+				'size': st.st_size,
+				'sha256': digest,
+				'mapping': mapping,
+			}, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, cache_path)
+	except OSError as e:
+		logging.warning(f'証券コードマスタのキャッシュ保存失敗: {e}')
+
+
+def refresh_source(url: str, dest_path: str, session=None, timeout: float = 30.0) -> Tuple[bool, str]:
+	"""ETag/Last-Modifiedによる条件付きGETでマスタファイルを更新する。
+	戻り値は (更新されたか, 保存先パス)。304の場合はダウンロードしない。"""
+	meta_path = dest_path + '.meta.json'
+	meta: Dict[str, str] = {}
+	if os.path.exists(dest_path) and os.path.exists(meta_path):
+		try:
+			with open(meta_path, encoding='utf-8') as f:
+				meta = json.load(f)
+		except (OSError, ValueError):
+			meta = {}
+	headers = {}
+	if meta.get('etag'):
+		headers['If-None-Match'] = meta['etag']
+	if meta.get('last_modified'):
+		headers['If-Modified-Since'] = meta['last_modified']
+
+	import requests
+	http = session or requests
+	res = http.get(url, headers=headers, timeout=timeout)
+	if res.status_code == 304:
+		logging.info(f'更新なし（304）: {url}')
+		return False, dest_path
+	res.raise_for_status()
+
+	os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+	tmp_path = dest_path + '.part'
+	with open(tmp_path, 'wb') as f:
+		f.write(res.content)
+	os.replace(tmp_path, dest_path)
+	with open(meta_path, 'w', encoding='utf-8') as f:
+		json.dump({
+			'url': url,
+			'etag': res.headers.get('ETag', ''),
+			'last_modified': res.headers.get('Last-Modified', ''),
+		}, f, ensure_ascii=False)
+	logging.info(f'ダウンロード完了: {url} → {dest_path}')
+	return True, dest_path
@@ -0,0 +1,74 @@
+import os
+import codecs
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import filing_archive
+
+
+# 判定に使う先頭バイト数
+SNIFF_BYTES = 64 * 1024
+
+_cache: Dict[Tuple[str, int, int], Tuple[str, str]] = {}
+_cache_lock = threading.Lock()
+
+
+def _detect_encoding(sample: bytes) -> str:
+	"""BOMと先頭バイトから文字コードを判定する"""
+	if sample.startswith(codecs.BOM_UTF8):
+		return 'utf-8-sig'
+	if sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+		return 'utf-16'
+	# BOMなしUTF-16（ASCII部分の上位バイトが0になる）
+	if sample:
+		odd_nuls = sample[1::2].count(0)
+		even_nuls = sample[0::2].count(0)
+		if odd_nuls > len(sample) // 4 and even_nuls == 0:
+			return 'utf-16-le'
+		if even_nuls > len(sample) // 4 and odd_nuls == 0:
+			return 'utf-16-be'
+	for enc in ('utf-8', 'cp932'):
+		try:
+			sample.decode(enc)
+			return enc
+		except UnicodeDecodeError as e:
+			# 先頭バイトの切り出しでマルチバイト文字が途中で切れた場合は許容する
+			if e.start >= len(sample) - 4 and len(sample) >= SNIFF_BYTES:
+				return enc
+	return 'latin1'
+
+
+def _detect_delimiter(text: str) -> str:
+	first_line = text.split('\n', 1)[0]
+	return '\t' if first_line.count('\t') > first_line.count(',') else ','
+
+
+def detect_format(path: str) -> Tuple[str, str]:
+	"""(文字コード, 区切り文字) を返す。ファイルのパス・更新日時・サイズごとに判定結果をキャッシュする。
+	ZIP内のメンバー（filing_archiveの仮想パス）も展開せずに判定する"""
+	size, mtime_ns = filing_archive.stat(path)
+	key = (os.path.abspath(path), mtime_ns, size)
+	with _cache_lock:
+		cached = _cache.get(key)
+	if cached:
+		return cached
+	with filing_archive.open_binary(path) as f:
+		sample = f.read(SNIFF_BYTES)
+	encoding = _detect_encoding(sample)
+	text = sample.decode(encoding, errors='ignore')
+	result = (encoding, _detect_delimiter(text))
+	with _cache_lock:
+		_cache[key] = result
+	return result
+
+
+def read_csv(path: str, usecols: Optional[Sequence] = None, nrows: Optional[int] = None, **kwargs):
+	"""文字コード・区切り文字を判定してから1回だけ読み込む。nrows/usecolsで必要な行・列のみ読む"""
+	import pandas as pd
+	encoding, sep = detect_format(path)
+	if filing_archive.is_member_path(path):
+		with filing_archive.open_binary(path) as f:
+			return pd.read_csv(f, encoding=encoding, sep=sep, usecols=usecols, nrows=nrows,
+				on_bad_lines='skip', **kwargs)
+	return pd.read_csv(path, encoding=encoding, sep=sep, usecols=usecols, nrows=nrows,
+		on_bad_lines='skip', **kwargs)
@@ -0,0 +1,464 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import filing_archive
+import instrumentation
+from instrumentation import REGISTRY, span
+from pipeline import map_parallel
+from ticker_placement import MANIFEST_FILENAME, load_manifest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# data配下の目録。各ステージが書き込んだ範囲（日付・ティッカー単位）をその都度置き換えて最新に保つ。
+# パイプラインの外での書き込みに備え、範囲ごとに走査前のディレクトリの更新日時（stamp）を持ち、参照時に変わっていれば読み直す
+# days: 目録に載せた日付（stampはdata/yyyymmddの更新日時）
+# filings: data/yyyymmdd直下の書類（展開済みフォルダ・ZIP）
+# tickers: 目録に載せたティッカーディレクトリ（ファイルが0件でも載せる。stampは配下のディレクトリとマニフェストの更新日時）
+# files: ティッカーディレクトリ内のファイル。kindは file（実体） / manifest（マニフェスト自体） / ref（マニフェストの参照）。
+#        refのpathはZIP内のメンバーを指す場合がある（filing_archiveの仮想パス）。digestはBLAKE2（未計算ならNULL）
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS days (
+	date TEXT PRIMARY KEY,
+	stamp TEXT,
+	updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS filings (
+	date TEXT NOT NULL,
+	name TEXT NOT NULL,
+	path TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	updated_at TEXT NOT NULL,
+	PRIMARY KEY (date, name)
+);
+CREATE TABLE IF NOT EXISTS tickers (
+	ticker TEXT PRIMARY KEY,
+	stamp TEXT,
+	updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+	ticker TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	name TEXT NOT NULL,
+	path TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	nlink INTEGER NOT NULL,
+	digest TEXT,
+	PRIMARY KEY (ticker, kind, name)
+);
+CREATE INDEX IF NOT EXISTS files_path ON files(path);
+'''
+
+FILE_COLUMNS = ['ticker', 'kind', 'name', 'path', 'size', 'mtime_ns', 'nlink', 'digest']
+
+DATE_DIR = re.compile(r'^\d{8}$')
+
+# (名前, パス, 種別, サイズ, 更新日時ns)
+FilingRow = Tuple[str, str, str, int, int]
+# (種別, 名前, パス, サイズ, 更新日時ns, リンク数)
+FileRow = Tuple[str, str, str, int, int, int]
+
+
+def default_catalog_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'catalog.sqlite')
+
+
+def is_ticker_dir_name(name: str) -> bool:
+	return name.endswith('.T')
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+	try:
+		return os.stat(path).st_mtime_ns
+	except OSError:
+		return None
+
+
+def day_stamp(day_dir: str) -> Optional[str]:
+	"""日付ディレクトリの更新日時（書類の追加・解凍・削除で変わる）。ディレクトリがなければNone"""
+	mtime_ns = _mtime_ns(day_dir)
+	return None if mtime_ns is None else str(mtime_ns)
+
+
+def _ticker_stamp(dirs: Dict[str, Optional[int]], manifest_mtime_ns: Optional[int]) -> str:
+	return json.dumps({'dirs': dirs, 'manifest': manifest_mtime_ns}, sort_keys=True)
+
+
+def ticker_stamp(ticker_dir: str, stamp: str) -> Optional[str]:
+	"""記録したstampと同じディレクトリについて、現在の更新日時からstampを求める。
+	ファイルの追加・削除・置換（os.replace）はディレクトリの、マニフェストへの追記はマニフェストの更新日時に現れる"""
+	try:
+		dirs = json.loads(stamp)['dirs']
+	except (TypeError, ValueError, KeyError):
+		return None
+	current = {rel: _mtime_ns(os.path.join(ticker_dir, rel) if rel else ticker_dir) for rel in dirs}
+	return _ticker_stamp(current, _mtime_ns(os.path.join(ticker_dir, MANIFEST_FILENAME)))
+
+
+def scan_day(day_dir: str) -> List[FilingRow]:
+	"""data/yyyymmdd直下の書類を列挙する（list_filingsと同じく展開済みフォルダを優先）"""
+	rows = []
+	for name, path in filing_archive.list_filings(day_dir).items():
+		try:
+			st = os.stat(path)
+		except OSError as e:
+			logging.error(f'書類の参照失敗: {path} : {e}')
+			continue
+		kind = 'zip' if filing_archive.is_archive(path) else 'dir'
+		rows.append((name, path, kind, st.st_size if kind == 'zip' else 0, st.st_mtime_ns))
+	return rows
+
+
+def scan_ticker(ticker_dir: str) -> Tuple[Optional[str], List[FileRow]]:
+	"""ティッカーディレクトリ配下のファイルとマニフェストの参照を列挙する（名前はディレクトリからの相対パス）。
+	走査前に取ったstamp（ディレクトリがなければNone）と一緒に返す（走査中の変更は次回の参照時に読み直される）"""
+	rows = []
+	dirs: Dict[str, Optional[int]] = {}
+	manifest_mtime_ns = _mtime_ns(os.path.join(ticker_dir, MANIFEST_FILENAME))
+	# os.walkと同じ順序・扱い（ディレクトリへのシンボリックリンクはたどらない）で、一覧を読む前に更新日時を取る
+	pending = ['']
+	while pending:
+		rel_dir = pending.pop(0)
+		cur = os.path.join(ticker_dir, rel_dir) if rel_dir else ticker_dir
+		try:
+			dirs[rel_dir] = os.stat(cur).st_mtime_ns
+			entries = sorted(os.scandir(cur), key=lambda e: e.name)
+		except OSError:
+			continue
+		for entry in entries:
+			rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+			try:
+				is_dir = entry.is_dir()
+			except OSError:
+				is_dir = False
+			if is_dir:
+				if not entry.is_symlink():
+					pending.append(rel)
+				continue
+			try:
+				st = os.stat(entry.path)
+			except OSError as e:
+				logging.error(f'ファイル処理失敗: {entry.path} : {e}')
+				continue
+			kind = 'manifest' if rel == MANIFEST_FILENAME else 'file'
+			rows.append((kind, rel, entry.path, st.st_size, st.st_mtime_ns, st.st_nlink))
+	if not dirs:
+		return None, rows
+	stamp = _ticker_stamp(dirs, manifest_mtime_ns)
+	for placed_name, entry in sorted(load_manifest(ticker_dir).items()):
+		path = str(entry['path'])
+		if not os.path.isabs(path):
+			path = os.path.normpath(os.path.join(ticker_dir, path))
+		try:
+			size, mtime_ns = filing_archive.stat(path)
+		except (OSError, KeyError) as e:
+			logging.error(f'参照先の処理失敗: {path} : {e}')
+			continue
+		# 参照は実体を持たないためリンク数0
+		rows.append(('ref', placed_name, path, size, mtime_ns, 0))
+	return stamp, rows
+
+
+class DataCatalog:
+	"""data配下の書類・ティッカーディレクトリのファイルの目録（SQLite）。
+	スクリプトはディレクトリを走査せずに目録を引く。目録にない日付・ティッカーはNoneを返すので、呼び出し側は
+	ディスクを直接読む。目録はステージが書き込むたびに範囲ごとトランザクションで置き換え、rebuildで全体を作り直す"""
+
+	def __init__(self, path: str, data_dir: Optional[str] = None):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self.data_dir = os.path.abspath(data_dir or os.path.dirname(path))
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.executescript(SCHEMA)
+		# stamp列のない目録（以前の形式）は列を足す。stampのない範囲は古いものとして参照時に読み直す
+		columns = [row[1] for row in self._conn.execute('PRAGMA table_info(tickers)')]
+		if 'stamp' not in columns:
+			self._conn.execute('ALTER TABLE tickers ADD COLUMN stamp TEXT')
+
+	def _ticker_of(self, ticker_dir: str) -> Optional[str]:
+		"""data直下のティッカーディレクトリならティッカー名、それ以外（ベンチマーク用の一時ディレクトリ等）はNone"""
+		ticker_dir = os.path.abspath(ticker_dir)
+		if os.path.dirname(ticker_dir) != self.data_dir:
+			return None
+		return os.path.basename(ticker_dir)
+
+	def _replace_day(self, date: str, stamp: Optional[str], rows: Iterable[FilingRow], now: str) -> None:
+		self._conn.execute('DELETE FROM filings WHERE date = ?', (date,))
+		self._conn.executemany(
+			'INSERT INTO filings (date, name, path, kind, size, mtime_ns, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+			((date, *row, now) for row in rows))
+		self._conn.execute('INSERT OR REPLACE INTO days (date, stamp, updated_at) VALUES (?, ?, ?)', (date, stamp, now))
+
+	def _replace_ticker(self, ticker: str, stamp: Optional[str], rows: Iterable[FileRow], now: str,
+			digests: Dict[str, Tuple[int, int, str]]) -> None:
+		"""ティッカーのファイルを置き換える。サイズ・更新日時が変わっていないファイルのハッシュは引き継ぐ"""
+		previous = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in self._conn.execute(
+			'SELECT path, size, mtime_ns, digest FROM files WHERE ticker = ? AND digest IS NOT NULL', (ticker,))}
+		self._conn.execute('DELETE FROM files WHERE ticker = ?', (ticker,))
+		records = []
+		for kind, name, path, size, mtime_ns, nlink in rows:
+			known = previous.get(path) or digests.get(path)
+			digest = known[2] if known and known[0] == size and known[1] == mtime_ns else None
+			records.append((ticker, kind, name, path, size, mtime_ns, nlink, digest))
+		self._conn.executemany(f'INSERT INTO files ({", ".join(FILE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', records)
+		self._conn.execute('INSERT OR REPLACE INTO tickers (ticker, stamp, updated_at) VALUES (?, ?, ?)',
+			(ticker, stamp, now))
+
+	def _scan_day(self, date: str) -> Tuple[Optional[str], List[FilingRow]]:
+		day_dir = os.path.join(self.data_dir, date)
+		stamp = day_stamp(day_dir)
+		return stamp, scan_day(day_dir) if stamp is not None else []
+
+	def sync_day(self, date: str) -> int:
+		"""data/yyyymmddを読み直して目録を更新する（解凍・ダウンロード後に呼ぶ）。書類数を返す"""
+		stamp, rows = self._scan_day(date)
+		now = datetime.now().isoformat(timespec='seconds')
+		with self._lock, self._conn:
+			if stamp is not None:
+				self._replace_day(date, stamp, rows, now)
+			else:
+				self._conn.execute('DELETE FROM filings WHERE date = ?', (date,))
+				self._conn.execute('DELETE FROM days WHERE date = ?', (date,))
+		return len(rows)
+
+	def sync_ticker(self, ticker_dir: str) -> Optional[int]:
+		"""ティッカーディレクトリを読み直して目録を更新する（配置・取得・重複削除の後に呼ぶ）。ファイル数を返す"""
+		ticker = self._ticker_of(ticker_dir)
+		if ticker is None:
+			return None
+		stamp, rows = scan_ticker(ticker_dir)
+		now = datetime.now().isoformat(timespec='seconds')
+		with self._lock, self._conn:
+			if stamp is not None:
+				self._replace_ticker(ticker, stamp, rows, now, {})
+			else:
+				self._conn.execute('DELETE FROM files WHERE ticker = ?', (ticker,))
+				self._conn.execute('DELETE FROM tickers WHERE ticker = ?', (ticker,))
+		return len(rows)
+
+	def rebuild(self, workers: int = 8, digests: Optional[Dict[str, Tuple[int, int, str]]] = None) -> Dict[str, int]:
+		"""data配下を並列に走査して目録を作り直す。digests（パス→(サイズ, 更新日時ns, ハッシュ)）を渡すと、
+		変更のないファイルのハッシュとして引き継ぐ"""
+		entries = sorted(os.listdir(self.data_dir)) if os.path.isdir(self.data_dir) else []
+		dates = [e for e in entries if DATE_DIR.match(e) and os.path.isdir(os.path.join(self.data_dir, e))]
+		tickers = [e for e in entries if is_ticker_dir_name(e) and os.path.isdir(os.path.join(self.data_dir, e))]
+		day_rows = map_parallel(lambda d: self._scan_day(d), dates, workers=workers,
+			desc='目録再構築（書類）')
+		ticker_rows = map_parallel(lambda t: scan_ticker(os.path.join(self.data_dir, t)), tickers, workers=workers,
+			desc='目録再構築（ティッカー）')
+		now = datetime.now().isoformat(timespec='seconds')
+		with self._lock, self._conn:
+			# 走査に失敗した範囲は目録から外し、次回の参照時にディスクを読ませる
+			for (date,) in self._conn.execute('SELECT date FROM days UNION SELECT DISTINCT date FROM filings').fetchall():
+				if date not in day_rows:
+					self._conn.execute('DELETE FROM filings WHERE date = ?', (date,))
+					self._conn.execute('DELETE FROM days WHERE date = ?', (date,))
+			for (ticker,) in self._conn.execute('SELECT ticker FROM tickers').fetchall():
+				if ticker not in ticker_rows:
+					self._conn.execute('DELETE FROM files WHERE ticker = ?', (ticker,))
+					self._conn.execute('DELETE FROM tickers WHERE ticker = ?', (ticker,))
+			for date, (stamp, rows) in day_rows.items():
+				self._replace_day(date, stamp, rows, now)
+			for ticker, (stamp, rows) in ticker_rows.items():
+				self._replace_ticker(ticker, stamp, rows, now, digests or {})
+		return {'dates': len(day_rows), 'filings': sum(len(rows) for _stamp, rows in day_rows.values()),
+			'tickers': len(ticker_rows), 'files': sum(len(rows) for _stamp, rows in ticker_rows.values())}
+
+	def _current_day(self, date: str) -> bool:
+		"""日付が目録にあればTrue。記録したstampから変わっていれば（パイプラインの外で書き込まれた等）読み直す"""
+		with self._lock:
+			row = self._conn.execute('SELECT stamp FROM days WHERE date = ?', (date,)).fetchone()
+		if row is None:
+			return False
+		if row[0] is None or row[0] != day_stamp(os.path.join(self.data_dir, date)):
+			REGISTRY.inc('catalog_rescans_total', scope='day')
+			self.sync_day(date)
+			with self._lock:
+				return self._conn.execute('SELECT 1 FROM days WHERE date = ?', (date,)).fetchone() is not None
+		return True
+
+	def _current_ticker(self, ticker_dir: str) -> Optional[str]:
+		"""目録にあるティッカーディレクトリならティッカー名（stampが変わっていれば読み直す）、なければNone"""
+		ticker = self._ticker_of(ticker_dir)
+		if ticker is None:
+			return None
+		with self._lock:
+			row = self._conn.execute('SELECT stamp FROM tickers WHERE ticker = ?', (ticker,)).fetchone()
+		if row is None:
+			return None
+		if row[0] is None or ticker_stamp(ticker_dir, row[0]) != row[0]:
+			REGISTRY.inc('catalog_rescans_total', scope='ticker')
+			self.sync_ticker(ticker_dir)
+			return ticker if self.has_ticker(ticker) else None
+		return ticker
+
+	def refresh(self, workers: int = 8) -> int:
+		"""data直下のティッカーディレクトリのうち、目録にないもの・stampが変わったものを並列に読み直し、
+		なくなったものを目録から外す（全ティッカーを引く前に呼ぶ）。読み直した件数を返す"""
+		entries = sorted(os.listdir(self.data_dir)) if os.path.isdir(self.data_dir) else []
+		tickers = [e for e in entries if is_ticker_dir_name(e) and os.path.isdir(os.path.join(self.data_dir, e))]
+		with self._lock:
+			stamps = dict(self._conn.execute('SELECT ticker, stamp FROM tickers').fetchall())
+		stale = [t for t in tickers if stamps.get(t) is None
+			or ticker_stamp(os.path.join(self.data_dir, t), stamps[t]) != stamps[t]]
+		stale += sorted(set(stamps) - set(tickers))
+		if stale:
+			REGISTRY.inc('catalog_rescans_total', len(stale), scope='ticker')
+			map_parallel(lambda t: self.sync_ticker(os.path.join(self.data_dir, t)), stale, workers=workers,
+				desc='目録更新（ティッカー）')
+		return len(stale)
+
+	def filings(self, date: str) -> Optional[Dict[str, str]]:
+		"""書類名→実体（list_filingsと同じ形）。目録にない日付・書類のない日付はNone"""
+		if not self._current_day(date):
+			return None
+		with self._lock:
+			rows = self._conn.execute('SELECT name, path FROM filings WHERE date = ? ORDER BY name', (date,)).fetchall()
+		return dict(rows) if rows else None
+
+	def has_ticker(self, ticker: str) -> bool:
+		with self._lock:
+			return self._conn.execute('SELECT 1 FROM tickers WHERE ticker = ?', (ticker,)).fetchone() is not None
+
+	def ticker_files(self, ticker: Optional[str] = None) -> List[Dict[str, object]]:
+		"""ティッカーディレクトリのファイルと参照（マニフェスト自体を除く）。tickerを省略すると全ティッカー
+		（ディスクとの突き合わせはしないので、先にrefreshを呼ぶ）"""
+		sql = f"SELECT {', '.join(FILE_COLUMNS)} FROM files WHERE kind != 'manifest'"
+		params: List[str] = []
+		if ticker is not None:
+			sql += ' AND ticker = ?'
+			params.append(ticker)
+		with self._lock:
+			rows = self._conn.execute(sql + ' ORDER BY ticker, kind, name', params).fetchall()
+		return [dict(zip(FILE_COLUMNS, row)) for row in rows]
+
+	def ticker_csvs(self, ticker_dir: str) -> Optional[List[Tuple[str, str]]]:
+		"""iter_ticker_csvsと同じ (ファイル名, パス) の並び。目録にないディレクトリはNone"""
+		ticker = self._current_ticker(ticker_dir)
+		if ticker is None:
+			return None
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT kind, name, path FROM files WHERE ticker = ? AND kind IN ('file', 'ref')", (ticker,)).fetchall()
+		files = sorted((name, path) for kind, name, path in rows
+			if kind == 'file' and os.sep not in name and name.lower().endswith('.csv'))
+		refs = sorted((name, path) for kind, name, path in rows if kind == 'ref')
+		return files + refs
+
+	def fingerprint(self, ticker_dir: str, extra: str = '') -> Optional[str]:
+		"""stage_state.fingerprint_paths([ticker_dir], extra) と同じ値を目録から求める。目録にないディレクトリはNone。
+		ファイルの追加・削除はstampで、その場での書き換え（ディレクトリの更新日時が変わらない）は各ファイルのstatで検知する"""
+		ticker = self._current_ticker(ticker_dir)
+		if ticker is None:
+			return None
+		sql = "SELECT name, size, mtime_ns FROM files WHERE ticker = ? AND kind IN ('file', 'manifest')"
+		with self._lock:
+			rows = self._conn.execute(sql, (ticker,)).fetchall()
+		for name, size, mtime_ns in rows:
+			try:
+				st = os.stat(os.path.join(ticker_dir, name))
+			except OSError:
+				st = None
+			if st is None or st.st_size != size or st.st_mtime_ns != mtime_ns:
+				REGISTRY.inc('catalog_rescans_total', scope='ticker')
+				self.sync_ticker(ticker_dir)
+				with self._lock:
+					rows = self._conn.execute(sql, (ticker,)).fetchall()
+				break
+		hasher = hashlib.sha1(extra.encode('utf-8'))
+		for name, size, mtime_ns in sorted(rows):
+			hasher.update(f'{name}\0{size}\0{mtime_ns}\n'.encode('utf-8'))
+		return hasher.hexdigest()
+
+	def digests(self) -> Dict[str, Tuple[int, int, str]]:
+		"""パス→(サイズ, 更新日時ns, ハッシュ)（計算済みのもののみ）"""
+		with self._lock:
+			rows = self._conn.execute('SELECT path, size, mtime_ns, digest FROM files WHERE digest IS NOT NULL').fetchall()
+		return {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+
+	def set_digests(self, rows: Iterable[Tuple[str, int, int, str]]) -> None:
+		"""(パス, サイズ, 更新日時ns, ハッシュ) を記録する（サイズ・更新日時が目録と一致する行のみ）"""
+		with self._lock, self._conn:
+			self._conn.executemany('UPDATE files SET digest = ? WHERE path = ? AND size = ? AND mtime_ns = ?',
+				((digest, path, size, mtime_ns) for path, size, mtime_ns, digest in rows))
+
+	def summary(self) -> Dict[str, Dict[str, int]]:
+		with self._lock:
+			days = self._conn.execute('SELECT date, COUNT(*) FROM filings GROUP BY date ORDER BY date').fetchall()
+			files = self._conn.execute(
+				"SELECT COUNT(DISTINCT ticker), COUNT(*), COALESCE(SUM(CASE WHEN kind = 'file' THEN size END), 0), "
+				"COUNT(digest) FROM files WHERE kind != 'manifest'").fetchone()
+			tickers = self._conn.execute('SELECT COUNT(*) FROM tickers').fetchone()[0]
+		return {'filings': dict(days), 'files': {'tickers': tickers, 'tickers_with_files': files[0], 'files': files[1],
+			'bytes': files[2], 'digests': files[3]}}
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='data配下の書類・ティッカーディレクトリの目録（SQLite）を管理する')
+	parser.add_argument('command', choices=('rebuild', 'status'),
+		help='rebuild: ディスクを並列に走査して作り直す / status: 目録と処理済み台帳の件数を表示する')
+	parser.add_argument('date', nargs='?', help='status: 処理済み台帳を表示する日付 yyyymmdd')
+	parser.add_argument('--workers', type=int, default=8, help='rebuild: 走査のスレッド数')
+	parser.add_argument('--db', default=default_catalog_path(BASE_DIR), help='目録のSQLiteファイル')
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+
+	catalog = DataCatalog(args.db, os.path.join(BASE_DIR, 'data'))
+	try:
+		if args.command == 'rebuild':
+			from hash_index import HashIndex, default_index_path
+			# 重複検出で計算済みのハッシュを引き継ぐ
+			digests = catalog.digests()
+			if os.path.exists(default_index_path(BASE_DIR)):
+				index = HashIndex(default_index_path(BASE_DIR))
+				try:
+					digests.update(index.load())
+				finally:
+					index.close()
+			with span('目録再構築') as event:
+				counts = catalog.rebuild(workers=args.workers, digests=digests)
+				event.update(counts)
+			logging.info(f'目録再構築: 日付 {counts["dates"]} 件, 書類 {counts["filings"]} 件, '
+				f'ティッカー {counts["tickers"]} 件, ファイル {counts["files"]} 件')
+			return
+		from stage_state import StageState, default_state_path
+		summary = catalog.summary()
+		for date, n in summary['filings'].items():
+			print(f'{date}: 書類 {n} 件')
+		files = summary['files']
+		print(f'ティッカー {files["tickers"]} 件, ファイル・参照 {files["files"]} 件, {files["bytes"]:,} bytes, '
+			f'ハッシュ計算済み {files["digests"]} 件')
+		state = StageState(default_state_path(BASE_DIR))
+		try:
+			stages: Dict[str, int] = {}
+			for stage in ('map', 'facts', 'analyze'):
+				stages[stage] = len(state.items(stage, args.date))
+		finally:
+			state.close()
+		print('処理済み' + (f'（{args.date}）' if args.date else '') + ': '
+			+ ', '.join(f'{stage} {n} 件' for stage, n in stages.items()))
+	finally:
+		catalog.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -1,49 +1,220 @@
 import os
-import hashlib
 import logging
+import argparse
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from hash_index import HashIndex, default_index_path
+from data_catalog import DataCatalog, default_catalog_path
+import instrumentation
+from instrumentation import REGISTRY, span
+from pipeline import map_parallel
+from ticker_placement import MANIFEST_FILENAME, content_digest, load_manifest, logical_name, remove_manifest_entries
+import filing_archive
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-def file_hash(path, block_size=65536):
-	hasher = hashlib.md5()
-	with open(path, 'rb') as f:
-		for block in iter(lambda: f.read(block_size), b''):
-			hasher.update(block)
-	return hasher.hexdigest()
 
-def main():
-	base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-	data_dir = os.path.join(base_dir, 'data')
-	if not os.path.isdir(data_dir):
-		logging.error(f'dataディレクトリが見つかりません: {data_dir}')
-		return
+class FileEntry(NamedTuple):
+	ticker: str
+	path: str
+	size: int
+	mtime_ns: int
+	nlink: int
+	# マニフェストの参照（ZIP内のメンバー等）の場合は配置名。削除はマニフェストから参照を外す
+	manifest_name: str = ''
 
-	deleted_total = 0
-	# data直下のXXXX.Tディレクトリのみ処理
-	for name in os.listdir(data_dir):
+
+def scan_ticker_files(data_dir: str) -> List[FileEntry]:
+	"""data直下のXXXX.Tディレクトリ内のファイルとマニフェストの参照を列挙する"""
+	entries = []
+	for name in sorted(os.listdir(data_dir)):
 		dir_path = os.path.join(data_dir, name)
 		if not (os.path.isdir(dir_path) and name.endswith('.T')):
 			continue
-		seen = dict()  # {(filename, size, hash): path}
-		deleted = 0
 		for cur, _dirs, files in os.walk(dir_path):
 			for fn in files:
+				if fn == MANIFEST_FILENAME:
+					continue
 				path = os.path.join(cur, fn)
 				try:
-					size = os.path.getsize(path)
-					h = file_hash(path)
-					key = (fn, size, h)
-					if key in seen:
-						logging.info(f'重複ファイル削除: {path}')
-						os.remove(path)
-						deleted += 1
-					else:
-						seen[key] = path
-				except Exception as e:
+					st = os.stat(path)
+				except OSError as e:
 					logging.error(f'ファイル処理失敗: {path} : {e}')
-		logging.info(f'{name} ディレクトリの重複削除件数: {deleted}')
-		deleted_total += deleted
-	logging.info(f'全XXXX.Tディレクトリの重複削除合計: {deleted_total}')
+					continue
+				entries.append(FileEntry(name, path, st.st_size, st.st_mtime_ns, st.st_nlink))
+		for placed_name, manifest_entry in sorted(load_manifest(dir_path).items()):
+			path = str(manifest_entry['path'])
+			if not os.path.isabs(path):
+				path = os.path.normpath(os.path.join(dir_path, path))
+			try:
+				size, mtime_ns = filing_archive.stat(path)
+			except (OSError, KeyError) as e:
+				logging.error(f'参照先の処理失敗: {path} : {e}')
+				continue
+			# 参照は実体を持たないため、外しても容量は空かない（nlink=0）
+			entries.append(FileEntry(name, path, size, mtime_ns, 0, placed_name))
+	return entries
+
+
+def catalog_ticker_files(catalog: DataCatalog) -> List[FileEntry]:
+	"""scan_ticker_filesと同じ内容を目録から返す（ディレクトリを走査しない）"""
+	return [FileEntry(row['ticker'], row['path'], row['size'], row['mtime_ns'], row['nlink'],
+		row['name'] if row['kind'] == 'ref' else '') for row in catalog.ticker_files()]
+
+
+def is_current(entry: FileEntry) -> bool:
+	"""ファイルのサイズ・更新日時が列挙した時点から変わっていなければTrue"""
+	try:
+		st = os.stat(entry.path)
+	except OSError:
+		return False
+	return st.st_size == entry.size and st.st_mtime_ns == entry.mtime_ns
+
+
+def hash_candidates(entries: List[FileEntry], index: HashIndex, workers: int = 4,
+		catalog: Optional[DataCatalog] = None) -> Dict[str, str]:
+	"""同じサイズのファイルが他にあるものだけハッシュを求める（索引に記録済みで変更がなければ再計算しない）。
+	catalogを渡すと目録のハッシュも使い、求めたハッシュを目録に記録する"""
+	by_size: Dict[int, List[FileEntry]] = defaultdict(list)
+	for entry in entries:
+		by_size[entry.size].append(entry)
+	candidates = [e for group in by_size.values() if len(group) > 1 for e in group]
+
+	known = index.load()
+	# 消えたファイルの記録は索引から除く
+	index.remove(set(known) - {e.path for e in entries})
+	if catalog is not None:
+		known = {**catalog.digests(), **known}
+	digests: Dict[str, str] = {}
+	to_hash = []
+	for entry in candidates:
+		cached = known.get(entry.path)
+		if cached and cached[0] == entry.size and cached[1] == entry.mtime_ns:
+			digests[entry.path] = cached[2]
+		else:
+			to_hash.append(entry)
+
+	hashed = map_parallel(lambda e: content_digest(e.path), to_hash, workers=workers, desc='ハッシュ計算')
+	index.store((e.path, e.size, e.mtime_ns, hashed[e]) for e in to_hash if e in hashed)
+	if catalog is not None:
+		catalog.set_digests((e.path, e.size, e.mtime_ns, hashed[e]) for e in to_hash if e in hashed)
+	digests.update((e.path, hashed[e]) for e in to_hash if e in hashed)
+	REGISTRY.inc('dedup_hashed_bytes_total', sum(e.size for e in to_hash if e in hashed))
+	REGISTRY.inc('dedup_hash_index_total', len(candidates) - len(to_hash), result='hit')
+	REGISTRY.inc('dedup_hash_index_total', len(to_hash), result='miss')
+	logging.info(f'ファイル {len(entries)} 件中 同サイズの候補 {len(candidates)} 件, '
+				 f'新規ハッシュ計算 {len(hashed)} 件, 索引から再利用 {len(candidates) - len(to_hash)} 件')
+	return digests
+
+
+def find_duplicates(entries: List[FileEntry], digests: Dict[str, str]) -> Tuple[List[Tuple[FileEntry, str]], Dict[str, Set[str]]]:
+	"""同一ディレクトリ内の重複（削除対象, 残すファイル）と、複数ティッカーにまたがる内容（ハッシュ→ティッカー）を返す。
+	重複は同じファイル名（内容ハッシュを除く）・サイズ・内容のもの。financials.csvとcashflow.csvのように
+	別のデータがたまたま同じ内容（空のDataFrame等）でも消さない"""
+	groups: Dict[Tuple[str, str, int, str], List[FileEntry]] = defaultdict(list)
+	tickers_by_digest: Dict[str, Set[str]] = defaultdict(set)
+	for entry in entries:
+		digest = digests.get(entry.path)
+		if digest is None:
+			continue
+		groups[(entry.ticker, logical_name(entry.manifest_name or entry.path), entry.size, digest)].append(entry)
+		tickers_by_digest[digest].add(entry.ticker)
+
+	duplicates = []
+	for group in groups.values():
+		keep, *rest = sorted(group, key=lambda e: e.path)
+		duplicates.extend((entry, keep.path) for entry in rest)
+	cross = {d: t for d, t in tickers_by_digest.items() if len(t) > 1}
+	return duplicates, cross
+
+
+def main():
+	parser = argparse.ArgumentParser(description='XXXX.Tディレクトリ内の重複ファイルを内容ハッシュで検出・削除する')
+	parser.add_argument('--dry-run', action='store_true', help='削除せずに削減できる容量のみ報告する')
+	parser.add_argument('--workers', type=int, default=4, help='ハッシュ計算のスレッド数')
+	parser.add_argument('--db', default=None, help='ハッシュ索引のパス（既定: data/hash_index.sqlite）')
+	parser.add_argument('--rescan', action='store_true', help='目録を使わずXXXX.Tディレクトリを走査する')
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+
+	base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	data_dir = os.path.join(base_dir, 'data')
+	if not os.path.isdir(data_dir):
+		logging.error(f'dataディレクトリが見つかりません: {data_dir}')
+		return
+
+	index = HashIndex(args.db or default_index_path(base_dir))
+	catalog = DataCatalog(default_catalog_path(base_dir))
+	try:
+		with span('ファイル列挙') as event:
+			from_catalog = not args.rescan
+			if from_catalog:
+				# 目録にない・パイプラインの外で変更されたティッカーディレクトリを読み直してから引く
+				refreshed = catalog.refresh(workers=args.workers)
+				if refreshed:
+					logging.info(f'目録を更新したティッカー: {refreshed} 件')
+				entries = catalog_ticker_files(catalog)
+			else:
+				entries = scan_ticker_files(data_dir)
+			event['files'] = len(entries)
+		with span('ハッシュ計算・重複検出') as event:
+			digests = hash_candidates(entries, index, workers=args.workers, catalog=catalog)
+			duplicates, cross = find_duplicates(entries, digests)
+			event['duplicates'] = len(duplicates)
+
+		deleted: Dict[str, int] = defaultdict(int)
+		reclaimed = 0
+		removed_paths = []
+		removed_refs: Dict[str, List[FileEntry]] = defaultdict(list)
+		for entry, keep_path in duplicates:
+			# ハードリンク（配置時のlinkモード）は削除してもリンクが減るだけで容量は空かない
+			freed = entry.size if entry.nlink == 1 else 0
+			if from_catalog and not entry.manifest_name and not is_current(entry):
+				# 目録の作成後に変更・削除されたファイルは、古いハッシュで消さないよう対象から外す
+				logging.warning(f'目録作成後に変更されたためスキップ: {entry.path}')
+				continue
+			if args.dry_run:
+				logging.info(f'重複ファイル（削除予定）: {entry.path} = {keep_path}')
+			elif entry.manifest_name:
+				removed_refs[entry.ticker].append(entry)
+				logging.info(f'重複する参照をマニフェストから削除: {entry.ticker}/{entry.manifest_name} ({entry.path})')
+			else:
+				try:
+					os.remove(entry.path)
+				except OSError as e:
+					logging.error(f'ファイル処理失敗: {entry.path} : {e}')
+					continue
+				logging.info(f'重複ファイル削除: {entry.path}')
+				removed_paths.append(entry.path)
+			deleted[entry.ticker] += 1
+			reclaimed += freed
+		for ticker, refs in removed_refs.items():
+			try:
+				remove_manifest_entries(os.path.join(data_dir, ticker), [e.manifest_name for e in refs])
+			except OSError as e:
+				logging.error(f'マニフェスト更新失敗: {ticker} : {e}')
+				deleted[ticker] -= len(refs)
+				continue
+			removed_paths.extend(e.path for e in refs)
+		index.remove(removed_paths)
+		if not args.dry_run:
+			for ticker in deleted:
+				catalog.sync_ticker(os.path.join(data_dir, ticker))
+		REGISTRY.inc('dedup_duplicates_total', sum(deleted.values()))
+		REGISTRY.inc('dedup_reclaimed_bytes_total', reclaimed)
+
+		for ticker, count in sorted(deleted.items()):
+			logging.info(f'{ticker} ディレクトリの重複削除件数: {count}')
+		for digest, tickers in sorted(cross.items(), key=lambda item: sorted(item[1])):
+			logging.info(f'複数ティッカーに同一内容のファイル: {", ".join(sorted(tickers))} (blake2b={digest[:12]})')
+		action = '削除予定' if args.dry_run else '削除'
+		logging.info(f'全XXXX.Tディレクトリの重複{action}合計: {sum(deleted.values())} 件, '
+					 f'削減容量 {reclaimed:,} bytes, ティッカー間で重複する内容 {len(cross)} 件')
+	finally:
+		catalog.close()
+		index.close()
 
 if __name__ == '__main__':
 	main()
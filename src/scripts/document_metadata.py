@@ -0,0 +1,61 @@
+import os
+import csv
+from typing import Dict, Iterable, Optional
+
+
+# data/yyyymmdd/document_metadata.csv に保存する書類一覧APIの項目
+METADATA_FILENAME = 'document_metadata.csv'
+METADATA_COLUMNS = ['docID', 'secCode', 'edinetCode', 'fundCode', 'filerName', 'docTypeCode', 'submitDateTime']
+
+
+def _clean(value) -> str:
+	if value is None:
+		return ''
+	s = str(value).strip()
+	return '' if s.lower() in ('none', 'nan') else s
+
+
+def load_document_metadata(day_dir: str) -> Dict[str, Dict[str, str]]:
+	"""docID→書類メタデータ。ファイルがなければ空のdict"""
+	path = os.path.join(day_dir, METADATA_FILENAME)
+	if not os.path.exists(path):
+		return {}
+	with open(path, encoding='utf-8-sig', newline='') as f:
+		return {row['docID']: row for row in csv.DictReader(f) if row.get('docID')}
+
+
+def save_document_metadata(day_dir: str, records: Iterable[Dict[str, object]]) -> str:
+	"""書類メタデータを既存分とdocIDでマージして保存し、保存先パスを返す"""
+	merged = load_document_metadata(day_dir)
+	for record in records:
+		row = {col: _clean(record.get(col)) for col in METADATA_COLUMNS}
+		if row['docID']:
+			merged[row['docID']] = row
+	path = os.path.join(day_dir, METADATA_FILENAME)
+	tmp_path = path + '.part'
+	with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+		w = csv.DictWriter(f, fieldnames=METADATA_COLUMNS, extrasaction='ignore')
+		w.writeheader()
+		w.writerows(sorted(merged.values(), key=lambda r: r['docID']))
+	os.replace(tmp_path, path)
+	return path
+
+
+def doc_id_from_folder(folder_name: str) -> str:
+	"""展開フォルダ名 '{filerName}_{docDescription}_{docID}' の末尾からdocIDを取り出す"""
+	return os.path.splitext(folder_name)[0].rsplit('_', 1)[-1]
+
+
+def code_from_metadata(meta: Optional[Dict[str, str]]) -> Optional[str]:
+	"""secCode（5桁）の先頭4文字を証券コードとして返す。英字入りコード（例: 130A0）もそのまま扱う"""
+	if not meta:
+		return None
+	sec_code = _clean(meta.get('secCode'))
+	if len(sec_code) >= 4:
+		return sec_code[:4]
+	return None
+
+
+def is_fund(meta: Optional[Dict[str, str]]) -> bool:
+	"""ファンド（投資信託等）の書類か。証券コードを持たないため名寄せの対象外"""
+	return bool(meta and _clean(meta.get('fundCode')))
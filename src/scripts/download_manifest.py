@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional, Dict
+
+
+# 状態: 'pending'（ダウンロード中/未完了） / 'done'（保存済み） / 'failed'
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS downloads (
+	doc_id TEXT PRIMARY KEY,
+	output_path TEXT NOT NULL,
+	size INTEGER,
+	sha256 TEXT,
+	status TEXT NOT NULL,
+	error TEXT,
+	updated_at TEXT NOT NULL
+)
+'''
+
+
+def default_manifest_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'download_manifest.sqlite')
+
+
+class DownloadManifest:
+	"""docIDをキーにしたダウンロード台帳（SQLite）。スレッド間で共有可能。"""
+
+	def __init__(self, path: str):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute(SCHEMA)
+		self._conn.commit()
+
+	def get(self, doc_id: str) -> Optional[Dict[str, object]]:
+		with self._lock:
+			cur = self._conn.execute(
+				'SELECT doc_id, output_path, size, sha256, status, error, updated_at FROM downloads WHERE doc_id = ?',
+				(doc_id,))
+			row = cur.fetchone()
+		if row is None:
+			return None
+		keys = ['doc_id', 'output_path', 'size', 'sha256', 'status', 'error', 'updated_at']
+		return dict(zip(keys, row))
+
+	def is_complete(self, doc_id: str) -> bool:
+		"""保存済みで、ZIPか解凍済みフォルダがディスク上に残っている場合にTrue"""
+		entry = self.get(doc_id)
+		if not entry or entry['status'] != 'done':
+			return False
+		output_path = str(entry['output_path'])
+		return os.path.exists(output_path) or os.path.isdir(os.path.splitext(output_path)[0])
+
+	def mark(self, doc_id: str, output_path: str, status: str, size: Optional[int] = None,
+			sha256: Optional[str] = None, error: Optional[str] = None) -> None:
+		now = datetime.now().isoformat(timespec='seconds')
+		with self._lock:
+			self._conn.execute(
+				'INSERT INTO downloads (doc_id, output_path, size, sha256, status, error, updated_at) '
+				'VALUES (?, ?, ?, ?, ?, ?, ?) '
+				'ON CONFLICT(doc_id) DO UPDATE SET output_path=excluded.output_path, size=excluded.size, '
+				'sha256=excluded.sha256, status=excluded.status, error=excluded.error, updated_at=excluded.updated_at',
+				(doc_id, output_path, size, sha256, status, error, now))
+			self._conn.commit()
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
@@ -3,128 +3,188 @@
 import requests
 import pandas as pd
 import os
+import re
 import logging
 from dotenv import load_dotenv
 import argparse
 
+import instrumentation
+from edinet_downloader import EdinetClient, DownloadTask, api_base
+from download_manifest import DownloadManifest, default_manifest_path
+from document_metadata import save_document_metadata
+from xbrl_instance import PACKAGE_TASK_SUFFIX, default_package_dir
 
 
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # .envファイルをルート直下から読み込む
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'))
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, '.env'))
 
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-# APIのエンドポイント
-# url = 'https://disclosure.edinet-fsa.go.jp/api/v2/documents.json'
-url = 'https://disclosure.edinet-fsa.go.jp/api/v2/documents.json'
-
-
-# APIキーは環境変数から取得
-api_key = os.environ.get('EDINET_API_KEY')
-if not api_key:
-    logging.error('EDINET_API_KEY 環境変数が設定されていません。')
-    raise SystemExit(1)
-
-
-# コマンドライン引数で日付指定（yyyymmdd形式）
-parser = argparse.ArgumentParser(description='EDINET APIから指定日付のZIPデータを取得')
-parser.add_argument('date', help='取得日 yyyymmdd 例: 20250821')
-args = parser.parse_args()
 
-# yyyymmdd→yyyy-mm-ddに変換
-input_date = args.date
-if len(input_date) == 8 and input_date.isdigit():
-    date_str = f'{input_date[:4]}-{input_date[4:6]}-{input_date[6:]}'
-else:
-    logging.error('日付はyyyymmdd形式で指定してください')
-    raise SystemExit(1)
-
-params = {
-    'date': date_str,
-    'type': 2,  # 2は有価証券報告書などの決算書類
-    'Subscription-Key': api_key
-}
-
-
-try:
-    response = requests.get(url, params=params, timeout=10)
-    response.raise_for_status()
-except requests.RequestException as e:
-    logging.error(f'APIリクエスト失敗: {e}')
-    raise SystemExit(1)
-
-# レスポンスのJSONデータを取得
-try:
+def sanitize_filename(filename):
+    """ファイル名を安全な形式に変換"""
+    # Windows で使用できない文字を除去・置換
+    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    # 連続するスペースやドットを単一に
+    filename = re.sub(r'[\s\.]+', '_', filename)
+    # 長すぎるファイル名を制限
+    if len(filename) > 200:
+        filename = filename[:200]
+    return filename
+
+
+def to_api_date(input_date):
+    """yyyymmdd→yyyy-mm-ddに変換（不正な形式はNone）"""
+    if len(input_date) == 8 and input_date.isdigit():
+        return f'{input_date[:4]}-{input_date[4:6]}-{input_date[6:]}'
+    return None
+
+
+def fetch_document_list(client, date_str, api_key):
+    """書類一覧APIから指定日の提出書類一覧を取得"""
+    params = {
+        'date': date_str,
+        'type': 2,  # 2は有価証券報告書などの決算書類
+        'Subscription-Key': api_key
+    }
+    response, _ = client.get(f'{api_base()}/documents.json', params=params)
     data = response.json()
-except Exception as e:
-    logging.error(f'JSONデータの取得失敗: {e}')
-    raise SystemExit(1)
-
-# データフレームに変換
-try:
     documents = data.get('results', [])
-    df = pd.DataFrame(documents)
-    print(df.head())
+    return pd.DataFrame(documents)
+
+
+def filter_financial(df):
+    """有価証券報告書のみを抽出"""
     # 特定のカラムだけを選択
     df_filtered = df[['docID', 'secCode','edinetCode', 'filerName', 'docDescription', 'submitDateTime']]
     # 決算情報のみをフィルタリング
-    df_financial = df_filtered[df_filtered['docDescription'].str.contains('有価証券報告書', na=False)]
+    return df_filtered[df_filtered['docDescription'].str.contains('有価証券報告書', na=False)]
+
+
+def build_tasks(df_financial, save_dir, api_key):
+    tasks = []
+    for _, doc in df_financial.iterrows():
+        docID = doc['docID']
+        print(doc['edinetCode'], doc['docID'], doc['filerName'], doc['docDescription'], doc['submitDateTime'], sep='\t')
+        # ファイル名を安全な形式に変換
+        raw_filename = f'{doc["filerName"]}_{doc["docDescription"]}_{docID}'
+        output_filename = sanitize_filename(raw_filename)
+        tasks.append(DownloadTask(
+            doc_id=docID,
+            url=f'{api_base()}/documents/{docID}',
+            output_path=os.path.join(save_dir, f'{output_filename}.zip'),
+            params={'type': '5', 'Subscription-Key': api_key},
+        ))
+    return tasks
+
+
+def build_xbrl_tasks(df_financial, save_dir, api_key):
+    """提出本文書（type=1、XBRLのインスタンス文書を含む）の取得タスク。台帳ではtype=5と別の書類として扱う"""
+    tasks = []
+    for _, doc in df_financial.iterrows():
+        output_filename = sanitize_filename(f'{doc["filerName"]}_{doc["docDescription"]}_{doc["docID"]}')
+        tasks.append(DownloadTask(
+            doc_id=f'{doc["docID"]}{PACKAGE_TASK_SUFFIX}',
+            url=f'{api_base()}/documents/{doc["docID"]}',
+            output_path=os.path.join(save_dir, f'{output_filename}.zip'),
+            params={'type': '1', 'Subscription-Key': api_key},
+        ))
+    return tasks
+
+
+def download_day(client, date_str, api_key, manifest, df=None, xbrl=False):
+    """指定日（yyyy-mm-dd）の有価証券報告書をダウンロードし、スループット集計を返す。
+    dfに取得済みの書類一覧を渡した場合は一覧APIを呼ばない。
+    xbrl=Trueの場合はtype=1のZIPも data/xbrl/yyyymmdd に取得する。"""
+    if df is None:
+        df = fetch_document_list(client, date_str, api_key)
+    print(df.head())
+    if df.empty:
+        logging.info(f'提出書類なし: {date_str}')
+        df_financial = df
+    else:
+        df_financial = filter_financial(df)
     logging.info(f'取得件数: {len(df_financial)}')
     print(df_financial.head())
 
-    # 保存先ディレクトリの作成とCSV保存
-    save_date = params['date'].replace('-', '')  # yyyymmdd形式
-    save_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', save_date)
+    # 保存先ディレクトリの作成
+    save_date = date_str.replace('-', '')  # yyyymmdd形式
+    save_dir = os.path.join(BASE_DIR, 'data', save_date)
     os.makedirs(save_dir, exist_ok=True)
-    save_path = os.path.join(save_dir, 'edinet_financial.csv')
-    # df_financial.to_csv(save_path, index=False, encoding='utf-8-sig')
-
-    import urllib.request
-    import sys
-    import re
-
-    def sanitize_filename(filename):
-        """ファイル名を安全な形式に変換"""
-        # Windows で使用できない文字を除去・置換
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        # 連続するスペースやドットを単一に
-        filename = re.sub(r'[\s\.]+', '_', filename)
-        # 長すぎるファイル名を制限
-        if len(filename) > 200:
-            filename = filename[:200]
-        return filename
-
-    # ドキュメントのダウンロード
-    for index, doc in df_financial.iterrows():
-        docID = doc['docID']
-        url = f'https://api.edinet-fsa.go.jp/api/v2/documents/{docID}?type=5&Subscription-Key={api_key}'
-        
-        print(doc['edinetCode'], doc['docID'], doc['filerName'], doc['docDescription'], doc['submitDateTime'], sep='\t')
 
+    # 証券コード解決用に書類メタデータ（secCode/edinetCode等）を保存
+    if not df_financial.empty:
+        metadata_path = save_document_metadata(save_dir, df.loc[df_financial.index].to_dict('records'))
+        logging.info(f'書類メタデータ保存: {metadata_path}')
+
+    # ドキュメントのダウンロード（台帳で完了済みのdocIDは通信せずスキップ）
+    tasks = build_tasks(df_financial, save_dir, api_key)
+    if xbrl and not df_financial.empty:
+        package_dir = default_package_dir(save_date, BASE_DIR)
+        os.makedirs(package_dir, exist_ok=True)
+        tasks += build_xbrl_tasks(df_financial, package_dir, api_key)
+    _, stats = client.download_all(tasks, manifest=manifest)
+    logging.info(stats.summary())
+    return stats
+
+
+def main():
+    # コマンドライン引数で日付指定（yyyymmdd形式）
+    parser = argparse.ArgumentParser(description='EDINET APIから指定日付のZIPデータを取得')
+    parser.add_argument('date', help='取得日 yyyymmdd 例: 20250821')
+    parser.add_argument('--workers', type=int, default=4, help='同時ダウンロード数')
+    parser.add_argument('--rate', type=float, default=2.0, help='ホストあたりの最大リクエスト数/秒（0で無制限）')
+    parser.add_argument('--max-retries', type=int, default=5, help='429/5xx時の最大リトライ回数')
+    parser.add_argument('--extract', action='store_true', help='ZIPを保存せずXBRL_TO_CSVのCSVのみを直接展開する')
+    parser.add_argument('--xbrl', action='store_true', help='type=1のZIP（XBRLのインスタンス文書）も data/xbrl/yyyymmdd に取得する')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
+    # APIキーは環境変数から取得
+    api_key = os.environ.get('EDINET_API_KEY')
+    if not api_key:
+        logging.error('EDINET_API_KEY 環境変数が設定されていません。')
+        raise SystemExit(1)
+
+    date_str = to_api_date(args.date)
+    if not date_str:
+        logging.error('日付はyyyymmdd形式で指定してください')
+        raise SystemExit(1)
+
+    client = EdinetClient(workers=args.workers, rate=args.rate, max_retries=args.max_retries, extract=args.extract)
+    manifest = DownloadManifest(default_manifest_path(BASE_DIR))
+    try:
         try:
-            # ZIPファイルのダウンロード
-            with urllib.request.urlopen(url) as res:
-                content = res.read()
-            # ファイル名を安全な形式に変換
-            raw_filename = f'{doc["filerName"]}_{doc["docDescription"]}_{docID}'
-            output_filename = sanitize_filename(raw_filename)
-            output_path = os.path.join(save_dir, f'{output_filename}.zip')
-            if os.path.exists(output_path):
-                logging.info(f'既存ファイルのため保存スキップ: {output_path}')
-            else:
-                with open(output_path, 'wb') as file_out:
-                    file_out.write(content)
-                logging.info(f'ZIP保存完了: {output_path}')
-
-        except urllib.error.HTTPError as e:
-            if e.code >= 400:
-                sys.stderr.write(e.reason + '\n')
-            else:
-                raise e
-
-except Exception as e:
-    logging.error(f'データ処理失敗: {e}')
-    raise SystemExit(1)
-
+            df = fetch_document_list(client, date_str, api_key)
+        except requests.RequestException as e:
+            logging.error(f'APIリクエスト失敗: {e}')
+            raise SystemExit(1)
+        except ValueError as e:
+            logging.error(f'JSONデータの取得失敗: {e}')
+            raise SystemExit(1)
 
+        try:
+            download_day(client, date_str, api_key, manifest, df=df, xbrl=args.xbrl)
+        except Exception as e:
+            logging.error(f'データ処理失敗: {e}')
+            raise SystemExit(1)
+        finally:
+            # 保存したZIPを目録に反映する（途中で失敗した場合も保存済みの分は載せる）
+            from data_catalog import DataCatalog, default_catalog_path
+            catalog = DataCatalog(default_catalog_path(BASE_DIR))
+            try:
+                catalog.sync_day(args.date)
+            finally:
+                catalog.close()
+    finally:
+        manifest.close()
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import os
+import time
+import hashlib
+import random
+import shutil
+import logging
+import tempfile
+import threading
+import zipfile
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from download_manifest import DownloadManifest
+from instrumentation import REGISTRY, span
+from zipdata2allcsv import DEFAULT_MEMBER_PATTERN, extract_members
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+# EDINET API v2 のエンドポイント（環境変数 EDINET_API_BASE でスタブサーバ等に差し替え可能）
+DEFAULT_API_BASE = 'https://api.edinet-fsa.go.jp/api/v2'
+
+# リトライ対象のHTTPステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# ストリーミング時の読み書き単位（書類サイズに関わらずメモリ使用量はこの程度で一定）
+CHUNK_SIZE = 256 * 1024
+
+
+def api_base() -> str:
+	return os.environ.get('EDINET_API_BASE', DEFAULT_API_BASE).rstrip('/')
+
+
+def file_sha256(path: str, block_size: int = 65536) -> str:
+	hasher = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			hasher.update(block)
+	return hasher.hexdigest()
+
+
+class RateLimiter:
+	"""ホスト単位のトークンバケット。rate件/秒、burst件まで連続リクエストを許可する。"""
+
+	def __init__(self, rate: float, burst: int = 1):
+		self.rate = rate
+		self.burst = max(1, burst)
+		self._lock = threading.Lock()
+		self._buckets: Dict[str, Tuple[float, float]] = {}  # host -> (tokens, last)
+
+	def acquire(self, host: str) -> None:
+		if self.rate <= 0:
+			return
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				tokens, last = self._buckets.get(host, (float(self.burst), now))
+				tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+				if tokens >= 1.0:
+					self._buckets[host] = (tokens - 1.0, now)
+					return
+				self._buckets[host] = (tokens, now)
+				wait = (1.0 - tokens) / self.rate
+			time.sleep(wait)
+
+
+@dataclass
+class DownloadTask:
+	doc_id: str
+	url: str
+	output_path: str
+	params: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class DownloadResult:
+	doc_id: str
+	output_path: str
+	status: str  # 'downloaded' / 'skipped' / 'failed'
+	bytes: int = 0
+	attempts: int = 0
+	error: Optional[str] = None
+
+
+@dataclass
+class DownloadStats:
+	docs: int = 0
+	skipped: int = 0
+	failures: int = 0
+	bytes: int = 0
+	retries: int = 0
+	elapsed: float = 0.0
+
+	def add(self, result: DownloadResult) -> None:
+		if result.status == 'downloaded':
+			self.docs += 1
+			self.bytes += result.bytes
+		elif result.status == 'skipped':
+			self.skipped += 1
+		else:
+			self.failures += 1
+		self.retries += max(0, result.attempts - 1)
+
+	def summary(self) -> str:
+		elapsed = self.elapsed or 1e-9
+		return (
+			f'ダウンロード {self.docs} 件, スキップ {self.skipped} 件, 失敗 {self.failures} 件, '
+			f'リトライ {self.retries} 回, {self.bytes:,} bytes, {self.elapsed:.2f} 秒 '
+			f'({self.docs / elapsed:.2f} docs/sec, {self.bytes / elapsed:,.0f} bytes/sec)'
+		)
+
+
+class RetryableError(Exception):
+	pass
+
+
+class EdinetClient:
+	"""keep-alive付きの共有セッション・ホスト単位レート制限・指数バックオフを備えたHTTPクライアント"""
+
+	def __init__(self, workers: int = 4, rate: float = 2.0, max_retries: int = 5,
+			backoff: float = 1.0, timeout: float = 60.0, session: Optional[requests.Session] = None,
+			extract: bool = False, member_pattern: str = DEFAULT_MEMBER_PATTERN):
+		self.workers = max(1, workers)
+		# extract=True の場合はZIPを残さず、member_patternに一致するメンバーのみ直接展開する
+		self.extract = extract
+		self.member_pattern = member_pattern
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.limiter = RateLimiter(rate, burst=1)
+		if session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+			session.mount('https://', adapter)
+			session.mount('http://', adapter)
+		self.session = session
+
+	def _sleep_before_retry(self, attempt: int, response: Optional[requests.Response]) -> None:
+		delay = self.backoff * (2 ** (attempt - 1))
+		if response is not None:
+			retry_after = response.headers.get('Retry-After', '')
+			if retry_after.isdigit():
+				delay = max(delay, float(retry_after))
+		time.sleep(delay + random.uniform(0, delay * 0.1))
+
+	def get(self, url: str, params: Optional[Dict[str, str]] = None, stream: bool = False,
+			headers: Optional[Dict[str, str]] = None) -> Tuple[requests.Response, int]:
+		"""429/5xx・通信エラーは指数バックオフでリトライする。戻り値は (レスポンス, 試行回数)。
+		条件付きリクエスト（If-None-Match等）をheadersで渡した場合は304もそのまま返す"""
+		host = urlsplit(url).netloc
+		attempt = 0
+		while True:
+			attempt += 1
+			self.limiter.acquire(host)
+			response = None
+			try:
+				response = self.session.get(url, params=params, timeout=self.timeout, stream=stream, headers=headers)
+				REGISTRY.inc('http_requests_total', host=host, code=response.status_code)
+				if response.status_code in RETRY_STATUS:
+					response.close()
+					raise RetryableError(f'HTTP {response.status_code}')
+				response.raise_for_status()
+				return response, attempt
+			except (RetryableError, requests.ConnectionError, requests.Timeout) as e:
+				if attempt > self.max_retries:
+					raise requests.RequestException(f'リトライ上限到達: {url}: {e}') from e
+				REGISTRY.inc('http_retries_total', host=host)
+				logging.warning(f'リトライ {attempt}/{self.max_retries}: {url}: {e}')
+				self._sleep_before_retry(attempt, response)
+
+	def download(self, task: DownloadTask, manifest: Optional[DownloadManifest] = None) -> DownloadResult:
+		with span('EDINETダウンロード', task.doc_id) as event:
+			result = self._download(task, manifest)
+			event.update(result=result.status, bytes=result.bytes, attempts=result.attempts)
+		REGISTRY.inc('download_docs_total', status=result.status)
+		REGISTRY.inc('download_bytes_total', result.bytes)
+		return result
+
+	def _download(self, task: DownloadTask, manifest: Optional[DownloadManifest] = None) -> DownloadResult:
+		# 通信前にスキップ判定（台帳で完了済み、または既にZIPが存在する）
+		if manifest is not None and manifest.is_complete(task.doc_id):
+			logging.info(f'ダウンロード済みのためスキップ: {task.doc_id}')
+			return DownloadResult(task.doc_id, task.output_path, 'skipped')
+		if os.path.exists(task.output_path):
+			logging.info(f'既存ファイルのため保存スキップ: {task.output_path}')
+			if manifest is not None:
+				manifest.mark(task.doc_id, task.output_path, 'done',
+					size=os.path.getsize(task.output_path), sha256=file_sha256(task.output_path))
+			return DownloadResult(task.doc_id, task.output_path, 'skipped')
+
+		if manifest is not None:
+			manifest.mark(task.doc_id, task.output_path, 'pending')
+		try:
+			response, attempts = self.get(task.url, params=task.params, stream=True)
+		except requests.RequestException as e:
+			return self._failed(task, manifest, str(e))
+		with response:
+			# 書類が存在しない場合などはHTTP 200でJSONのエラーが返る
+			if 'application/json' in response.headers.get('Content-Type', ''):
+				return self._failed(task, manifest, f'ZIPではなくJSONが返却されました: {response.text[:200]}', attempts)
+			try:
+				if self.extract:
+					size, digest = self._stream_extract(response, task.output_path)
+				else:
+					size, digest = self._stream_to_file(response, task.output_path)
+			except (OSError, requests.RequestException, zipfile.BadZipFile) as e:
+				return self._failed(task, manifest, f'保存失敗: {e}', attempts)
+		if manifest is not None:
+			manifest.mark(task.doc_id, task.output_path, 'done', size=size, sha256=digest)
+		if self.extract:
+			logging.info(f'展開完了: {os.path.splitext(task.output_path)[0]}')
+		else:
+			logging.info(f'ZIP保存完了: {task.output_path}')
+		return DownloadResult(task.doc_id, task.output_path, 'downloaded', bytes=size, attempts=attempts)
+
+	def _copy_stream(self, response: requests.Response, file_out) -> Tuple[int, str]:
+		"""レスポンスを固定サイズのチャンクで書き出しながらハッシュを計算する"""
+		hasher = hashlib.sha256()
+		size = 0
+		for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+			file_out.write(chunk)
+			hasher.update(chunk)
+			size += len(chunk)
+		return size, hasher.hexdigest()
+
+	def _stream_to_file(self, response: requests.Response, output_path: str) -> Tuple[int, str]:
+		# 一時ファイルに書いてからリネームし、中断時に壊れたZIPが残らないようにする
+		part_path = output_path + '.part'
+		try:
+			with open(part_path, 'wb') as file_out:
+				size, digest = self._copy_stream(response, file_out)
+			os.replace(part_path, output_path)
+		except BaseException:
+			if os.path.exists(part_path):
+				os.remove(part_path)
+			raise
+		return size, digest
+
+	def _stream_extract(self, response: requests.Response, output_path: str) -> Tuple[int, str]:
+		"""ZIPを保存せず、必要なメンバーだけを展開フォルダに書き出す。
+		ZIPの中央ディレクトリは末尾にあるため、本体は自動削除される一時ファイルに逐次書き出してから読む。"""
+		extract_dir = os.path.splitext(output_path)[0]
+		part_dir = extract_dir + '.part'
+		with tempfile.TemporaryFile(dir=os.path.dirname(output_path)) as spool:
+			size, digest = self._copy_stream(response, spool)
+			spool.seek(0)
+			try:
+				shutil.rmtree(part_dir, ignore_errors=True)
+				with zipfile.ZipFile(spool) as zip_ref:
+					extract_members(zip_ref, part_dir, self.member_pattern)
+				shutil.rmtree(extract_dir, ignore_errors=True)
+				os.replace(part_dir, extract_dir)
+			except BaseException:
+				shutil.rmtree(part_dir, ignore_errors=True)
+				raise
+		return size, digest
+
+	def _failed(self, task: DownloadTask, manifest: Optional[DownloadManifest], error: str, attempts: int = 0) -> DownloadResult:
+		if manifest is not None:
+			manifest.mark(task.doc_id, task.output_path, 'failed', error=error)
+		return DownloadResult(task.doc_id, task.output_path, 'failed', attempts=attempts, error=error)
+
+	def download_all(self, tasks: List[DownloadTask],
+			manifest: Optional[DownloadManifest] = None) -> Tuple[List[DownloadResult], DownloadStats]:
+		"""ワーカー数を上限に並列ダウンロードし、結果とスループット集計を返す"""
+		stats = DownloadStats()
+		start = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			results = list(pool.map(lambda task: self.download(task, manifest), tasks))
+		stats.elapsed = time.perf_counter() - start
+		for result in results:
+			stats.add(result)
+			if result.status == 'failed':
+				logging.error(f'ダウンロード失敗: {result.doc_id}: {result.error}')
+		return results, stats
+
+	def close(self) -> None:
+		self.session.close()
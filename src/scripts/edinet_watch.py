@@ -0,0 +1,382 @@
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, cast
+
+import pandas as pd
+
+import edinet2data2zipdata as edinet
+import instrumentation
+from instrumentation import REGISTRY
+from edinet_downloader import EdinetClient, DownloadTask, api_base
+from download_manifest import DownloadManifest, default_manifest_path
+from document_metadata import save_document_metadata, code_from_metadata, is_fund
+from stage_state import StageState, default_state_path, fingerprint_paths
+from data_catalog import DataCatalog, default_catalog_path
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+JST = timezone(timedelta(hours=9))
+
+# 処理済み台帳（stage_state）でのステージ名。パイプラインを通過したdocIDを記録する
+STATE_STAGE = 'watch'
+
+
+def today_jst() -> str:
+	return datetime.now(JST).strftime('%Y%m%d')
+
+
+def parse_submit_time(value: str) -> Optional[datetime]:
+	"""書類一覧の submitDateTime（JST, 'yyyy-mm-dd hh:mm'）"""
+	try:
+		return datetime.strptime(str(value), '%Y-%m-%d %H:%M').replace(tzinfo=JST)
+	except ValueError:
+		return None
+
+
+@dataclass
+class WatchItem:
+	"""パイプラインを流れる1書類分の状態"""
+	date: str
+	record: Dict[str, Any]
+	task: DownloadTask
+	detected_at: float = field(default_factory=time.time)
+	folder: Optional[str] = None
+	ticker: Optional[str] = None
+
+	@property
+	def doc_id(self) -> str:
+		return self.task.doc_id
+
+
+class DocumentWatcher:
+	"""書類一覧APIを定期的に確認し、未検知の書類を返す。
+	まず件数のみのtype=1（条件付きリクエスト）で変化を確かめ、変化があった場合のみtype=2の一覧を取得する"""
+
+	def __init__(self, client: EdinetClient, api_key: str, state: StageState):
+		self.client = client
+		self.api_key = api_key
+		self.state = state
+		self._validators: Dict[str, Dict[str, str]] = {}
+		self._counts: Dict[str, Optional[int]] = {}
+		self._seen: Dict[str, set] = {}
+
+	def seen(self, date: str) -> set:
+		if date not in self._seen:
+			self._seen[date] = set(self.state.items(STATE_STAGE, date))
+		return self._seen[date]
+
+	def forget(self, date: str, doc_id: str) -> None:
+		"""処理に失敗した書類は次回のポーリングで再検知させる"""
+		self.seen(date).discard(doc_id)
+		self._counts.pop(date, None)
+
+	def _count(self, date: str) -> Optional[int]:
+		"""type=1で書類件数を取得する。変化がない（304）場合は前回の件数を返す（キーはいずれもyyyymmdd）"""
+		headers = {}
+		validators = self._validators.get(date, {})
+		if validators.get('etag'):
+			headers['If-None-Match'] = validators['etag']
+		if validators.get('last_modified'):
+			headers['If-Modified-Since'] = validators['last_modified']
+		response, _ = self.client.get(f'{api_base()}/documents.json', headers=headers or None,
+			params={'date': str(edinet.to_api_date(date)), 'type': '1', 'Subscription-Key': self.api_key})
+		with response:
+			if response.status_code == 304:
+				return self._counts.get(date)
+			self._validators[date] = {
+				'etag': response.headers.get('ETag', ''),
+				'last_modified': response.headers.get('Last-Modified', ''),
+			}
+			count = ((response.json().get('metadata') or {}).get('resultset') or {}).get('count')
+		return int(count) if count is not None else None
+
+	def poll(self, date: str) -> List[WatchItem]:
+		count = self._count(date)
+		if count is not None and self._counts.get(date) == count:
+			return []
+		df = edinet.fetch_document_list(self.client, edinet.to_api_date(date), self.api_key)
+		self._counts[date] = count
+		if df.empty:
+			return []
+		seen = self.seen(date)
+		df_financial = cast(pd.DataFrame, edinet.filter_financial(df))
+		df_new = df_financial[~df_financial['docID'].isin(list(seen))]
+		if df_new.empty:
+			return []
+
+		save_dir = os.path.join(BASE_DIR, 'data', date)
+		os.makedirs(save_dir, exist_ok=True)
+		records = df.loc[df_new.index].to_dict('records')
+		save_document_metadata(save_dir, records)
+		items = []
+		for record, task in zip(records, edinet.build_tasks(df_new, save_dir, self.api_key)):
+			seen.add(task.doc_id)
+			items.append(WatchItem(date, record, task))
+		logging.info(f'新着書類 {len(items)} 件を検知: {date}')
+		return items
+
+
+class WatchPipeline:
+	"""新着書類をダウンロード→解凍→証券コード割当→AI分析の順に流すストリーミングパイプライン。
+	ステージ間は上限付きキューでつなぎ、書類ごとに提出から分析完了までの遅延を記録する"""
+
+	def __init__(self, client: EdinetClient, manifest: DownloadManifest, state: StageState, index,
+			placement: str = 'link', queue_size: int = 16, analyze: bool = True, analysis_batch: int = 8,
+			catalog=None):
+		self.client = client
+		self.manifest = manifest
+		self.state = state
+		self.index = index
+		self.placement = placement
+		self.analyze = analyze
+		self.analysis_batch = analysis_batch
+		self.catalog = catalog
+		self.download_q: 'queue.Queue[Optional[WatchItem]]' = queue.Queue(maxsize=queue_size)
+		self.extract_q: 'queue.Queue[Optional[WatchItem]]' = queue.Queue(maxsize=queue_size)
+		self.map_q: 'queue.Queue[Optional[WatchItem]]' = queue.Queue(maxsize=queue_size)
+		self.analyze_q: 'queue.Queue[Optional[WatchItem]]' = queue.Queue(maxsize=queue_size)
+		self.on_failure: Optional[Callable[[WatchItem], None]] = None
+		self.latencies: List[float] = []
+		self._lock = threading.Lock()
+		self._download_workers = client.workers
+		self._threads = (
+			[threading.Thread(target=self._download_worker, daemon=True) for _ in range(self._download_workers)]
+			+ [threading.Thread(target=self._extract_worker, daemon=True),
+			   threading.Thread(target=self._map_worker, daemon=True),
+			   threading.Thread(target=self._analyze_worker, daemon=True)])
+
+	def start(self) -> None:
+		for t in self._threads:
+			t.start()
+
+	def submit(self, item: WatchItem) -> None:
+		"""キューが一杯ならパイプラインが追いつくまで待つ（背圧）"""
+		self.download_q.put(item)
+
+	def stop(self) -> None:
+		"""キューに残った書類を処理し終えてから停止する"""
+		for _ in range(self._download_workers):
+			self.download_q.put(None)
+		for t in self._threads:
+			t.join()
+
+	def _fail(self, item: WatchItem, message: str) -> None:
+		logging.error(f'{message}: {item.doc_id}')
+		if self.on_failure:
+			self.on_failure(item)
+
+	def _download_worker(self) -> None:
+		while True:
+			item = self.download_q.get()
+			if item is None:
+				break
+			result = self.client.download(item.task, self.manifest)
+			if result.status == 'failed':
+				self._fail(item, f'ダウンロード失敗 ({result.error})')
+				continue
+			self.extract_q.put(item)
+		# 最後のワーカーが後続に終了を伝える
+		with self._lock:
+			self._download_workers -= 1
+			if self._download_workers == 0:
+				self.extract_q.put(None)
+
+	def _extract_worker(self) -> None:
+		from zipdata2allcsv import extract_zip
+		while True:
+			item = self.extract_q.get()
+			if item is None:
+				self.map_q.put(None)
+				break
+			zip_path = item.task.output_path
+			folder = os.path.splitext(zip_path)[0]
+			item.folder = folder
+			if os.path.exists(zip_path):
+				result = extract_zip(zip_path, folder)
+				if result['error'] and not os.path.isdir(folder):
+					self._fail(item, result['error'])
+					continue
+			elif not os.path.isdir(folder):
+				self._fail(item, '展開フォルダが見つかりません')
+				continue
+			if self.catalog is not None:
+				self.catalog.sync_day(item.date)
+			self.map_q.put(item)
+
+	def _map_worker(self) -> None:
+		import yyyymmddallcsv2tickersymbol2data as mapping
+		while True:
+			item = self.map_q.get()
+			if item is None:
+				self.analyze_q.put(None)
+				break
+			folder = item.folder
+			if folder is None:
+				# 解凍ステージを通った書類には必ず展開フォルダがある
+				self._fail(item, '展開フォルダが未設定です')
+				continue
+			if is_fund(item.record):
+				logging.info(f'ファンドの書類のためスキップ: {item.doc_id}')
+				self._record_latency(item, '割当対象外')
+				continue
+			name = os.path.basename(folder)
+			code = code_from_metadata(item.record)
+			if not code:
+				code, _key, _ratio = self.index.resolve(mapping.parse_company_from_folder(name), threshold=0.5)
+			if not code:
+				logging.warning(f'証券コード不明のためスキップ: {name}')
+				self._record_latency(item, '証券コード不明')
+				continue
+			ticker = f'{code}.T'
+			item.ticker = ticker
+			copied, skipped = mapping.copy_csvs_to_ticker_dir(folder, os.path.join(BASE_DIR, 'data', ticker),
+				self.placement, self.catalog)
+			logging.info(f'{name} → {ticker}: 配置 {copied} 件, スキップ {skipped} 件')
+			# 日付単位のバッチ実行で同じフォルダを配置し直さないよう記録する
+			fingerprint = fingerprint_paths([folder], extra=f'{self.placement}\0{item.record.get("secCode") or ""}')
+			self.state.mark(mapping.STATE_STAGE, name, fingerprint, date=item.date, output=ticker)
+			if self.analyze:
+				self.analyze_q.put(item)
+			else:
+				self._record_latency(item, '割当完了')
+
+	def _analyze_worker(self) -> None:
+		from aifinanceanalysisfortickersymbol import load_ticker_prompt
+		from ai_analysis_engine import AnalysisEngine, AnalysisCache, default_cache_path
+		cache = AnalysisCache(default_cache_path(BASE_DIR))
+		data_dir = os.path.join(BASE_DIR, 'data')
+		done = False
+		try:
+			while not done:
+				# 先頭の1件を待ち、その時点でキューにある分をまとめて並列に分析する
+				received = [self.analyze_q.get()]
+				while len(received) < self.analysis_batch:
+					try:
+						received.append(self.analyze_q.get_nowait())
+					except queue.Empty:
+						break
+				done = None in received
+				# 割当ステージで証券コードを決めた書類だけが流れてくる（tickerは必ずある）
+				batch = [(item, item.ticker) for item in received if item is not None and item.ticker]
+				if not batch:
+					continue
+				prompts: Dict[str, str] = {}
+				for _item, ticker in batch:
+					try:
+						prompts[ticker] = load_ticker_prompt(ticker, data_dir=data_dir, catalog=self.catalog)
+					except Exception as e:
+						logging.error(f'分析プロンプト作成失敗: {ticker}: {e}')
+				try:
+					results = AnalysisEngine(concurrency=self.analysis_batch, cache=cache).run(prompts) if prompts else {}
+				except RuntimeError as e:
+					logging.error(f'AI分析失敗: {e}')
+					results = {}
+				for item, ticker in batch:
+					if ticker in results:
+						logging.info(f'--- {ticker} ({item.doc_id}) ---\n{results[ticker]}')
+						self._record_latency(item, 'AI分析完了')
+					else:
+						self._record_latency(item, 'AI分析失敗')
+		finally:
+			cache.close()
+
+	def _record_latency(self, item: WatchItem, outcome: str) -> None:
+		now = time.time()
+		self.state.mark(STATE_STAGE, item.doc_id, outcome, date=item.date, output=item.ticker)
+		submitted = parse_submit_time(item.record.get('submitDateTime') or '')
+		pipeline_latency = now - item.detected_at
+		REGISTRY.inc('watch_docs_total', outcome=outcome)
+		REGISTRY.observe('watch_pipeline_seconds', pipeline_latency)
+		if submitted:
+			latency = now - submitted.timestamp()
+			REGISTRY.observe('watch_latency_seconds', latency)
+			with self._lock:
+				self.latencies.append(latency)
+			logging.info(f'{outcome}: {item.doc_id} 提出→完了 {latency:.1f} 秒 (検知→完了 {pipeline_latency:.1f} 秒)')
+		else:
+			logging.info(f'{outcome}: {item.doc_id} 検知→完了 {pipeline_latency:.1f} 秒')
+
+	def latency_summary(self) -> str:
+		with self._lock:
+			values = sorted(self.latencies)
+		if not values:
+			return '提出→完了の遅延: 記録なし'
+		def pct(p):
+			return values[min(len(values) - 1, int(len(values) * p))]
+		return (f'提出→完了の遅延: {len(values)} 件, 中央値 {pct(0.5):.1f} 秒, '
+				f'90% {pct(0.9):.1f} 秒, 最大 {values[-1]:.1f} 秒')
+
+
+def watch(api_key: str, date: Optional[str] = None, interval: float = 60.0, duration: float = 0.0,
+		workers: int = 4, rate: float = 2.0, placement: str = 'link', queue_size: int = 16,
+		analyze: bool = True) -> WatchPipeline:
+	"""書類一覧をinterval秒ごとに確認し、新着書類をパイプラインに流し続ける。
+	dateを省略すると当日（JST）を監視し、日付が変われば翌日に切り替える。duration秒経過（0は無期限）か Ctrl+C で終了する"""
+	import yyyymmddallcsv2tickersymbol2data as mapping
+	index = mapping.CompanyNameIndex(mapping.load_company_code_map(mapping.default_code_map_path(BASE_DIR)))
+	client = EdinetClient(workers=workers, rate=rate)
+	manifest = DownloadManifest(default_manifest_path(BASE_DIR))
+	state = StageState(default_state_path(BASE_DIR))
+	catalog = DataCatalog(default_catalog_path(BASE_DIR))
+	watcher = DocumentWatcher(client, api_key, state)
+	pipeline = WatchPipeline(client, manifest, state, index, placement=placement, queue_size=queue_size, analyze=analyze,
+		catalog=catalog)
+	pipeline.on_failure = lambda item: watcher.forget(item.date, item.doc_id)
+	pipeline.start()
+	started = time.monotonic()
+	logging.info(f'監視開始: 間隔 {interval} 秒')
+	try:
+		while True:
+			target = date or today_jst()
+			try:
+				for item in watcher.poll(target):
+					pipeline.submit(item)
+			except Exception as e:
+				logging.error(f'書類一覧の取得失敗: {target}: {e}')
+			if duration and time.monotonic() - started >= duration:
+				break
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		logging.info('監視を終了します')
+	finally:
+		pipeline.stop()
+		logging.info(pipeline.latency_summary())
+		catalog.close()
+		state.close()
+		manifest.close()
+		client.close()
+	return pipeline
+
+
+def main():
+	parser = argparse.ArgumentParser(description='EDINETの新着書類を監視し、提出後すぐに取得・分析する')
+	parser.add_argument('--date', default=None, help='監視する提出日 yyyymmdd（既定: 当日）')
+	parser.add_argument('--interval', type=float, default=60.0, help='書類一覧の確認間隔（秒）')
+	parser.add_argument('--duration', type=float, default=0.0, help='監視を続ける秒数（0は無期限）')
+	parser.add_argument('--workers', type=int, default=4, help='同時ダウンロード数')
+	parser.add_argument('--rate', type=float, default=2.0, help='EDINETへの最大リクエスト数/秒')
+	parser.add_argument('--queue-size', type=int, default=16, help='ステージ間キューの上限')
+	parser.add_argument('--no-analyze', action='store_true', help='AI分析を行わず証券コード割当までで止める')
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+
+	api_key = os.environ.get('EDINET_API_KEY')
+	if not api_key:
+		logging.error('EDINET_API_KEY 環境変数が設定されていません。')
+		raise SystemExit(1)
+	watch(api_key, date=args.date, interval=args.interval, duration=args.duration, workers=args.workers,
+		rate=args.rate, queue_size=args.queue_size, analyze=not args.no_analyze)
+
+
+if __name__ == '__main__':
+	main()
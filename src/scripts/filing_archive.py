@@ -0,0 +1,127 @@
+import os
+import io
+import fnmatch
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from zipdata2allcsv import DEFAULT_MEMBER_PATTERN
+
+
+# ZIP内のメンバーを指す仮想パスの区切り（<ZIPのパス>!/<メンバー名>）。展開せずにCSVを参照する
+MEMBER_SEP = '!/'
+
+# ZIP内でXBRL→CSV変換結果を格納するフォルダ
+XBRL_CSV_DIR = 'XBRL_TO_CSV'
+
+
+def member_path(zip_path: str, member: str) -> str:
+	return f'{zip_path}{MEMBER_SEP}{member}'
+
+
+def split_member_path(path: str) -> Optional[Tuple[str, str]]:
+	"""仮想パスなら (ZIPのパス, メンバー名)、通常のパスならNone"""
+	zip_path, sep, member = path.partition(MEMBER_SEP)
+	if not sep or not zip_path.lower().endswith('.zip'):
+		return None
+	return zip_path, member
+
+
+def is_member_path(path: str) -> bool:
+	return split_member_path(path) is not None
+
+
+def is_archive(path: str) -> bool:
+	return path.lower().endswith('.zip') and os.path.isfile(path)
+
+
+def filing_name(source: str) -> str:
+	"""展開フォルダ名またはZIPのファイル名から拡張子を除いた書類名（'{filerName}_{docDescription}_{docID}'）"""
+	name = os.path.basename(source.rstrip(os.sep))
+	return name[:-4] if name.lower().endswith('.zip') else name
+
+
+@contextmanager
+def open_binary(path: str) -> Iterator[BinaryIO]:
+	"""ファイルまたはZIP内のメンバーをバイナリで開く。メンバーは中央ディレクトリから位置を引いて直接読む"""
+	parts = split_member_path(path)
+	if parts is None:
+		with open(path, 'rb') as f:
+			yield f
+		return
+	with zipfile.ZipFile(parts[0]) as zf, zf.open(parts[1]) as f:
+		yield f
+
+
+@contextmanager
+def open_text(path: str, encoding: str, newline: Optional[str] = '') -> Iterator[TextIO]:
+	with open_binary(path) as f:
+		yield io.TextIOWrapper(f, encoding=encoding, newline=newline)
+
+
+def stat(path: str) -> Tuple[int, int]:
+	"""(サイズ, 更新日時ns)。メンバーは展開後のサイズとZIP自体の更新日時"""
+	parts = split_member_path(path)
+	if parts is None:
+		st = os.stat(path)
+		return st.st_size, st.st_mtime_ns
+	st = os.stat(parts[0])
+	with zipfile.ZipFile(parts[0]) as zf:
+		return zf.getinfo(parts[1]).file_size, st.st_mtime_ns
+
+
+def exists(path: str) -> bool:
+	parts = split_member_path(path)
+	if parts is None:
+		return os.path.exists(path)
+	try:
+		with zipfile.ZipFile(parts[0]) as zf:
+			zf.getinfo(parts[1])
+		return True
+	except (OSError, KeyError, zipfile.BadZipFile):
+		return False
+
+
+def list_members(zip_path: str, pattern: str = DEFAULT_MEMBER_PATTERN) -> List[str]:
+	"""パターンに一致するメンバー名（中央ディレクトリのみ読み、本体は展開しない）"""
+	with zipfile.ZipFile(zip_path) as zf:
+		return sorted(info.filename for info in zf.infolist()
+			if not info.is_dir() and fnmatch.fnmatch(info.filename, pattern))
+
+
+def iter_filing_csvs(source: str, pattern: str = DEFAULT_MEMBER_PATTERN) -> Iterator[str]:
+	"""展開済みフォルダ配下のCSV、またはZIP内のCSVの仮想パスを列挙する"""
+	if not is_archive(source):
+		for root, _dirs, files in os.walk(source):
+			for file in files:
+				if file.lower().endswith('.csv'):
+					yield os.path.join(root, file)
+		return
+	for member in list_members(source, pattern):
+		if member.lower().endswith('.csv'):
+			yield member_path(source, member)
+
+
+def xbrl_csvs(source: str) -> List[Tuple[str, str]]:
+	"""XBRL_TO_CSV直下のCSVを (ファイル名, パス) の名前順で返す。sourceは展開済みフォルダまたはZIP"""
+	if not is_archive(source):
+		csv_dir = os.path.join(source, XBRL_CSV_DIR)
+		if not os.path.isdir(csv_dir):
+			return []
+		return [(fn, os.path.join(csv_dir, fn)) for fn in sorted(os.listdir(csv_dir))]
+	prefix = XBRL_CSV_DIR + '/'
+	return [(member[len(prefix):], member_path(source, member))
+		for member in list_members(source, prefix + '*')
+		if '/' not in member[len(prefix):]]
+
+
+def list_filings(day_dir: str) -> Dict[str, str]:
+	"""data/yyyymmdd配下の書類名→実体（展開済みフォルダまたはZIP）。両方ある場合は展開済みフォルダを使う"""
+	filings: Dict[str, str] = {}
+	for entry in sorted(os.listdir(day_dir)):
+		path = os.path.join(day_dir, entry)
+		if os.path.isdir(path):
+			filings[entry] = path
+		elif entry.lower().endswith('.zip'):
+			filings.setdefault(filing_name(entry), path)
+	return filings
@@ -1,36 +1,58 @@
-
-import requests
+import os
+import argparse
 import pandas as pd
 
+import instrumentation
+from code_master import refresh_source
+
 # 公式ページから取得した最新CSVのURL（例: 2025年8月時点のURL）
 csv_url = "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq00000030vg-att/data_j.csv"
 
-# ダウンロード
-res = requests.get(csv_url)
-res.raise_for_status()
-with open("jpx_listed.csv", "wb") as f:
-    f.write(res.content)
-print("jpx_listed.csv を保存しました。")
 
-# 会社名と証券コードのみ抽出して新CSVに保存
-df = pd.read_csv("jpx_listed.csv", encoding="shift_jis")
+def extract_company_codes(src_path, out_path):
+    # 会社名と証券コードのみ抽出して新CSVに保存
+    df = pd.read_csv(src_path, encoding="shift_jis")
+
+    # 列名の自動判定
+    code_col = None
+    name_col = None
+    for col in df.columns:
+        if "コード" in col or "証券コード" in col:
+            code_col = col
+        if "会社名" in col or "銘柄名" in col or "上場会社名" in col:
+            name_col = col
+
+    if not code_col or not name_col:
+        raise Exception(f"証券コード・会社名の列が見つかりません: {df.columns}")
+
+    out_df = df[[code_col, name_col]].copy()
+    out_df.columns = ["証券コード", "会社名"]
+    out_df.to_csv(out_path, index=False, encoding="utf-8-sig")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPXの上場銘柄一覧CSVを取得し、証券コード・会社名のCSVを作成")
+    parser.add_argument("--url", default=csv_url, help="JPX上場銘柄一覧CSVのURL")
+    parser.add_argument("--force", action="store_true", help="未更新でも証券コード・会社名CSVを作り直す")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
+    # ダウンロード（ETag/Last-Modifiedで未更新なら再取得しない）
+    changed, src_path = refresh_source(args.url, "jpx_listed.csv")
+    if changed:
+        print("jpx_listed.csv を保存しました。")
+    else:
+        print("jpx_listed.csv は更新されていません。")
 
-# 列名の自動判定
-code_col = None
-name_col = None
-for col in df.columns:
-    if "コード" in col or "証券コード" in col:
-        code_col = col
-    if "会社名" in col or "銘柄名" in col or "上場会社名" in col:
-        name_col = col
+    out_path = "jpx_company_code.csv"
+    if changed or args.force or not os.path.exists(out_path):
+        extract_company_codes(src_path, out_path)
+        print("jpx_company_code.csv を保存しました。")
 
-if not code_col or not name_col:
-    raise Exception(f"証券コード・会社名の列が見つかりません: {df.columns}")
 
-out_df = df[[code_col, name_col]].copy()
-out_df.columns = ["証券コード", "会社名"]
-out_df.to_csv("jpx_company_code.csv", index=False, encoding="utf-8-sig")
-print("jpx_company_code.csv を保存しました。")
+if __name__ == "__main__":
+    main()
 
 
 # import requests
@@ -64,4 +86,4 @@ print("jpx_company_code.csv を保存しました。")
 # with open("jpx_listed.csv", "wb") as f:
 #     f.write(csv_res.content)
 
-# print("jpx_listed.csv を保存しました。")
\ No newline at end of file
+# print("jpx_listed.csv を保存しました。")
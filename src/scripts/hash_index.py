@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+	path TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_digest ON files(digest);
+'''
+
+
+def default_index_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'hash_index.sqlite')
+
+
+class HashIndex:
+	"""パス・サイズ・更新日時→内容ハッシュ（BLAKE2）の索引（SQLite）。変更のないファイルは再計算しない。"""
+
+	def __init__(self, path: str):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.executescript(SCHEMA)
+
+	def load(self) -> Dict[str, Tuple[int, int, str]]:
+		"""パス→(サイズ, 更新日時ns, ハッシュ)"""
+		with self._lock:
+			rows = self._conn.execute('SELECT path, size, mtime_ns, digest FROM files').fetchall()
+		return {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+
+	def lookup(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+		"""サイズと更新日時が一致する場合のみ記録済みのハッシュを返す"""
+		with self._lock:
+			row = self._conn.execute('SELECT size, mtime_ns, digest FROM files WHERE path = ?', (path,)).fetchone()
+		if row and row[0] == size and row[1] == mtime_ns:
+			return row[2]
+		return None
+
+	def store(self, rows: Iterable[Tuple[str, int, int, str]]) -> None:
+		"""(パス, サイズ, 更新日時ns, ハッシュ) を記録する"""
+		with self._lock, self._conn:
+			self._conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)', rows)
+
+	def remove(self, paths: Iterable[str]) -> None:
+		with self._lock, self._conn:
+			self._conn.executemany('DELETE FROM files WHERE path = ?', ((p,) for p in paths))
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
@@ -0,0 +1,368 @@
+import os
+import json
+import math
+import time
+import atexit
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# 全メトリクス名の接頭辞（Prometheus側で他のジョブと区別する）
+METRIC_PREFIX = 'edinet_'
+
+# 所要時間（秒）のヒストグラムの既定の境界
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+	120.0, 300.0, 900.0)
+
+# メトリクスの説明（Prometheusの # HELP 行）
+METRIC_HELP: Dict[str, str] = {
+	'stage_seconds': 'ステージの所要時間（秒）',
+	'stage_runs_total': 'ステージの実行回数',
+	'stage_peak_memory_bytes': 'プロファイル時のステージ実行中のメモリ使用量のピーク（バイト）',
+	'item_seconds': '書類・ティッカー等の項目単位の所要時間（秒）',
+	'items_total': '処理した項目数',
+	'http_requests_total': 'EDINETへのHTTPリクエスト数',
+	'http_retries_total': 'EDINETへのリクエストの再試行回数',
+	'download_docs_total': '書類のダウンロード件数（結果別）',
+	'download_bytes_total': 'ダウンロードした書類のバイト数',
+	'extract_files_total': 'ZIPから展開したファイル数',
+	'extract_bytes_total': 'ZIPから展開したバイト数',
+	'map_folders_total': '証券コード割当てのフォルダ数（解決方法別）',
+	'placement_files_total': '証券コードディレクトリへのCSV配置数（方式・結果別）',
+	'facts_filings_total': 'ファクトを取り込んだ書類数',
+	'facts_rows_total': '取り込んだファクト件数',
+	'dedup_hashed_bytes_total': '重複検出でハッシュを計算したバイト数',
+	'dedup_hash_index_total': 'ハッシュ索引の参照結果',
+	'dedup_duplicates_total': '検出した重複ファイル数',
+	'dedup_reclaimed_bytes_total': '重複削除で空く容量（バイト）',
+	'yahoo_datasets_total': 'Yahoo Financeのデータセット数（取得・キャッシュ別）',
+	'ai_analyses_total': 'AI分析の件数（結果別）',
+	'ai_cache_total': 'AI分析キャッシュの参照結果',
+	'ai_request_seconds': 'AI分析APIの応答時間（秒）',
+	'ai_retries_total': 'AI分析APIの再試行回数',
+	'ai_tokens_total': 'AI分析APIの使用トークン数',
+	'watch_docs_total': '監視モードで処理した書類数（結果別）',
+	'watch_latency_seconds': '書類の提出から処理完了までの時間（秒）',
+	'watch_pipeline_seconds': '新着書類の検知から処理完了までの時間（秒）',
+	'queue_jobs_total': 'ジョブキューで処理したジョブ数（結果別）',
+	'catalog_rescans_total': '目録の参照時に、ディスクの変更を検知して読み直した範囲の数（日付・ティッカー別）',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+	return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+	pairs = list(key) + list(extra)
+	if not pairs:
+		return ''
+	escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _k, v in pairs)
+	return '{' + ','.join(f'{k}="{v}"' for (k, _v), v in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value: float) -> str:
+	if math.isinf(value):
+		return '+Inf' if value > 0 else '-Inf'
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+	"""累積バケット・合計・件数を持つヒストグラム（Prometheusのhistogramと同じ形）"""
+
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.buckets = tuple(sorted(b for b in buckets if not math.isinf(b)))
+		self.counts = [0] * len(self.buckets)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value: float) -> None:
+		self.count += 1
+		self.sum += value
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {'count': self.count, 'sum': round(self.sum, 6),
+			'buckets': {_format_number(b): c for b, c in zip(self.buckets, self.counts)}}
+
+
+class MetricsRegistry:
+	"""プロセス内のカウンタ・ゲージ・ヒストグラム（スレッドセーフ）"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.counters: Dict[str, Dict[LabelKey, float]] = {}
+		self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+		self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+	def inc(self, name: str, value: float = 1, **labels) -> None:
+		key = _label_key(labels)
+		with self._lock:
+			series = self.counters.setdefault(name, {})
+			series[key] = series.get(key, 0) + value
+
+	def set_gauge(self, name: str, value: float, **labels) -> None:
+		with self._lock:
+			self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+	def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> None:
+		key = _label_key(labels)
+		with self._lock:
+			series = self.histograms.setdefault(name, {})
+			if key not in series:
+				series[key] = Histogram(buckets)
+			series[key].observe(value)
+
+	def counter_value(self, name: str, **labels) -> float:
+		with self._lock:
+			return self.counters.get(name, {}).get(_label_key(labels), 0)
+
+	def reset(self) -> None:
+		with self._lock:
+			self.counters.clear()
+			self.gauges.clear()
+			self.histograms.clear()
+
+	def snapshot(self) -> Dict[str, Any]:
+		"""JSONに書き出せる形の現在値"""
+		def series(metrics, convert):
+			return {name: [dict(labels=dict(key), value=convert(v)) for key, v in sorted(values.items())]
+				for name, values in sorted(metrics.items())}
+		with self._lock:
+			return {
+				'counters': series(self.counters, lambda v: v),
+				'gauges': series(self.gauges, lambda v: v),
+				'histograms': series(self.histograms, lambda h: h.to_dict()),
+			}
+
+	def to_prometheus(self) -> str:
+		"""Prometheusのテキスト形式（node_exporterのtextfile collector等で読める形）で出力する"""
+		lines: List[str] = []
+		with self._lock:
+			for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+				for name, values in sorted(metrics.items()):
+					full = METRIC_PREFIX + name
+					if name in METRIC_HELP:
+						lines.append(f'# HELP {full} {METRIC_HELP[name]}')
+					lines.append(f'# TYPE {full} {kind}')
+					for key, value in sorted(values.items()):
+						lines.append(f'{full}{_format_labels(key)} {_format_number(value)}')
+			for name, values in sorted(self.histograms.items()):
+				full = METRIC_PREFIX + name
+				if name in METRIC_HELP:
+					lines.append(f'# HELP {full} {METRIC_HELP[name]}')
+				lines.append(f'# TYPE {full} histogram')
+				for key, hist in sorted(values.items()):
+					for bound, count in zip(hist.buckets, hist.counts):
+						lines.append(f'{full}_bucket{_format_labels(key, [("le", _format_number(bound))])} {count}')
+					lines.append(f'{full}_bucket{_format_labels(key, [("le", "+Inf")])} {hist.count}')
+					lines.append(f'{full}_sum{_format_labels(key)} {_format_number(round(hist.sum, 6))}')
+					lines.append(f'{full}_count{_format_labels(key)} {hist.count}')
+		lines.append('# EOF')
+		return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+	REGISTRY.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+	REGISTRY.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+	REGISTRY.observe(name, value, **labels)
+
+
+class JsonFormatter(logging.Formatter):
+	"""1行1イベントのJSONログ。spanなどが extra={'event': {...}} で渡した項目をそのまま含める"""
+
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+			'level': record.levelname,
+			'logger': record.name,
+			'thread': record.threadName,
+			'msg': record.getMessage(),
+		}
+		event = getattr(record, 'event', None)
+		if isinstance(event, dict):
+			entry.update(event)
+		if record.exc_info:
+			entry['exc'] = self.formatException(record.exc_info)
+		return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _Config:
+	json_logs = False
+	metrics_path: Optional[str] = None
+	profile: frozenset = frozenset()
+	profile_dir: Optional[str] = None
+
+
+_config = _Config()
+_profile_lock = threading.Lock()
+
+
+def configure(json_logs: Optional[bool] = None, metrics_path: Optional[str] = None,
+		profile: Optional[Iterable[str]] = None, profile_dir: Optional[str] = None) -> None:
+	"""計測の出力先を設定する。省略した項目は環境変数（EDINET_LOG_JSON / EDINET_METRICS_FILE /
+	EDINET_PROFILE / EDINET_PROFILE_DIR）から読む。metrics_pathを指定するとプロセス終了時に書き出す"""
+	if json_logs is None:
+		json_logs = os.environ.get('EDINET_LOG_JSON', '') not in ('', '0', 'false')
+	metrics_path = metrics_path or os.environ.get('EDINET_METRICS_FILE') or None
+	if profile is None:
+		profile = os.environ.get('EDINET_PROFILE', '').split(',')
+	profile_dir = profile_dir or os.environ.get('EDINET_PROFILE_DIR') or None
+
+	_config.json_logs = bool(json_logs)
+	if _config.json_logs:
+		root = logging.getLogger()
+		if not root.handlers:
+			logging.basicConfig(level=logging.INFO)
+		for handler in root.handlers:
+			handler.setFormatter(JsonFormatter())
+	if metrics_path and metrics_path != _config.metrics_path:
+		if _config.metrics_path is None:
+			atexit.register(lambda: _config.metrics_path and write_metrics(_config.metrics_path))
+		_config.metrics_path = metrics_path
+	_config.profile = frozenset(p.strip() for p in profile if p.strip())
+	_config.profile_dir = profile_dir
+
+
+def add_arguments(parser) -> None:
+	"""各スクリプトのargparseに計測用のオプションを追加する"""
+	parser.add_argument('--log-json', action='store_true', default=None, help='ログを1行1件のJSONで出力する')
+	parser.add_argument('--metrics-file', default=None,
+		help='終了時にメトリクスをPrometheusテキスト形式で書き出すファイル（.jsonならJSON）')
+	parser.add_argument('--profile', default=None,
+		help='cProfile・tracemallocで計測するステージ（名前の一部をカンマ区切り、allで全ステージ）')
+	parser.add_argument('--profile-dir', default=None, help='プロファイル結果の出力先（既定: data/profiles）')
+
+
+def configure_from_args(args) -> None:
+	configure(json_logs=args.log_json, metrics_path=args.metrics_file,
+		profile=args.profile.split(',') if args.profile else None, profile_dir=args.profile_dir)
+
+
+def write_metrics(path: str) -> None:
+	"""現在のメトリクスを書き出す（拡張子が .json ならJSON、それ以外はPrometheusテキスト形式）"""
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+	if path.endswith('.json'):
+		content = json.dumps(REGISTRY.snapshot(), ensure_ascii=False, indent=2)
+	else:
+		content = REGISTRY.to_prometheus()
+	part_path = path + '.part'
+	with open(part_path, 'w', encoding='utf-8') as f:
+		f.write(content)
+	os.replace(part_path, path)
+
+
+def _profiling(stage: str) -> bool:
+	# ステージ名の一部（例: 解凍）でも指定できる
+	return 'all' in _config.profile or any(name in stage for name in _config.profile)
+
+
+def _profile_path(stage: str, suffix: str) -> str:
+	base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	profile_dir = _config.profile_dir or os.path.join(base_dir, 'data', 'profiles')
+	os.makedirs(profile_dir, exist_ok=True)
+	safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in stage)
+	return os.path.join(profile_dir, f'{safe}_{datetime.now().strftime("%Y%m%d%H%M%S")}_{os.getpid()}{suffix}')
+
+
+@contextmanager
+def _profile_stage(stage: str) -> Iterator[None]:
+	"""cProfile（呼び出したスレッドのみ）とtracemalloc（プロセス全体のピーク）でステージを計測する。
+	別のステージを計測中の場合はcProfileを重ねずに、tracemallocのみ計測する"""
+	profiler = cProfile.Profile() if _profile_lock.acquire(blocking=False) else None
+	started_tracing = not tracemalloc.is_tracing()
+	if started_tracing:
+		tracemalloc.start(10)
+	tracemalloc.reset_peak()
+	if profiler is not None:
+		profiler.enable()
+	try:
+		yield
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			path = _profile_path(stage, '.prof')
+			profiler.dump_stats(path)
+			_profile_lock.release()
+			logging.info(f'プロファイル出力: {stage}: {path}', extra={'event': {'type': 'profile', 'stage': stage,
+				'path': path}})
+		_current, peak = tracemalloc.get_traced_memory()
+		top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+		if started_tracing:
+			tracemalloc.stop()
+		set_gauge('stage_peak_memory_bytes', peak, stage=stage)
+		logging.info(f'メモリ使用量のピーク: {stage}: {peak / 1e6:.1f} MB', extra={'event': {
+			'type': 'memory', 'stage': stage, 'peak_bytes': peak,
+			'top': [{'where': str(s.traceback), 'bytes': s.size} for s in top]}})
+
+
+@contextmanager
+def span(stage: str, item: Optional[str] = None, **fields) -> Iterator[Dict[str, Any]]:
+	"""ステージ（itemなし）または項目（書類・ティッカー等）単位の処理時間を計測する。
+	所要時間は stage_seconds / item_seconds ヒストグラム、件数は stage_runs_total / items_total に
+	status（ok / error）付きで記録し、終了時にイベントをログに出力する。
+	yieldした辞書に bytes 等を入れるとイベントに含まれる。項目単位のイベントはJSONログ時のみINFO（通常はDEBUG）"""
+	event: Dict[str, Any] = dict(fields)
+	status = 'ok'
+	start = time.perf_counter()
+	profiling = item is None and _profiling(stage)
+	try:
+		if profiling:
+			with _profile_stage(stage):
+				yield event
+		else:
+			yield event
+	except BaseException as e:
+		status = 'error'
+		event.setdefault('error', f'{type(e).__name__}: {e}')
+		raise
+	finally:
+		elapsed = time.perf_counter() - start
+		if item is None:
+			REGISTRY.observe('stage_seconds', elapsed, stage=stage)
+			REGISTRY.inc('stage_runs_total', stage=stage, status=status)
+			level = logging.INFO
+		else:
+			REGISTRY.observe('item_seconds', elapsed, stage=stage)
+			REGISTRY.inc('items_total', stage=stage, status=status)
+			level = logging.INFO if _config.json_logs else logging.DEBUG
+		record = {'type': 'span', 'stage': stage, 'status': status, 'seconds': round(elapsed, 4)}
+		if item is not None:
+			record['item'] = item
+		record.update(event)
+		name = stage if item is None else f'{stage}: {item}'
+		logging.log(level, f'計測: {name}: {elapsed:.2f} 秒 ({status})', extra={'event': record})
+
+
+def log_summary() -> None:
+	"""ステージごとの所要時間・件数・エラー数の要約をログに出力する"""
+	snapshot = REGISTRY.snapshot()
+	runs = {}
+	for entry in snapshot['counters'].get('stage_runs_total', []):
+		stats = runs.setdefault(entry['labels']['stage'], {'ok': 0, 'error': 0})
+		stats[entry['labels']['status']] = entry['value']
+	for entry in snapshot['histograms'].get('stage_seconds', []):
+		stage = entry['labels']['stage']
+		stats = runs.get(stage, {})
+		logging.info(f'ステージ集計: {stage}: {entry["value"]["count"]} 回, 合計 {entry["value"]["sum"]:.2f} 秒, '
+					 f'エラー {stats.get("error", 0)} 回',
+					 extra={'event': {'type': 'summary', 'stage': stage, 'runs': entry['value']['count'],
+						'seconds': entry['value']['sum'], 'errors': stats.get('error', 0)}})
@@ -0,0 +1,129 @@
+import time
+import logging
+import multiprocessing
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from instrumentation import span
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+@dataclass
+class Stage:
+	name: str
+	func: Callable[[Dict[str, Any]], Any]  # 依存ステージの結果 {名前: 戻り値} を受け取る
+	deps: Tuple[str, ...] = ()
+
+
+@dataclass
+class StageResult:
+	name: str
+	status: str  # 'ok' / 'failed' / 'skipped'
+	value: Any = None
+	elapsed: float = 0.0
+	error: str = ''
+
+
+class DagScheduler:
+	"""依存関係付きのステージを1プロセス内のワーカープールで実行する簡易DAGスケジューラ。
+	依存のないステージは並行に実行し、ステージ間のデータは戻り値としてメモリ上で受け渡す。"""
+
+	def __init__(self, workers: int = 4):
+		self.workers = max(1, workers)
+		self.stages: Dict[str, Stage] = {}
+		self.results: Dict[str, StageResult] = {}
+
+	def add(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = ()) -> None:
+		if name in self.stages:
+			raise ValueError(f'ステージ名が重複しています: {name}')
+		self.stages[name] = Stage(name, func, tuple(deps))
+
+	def _check(self) -> None:
+		for stage in self.stages.values():
+			for dep in stage.deps:
+				if dep not in self.stages:
+					raise ValueError(f'未定義の依存ステージ: {stage.name} → {dep}')
+		# 循環検出（トポロジカルソート）
+		remaining = {name: set(stage.deps) for name, stage in self.stages.items()}
+		while remaining:
+			ready = [name for name, deps in remaining.items() if not deps]
+			if not ready:
+				raise ValueError(f'ステージの依存関係が循環しています: {sorted(remaining)}')
+			for name in ready:
+				del remaining[name]
+			for deps in remaining.values():
+				deps.difference_update(ready)
+
+	def _run_stage(self, stage: Stage, inputs: Dict[str, Any]) -> StageResult:
+		logging.info(f'--- {stage.name} ---')
+		start = time.perf_counter()
+		try:
+			with span(stage.name):
+				value = stage.func(inputs)
+		except Exception as e:
+			logging.error(f'失敗: {stage.name}: {e}')
+			return StageResult(stage.name, 'failed', elapsed=time.perf_counter() - start, error=str(e))
+		return StageResult(stage.name, 'ok', value, elapsed=time.perf_counter() - start)
+
+	def run(self) -> Dict[str, StageResult]:
+		self._check()
+		self.results = {}
+		pending = dict(self.stages)
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			running = {}
+			while pending or running:
+				for name, stage in list(pending.items()):
+					dep_results = [self.results.get(dep) for dep in stage.deps]
+					if any(r is not None and r.status != 'ok' for r in dep_results):
+						logging.warning(f'依存ステージ失敗のためスキップ: {name}')
+						self.results[name] = StageResult(name, 'skipped')
+						del pending[name]
+					elif all(r is not None for r in dep_results):
+						inputs = {dep: self.results[dep].value for dep in stage.deps}
+						running[pool.submit(self._run_stage, stage, inputs)] = name
+						del pending[name]
+				if not running:
+					continue
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					del running[future]
+					result = future.result()
+					self.results[result.name] = result
+		for name in self.stages:
+			result = self.results[name]
+			logging.info(f'ステージ所要時間: {name}: {result.elapsed:.2f} 秒 ({result.status})')
+		return self.results
+
+	@property
+	def failed(self) -> List[str]:
+		return [name for name, r in self.results.items() if r.status != 'ok']
+
+
+def map_parallel(func: Callable[[Any], Any], items: Iterable[Any], workers: int = 4, desc: str = '') -> Dict[Any, Any]:
+	"""銘柄単位などのタスクをスレッドプールで並列実行する。失敗した要素は結果に含めずログのみ残す。"""
+	items = list(items)
+	results: Dict[Any, Any] = {}
+	start = time.perf_counter()
+
+	def timed(item):
+		with span(desc or getattr(func, '__name__', 'task'), str(item)):
+			return func(item)
+	with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+		futures = {pool.submit(timed, item): item for item in items}
+		for future in futures:
+			item = futures[future]
+			try:
+				results[item] = future.result()
+			except Exception as e:
+				logging.error(f'{desc}失敗: {item}: {e}')
+	logging.info(f'{desc}: {len(results)}/{len(items)} 件成功, {time.perf_counter() - start:.2f} 秒')
+	return results
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+	"""CPU処理用のプロセスプール。パイプラインはダウンロード・DAGのスレッドが動いている中でプールを作るため、
+	ロックを持ったままのスレッドごとforkしないよう、forkserver（ない環境ではspawn）でワーカーを起動する"""
+	method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+	return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
@@ -0,0 +1,184 @@
+import os
+from typing import Dict, List, Sequence, Tuple
+
+from ai_analysis_engine import DEFAULT_MODEL, estimate_tokens
+from xbrl_facts_store import XBRL_CSV_NAME, iter_xbrl_csv_rows, to_number
+from ticker_placement import iter_ticker_csvs
+
+
+# プロンプトの既定のトークン上限
+DEFAULT_TOKEN_BUDGET = 1500
+
+# 主要項目（表示名, 候補の要素名）。要素名は名前空間を除いた部分で照合し、先に書いた候補を優先する
+KEY_ELEMENTS: List[Tuple[str, Sequence[str]]] = [
+	('売上高', ('NetSalesSummaryOfBusinessResults', 'RevenueIFRSSummaryOfBusinessResults',
+		'OperatingRevenue1SummaryOfBusinessResults', 'NetSales', 'Revenue', 'RevenueIFRS', 'OperatingRevenue1')),
+	('営業利益', ('OperatingIncome', 'OperatingProfitLossIFRS', 'OperatingIncomeLossSummaryOfBusinessResults')),
+	('経常利益', ('OrdinaryIncomeLossSummaryOfBusinessResults', 'OrdinaryIncome')),
+	('当期純利益', ('ProfitLossAttributableToOwnersOfParentSummaryOfBusinessResults',
+		'ProfitLossAttributableToOwnersOfParentIFRSSummaryOfBusinessResults', 'NetIncomeLossSummaryOfBusinessResults',
+		'ProfitLossAttributableToOwnersOfParent', 'ProfitLoss')),
+	('総資産', ('TotalAssetsSummaryOfBusinessResults', 'TotalAssetsIFRSSummaryOfBusinessResults', 'Assets', 'AssetsIFRS')),
+	('純資産', ('NetAssetsSummaryOfBusinessResults', 'EquityAttributableToOwnersOfParentIFRSSummaryOfBusinessResults',
+		'NetAssets', 'EquityIFRS')),
+	('自己資本比率', ('EquityToAssetRatioSummaryOfBusinessResults', 'RatioOfOwnersEquityToGrossAssetsIFRSSummaryOfBusinessResults')),
+	('自己資本利益率', ('RateOfReturnOnEquitySummaryOfBusinessResults', 'RateOfReturnOnEquityIFRSSummaryOfBusinessResults')),
+	('営業キャッシュ・フロー', ('NetCashProvidedByUsedInOperatingActivitiesSummaryOfBusinessResults',
+		'CashFlowsFromUsedInOperatingActivitiesIFRSSummaryOfBusinessResults', 'NetCashProvidedByUsedInOperatingActivities')),
+	('投資キャッシュ・フロー', ('NetCashProvidedByUsedInInvestingActivitiesSummaryOfBusinessResults',
+		'CashFlowsFromUsedInInvestingActivitiesIFRSSummaryOfBusinessResults', 'NetCashProvidedByUsedInInvestmentActivities')),
+	('財務キャッシュ・フロー', ('NetCashProvidedByUsedInFinancingActivitiesSummaryOfBusinessResults',
+		'CashFlowsFromUsedInFinancingActivitiesIFRSSummaryOfBusinessResults', 'NetCashProvidedByUsedInFinancingActivities')),
+	('現金及び現金同等物', ('CashAndCashEquivalentsSummaryOfBusinessResults',
+		'CashAndCashEquivalentsIFRSSummaryOfBusinessResults', 'CashAndCashEquivalents')),
+]
+
+# 期間（表示名, コンテキストIDの候補）。年次→四半期累計の順に探す
+PERIODS: List[Tuple[str, Sequence[str]]] = [
+	('当期', ('CurrentYearDuration', 'CurrentYearInstant', 'CurrentYTDDuration', 'CurrentQuarterInstant')),
+	('前期', ('Prior1YearDuration', 'Prior1YearInstant', 'Prior1YTDDuration', 'Prior1QuarterInstant')),
+]
+NON_CONSOLIDATED = '_NonConsolidatedMember'
+
+# Yahoo Financeの保存CSVから載せる行（ファイル名, 行名）
+YAHOO_ROWS: List[Tuple[str, Sequence[str]]] = [
+	('financials.csv', ('Total Revenue', 'Operating Income', 'Net Income')),
+	('balance_sheet.csv', ('Total Assets', 'Stockholders Equity')),
+	('cashflow.csv', ('Operating Cash Flow', 'Free Cash Flow')),
+]
+YAHOO_INFO_FIELDS = ('longName', 'sector', 'industry', 'marketCap', 'trailingPE', 'priceToBook', 'dividendYield')
+
+
+def token_counter() -> str:
+	"""トークン数の数え方（tiktoken / estimate）。環境によって切り詰め位置が変わるため、分析のフィンガープリントに含める。
+	tiktokenは追加依存（pip install .[tokens]）"""
+	try:
+		import tiktoken  # noqa: F401
+	except ImportError:
+		return 'estimate'
+	return 'tiktoken'
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+	"""tiktokenがあれば実際のトークン数、なければ概算を返す"""
+	if token_counter() == 'estimate':
+		return estimate_tokens(text)
+	import tiktoken
+	try:
+		encoding = tiktoken.encoding_for_model(model)
+	except KeyError:
+		encoding = tiktoken.get_encoding('cl100k_base')
+	return len(encoding.encode(text))
+
+
+def format_value(value_text: str) -> str:
+	number = to_number(value_text)
+	if number is None:
+		return value_text.strip()
+	if number.is_integer():
+		return f'{int(number):,}'
+	return f'{number:.4g}'
+
+
+def _filing_csvs(ticker_dir: str, catalog=None) -> List[Tuple[str, str]]:
+	"""提出書類本体（監査報告書 jpaud を除く）のXBRL_TO_CSVを提出日の新しい順に返す"""
+	files = []
+	for name, path in iter_ticker_csvs(ticker_dir, catalog):
+		# 配置時に付く内容ハッシュ（stem.<hash>.csv）を除いてファイル名を照合する
+		stem, ext = os.path.splitext(name)
+		base = stem.rsplit('.', 1)[0] + ext if '.' in stem else name
+		m = XBRL_CSV_NAME.match(base)
+		if m and not m.group('form').startswith('jpaud'):
+			files.append((m.group('submitted'), name, path))
+	files.sort(key=lambda f: (f[0], f[1]), reverse=True)
+	return [(name, path) for _submitted, name, path in files]
+
+
+def select_key_facts(ticker_dir: str, catalog=None) -> List[Tuple[str, Dict[str, str]]]:
+	"""主要項目ごとに {期間: 値} を返す。最新の書類の値を優先し、連結がなければ個別の値を使う"""
+	wanted = {local for _label, candidates in KEY_ELEMENTS for local in candidates}
+	contexts = {ctx for _period, ctxs in PERIODS for ctx in ctxs}
+	# (要素名, コンテキストID) → 値。新しい書類から読むので最初に見つけた値を残す
+	found: Dict[Tuple[str, str], str] = {}
+	for _name, path in _filing_csvs(ticker_dir, catalog):
+		for fact in iter_xbrl_csv_rows(path):
+			local = fact['element_id'].rsplit(':', 1)[-1]
+			if local not in wanted:
+				continue
+			ctx = fact['context_id']
+			base_ctx = ctx[:-len(NON_CONSOLIDATED)] if ctx.endswith(NON_CONSOLIDATED) else ctx
+			if base_ctx in contexts and (local, ctx) not in found and fact['value_text'].strip():
+				found[(local, ctx)] = fact['value_text']
+
+	selected = []
+	for label, candidates in KEY_ELEMENTS:
+		values: Dict[str, str] = {}
+		for period, ctxs in PERIODS:
+			for suffix in ('', NON_CONSOLIDATED):
+				value = next((found[(local, ctx + suffix)] for local in candidates for ctx in ctxs
+					if (local, ctx + suffix) in found), None)
+				if value is not None:
+					values[period] = format_value(value) + ('（個別）' if suffix else '')
+					break
+		if values:
+			selected.append((label, values))
+	return selected
+
+
+def _yahoo_lines(ticker_dir: str) -> List[str]:
+	import csv
+	lines = []
+	info_path = os.path.join(ticker_dir, 'info.csv')
+	if os.path.exists(info_path):
+		with open(info_path, encoding='utf-8', newline='') as f:
+			row = next(csv.DictReader(f), None) or {}
+		for field in YAHOO_INFO_FIELDS:
+			if row.get(field):
+				lines.append(f'{field}: {format_value(row[field])}')
+	for fname, wanted in YAHOO_ROWS:
+		path = os.path.join(ticker_dir, fname)
+		if not os.path.exists(path):
+			continue
+		with open(path, encoding='utf-8', newline='') as f:
+			reader = csv.reader(f)
+			header = next(reader, [])
+			for row in reader:
+				if row and row[0] in wanted:
+					# 直近2期のみ
+					cells = [f'{header[i]} {format_value(row[i])}' for i in range(1, min(3, len(row))) if row[i]]
+					lines.append(f'{row[0]}: ' + ' / '.join(cells))
+	return lines
+
+
+def build_ticker_prompt(ticker: str, ticker_dir: str, token_budget: int = DEFAULT_TOKEN_BUDGET,
+		model: str = DEFAULT_MODEL, catalog=None) -> str:
+	"""主要XBRL項目（当期・前期）とYahoo Financeの要約をトークン上限内に収めたプロンプトを返す。
+	入力が同じなら同じバイト列になる（ファイルの列挙順に依存しない）。catalogを渡すとCSVの一覧を目録から引く"""
+	header = (f'以下は{ticker}の主要財務データです（単位の記載がない金額は円）。'
+			  f'当期と前期を比較し、収益性・財務健全性・キャッシュ・フローの観点で財務分析を日本語で要約してください。')
+	sections: List[Tuple[str, List[str]]] = []
+	facts = select_key_facts(ticker_dir, catalog)
+	if facts:
+		sections.append(('有価証券報告書等（XBRL）', [
+			f'{label}: ' + ' / '.join(f'{period} {values[period]}' for period, _ctxs in PERIODS if period in values)
+			for label, values in facts]))
+	yahoo = _yahoo_lines(ticker_dir)
+	if yahoo:
+		sections.append(('Yahoo Finance', yahoo))
+
+	parts = [header]
+	used = count_tokens(header, model)
+	for title, lines in sections:
+		title_line = f'\n--- {title} ---'
+		cost = count_tokens(title_line, model)
+		if used + cost > token_budget:
+			break
+		parts.append(title_line)
+		used += cost
+		for line in lines:
+			cost = count_tokens('\n' + line, model)
+			if used + cost > token_budget:
+				break
+			parts.append(line)
+			used += cost
+	return '\n'.join(parts)
@@ -0,0 +1,271 @@
+import os
+import sys
+import logging
+import argparse
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+import instrumentation
+from work_queue import (JobQueue, Job, STATUSES, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_DELAY,
+	default_queue_path, drain)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# キュー名（取り出しはこの順に優先する）。mapは書類単位、yahoo・analyzeはティッカー単位
+QUEUE_MAP = 'map'
+QUEUE_YAHOO = 'yahoo'
+QUEUE_ANALYZE = 'analyze'
+QUEUES = (QUEUE_MAP, QUEUE_YAHOO, QUEUE_ANALYZE)
+
+
+class DayJobs:
+	"""1日分のステージ3（証券コード割当・配置）・Yahoo Finance取得・AI分析をジョブ単位で処理するハンドラ。
+	割当てが終わった書類のティッカーについて、Yahoo Finance取得とAI分析のジョブを登録する。AI分析は
+	同じティッカーの取得と、同じ日付の全書類の配置（同じティッカーに複数の書類がある場合がある）の後に行う"""
+
+	def __init__(self, queue: JobQueue, workers: int = 4, model: Optional[str] = None):
+		from stage_state import StageState, default_state_path
+		from data_catalog import DataCatalog, default_catalog_path
+		self.queue = queue
+		self.workers = workers
+		self.model = model
+		self.state = StageState(default_state_path(BASE_DIR))
+		self.catalog = DataCatalog(default_catalog_path(BASE_DIR))
+		self._index = None
+		self._filings: Dict[str, Dict[str, str]] = {}
+		self._metadata: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+	@property
+	def handlers(self):
+		return {QUEUE_MAP: self.map, QUEUE_YAHOO: self.yahoo, QUEUE_ANALYZE: self.analyze}
+
+	def _code_index(self):
+		# コードマスタの読込は重いため、ワーカーごとに最初のmapジョブで1回だけ行う
+		if self._index is None:
+			import yyyymmddallcsv2tickersymbol2data as mapping
+			self._index = mapping.CompanyNameIndex(mapping.load_company_code_map(mapping.default_code_map_path(BASE_DIR)))
+		return self._index
+
+	def _day(self, date: str):
+		from filing_archive import list_filings
+		from document_metadata import load_document_metadata
+		if date not in self._filings:
+			day_dir = os.path.join(BASE_DIR, 'data', date)
+			self._filings[date] = self.catalog.filings(date) or list_filings(day_dir)
+			self._metadata[date] = load_document_metadata(day_dir)
+		return self._filings[date], self._metadata[date]
+
+	def map(self, jobs: List[Job]) -> Dict[int, Any]:
+		import yyyymmddallcsv2tickersymbol2data as mapping
+		from document_metadata import doc_id_from_folder
+		index = self._code_index()
+		index.prepare(mapping.parse_company_from_folder(job.item) for job in jobs)
+		results: Dict[int, Any] = {}
+		for job in jobs:
+			try:
+				filings, metadata = self._day(job.date)
+				if job.item not in filings:
+					raise FileNotFoundError(f'書類が見つかりません: data/{job.date}/{job.item}')
+				result, ticker, company = mapping.map_filing(BASE_DIR, job.date, job.item, filings[job.item], index,
+					metadata.get(doc_id_from_folder(job.item)), (job.payload or {}).get('placement', 'link'), self.state,
+					self.catalog)
+			except Exception as e:
+				results[job.id] = e
+				continue
+			if ticker:
+				self.queue.enqueue(QUEUE_YAHOO, [ticker], date=job.date, max_attempts=job.max_attempts)
+				self.queue.enqueue(QUEUE_ANALYZE, [ticker], date=job.date, after=QUEUE_YAHOO, barrier=QUEUE_MAP,
+					max_attempts=job.max_attempts)
+			results[job.id] = {'result': result, 'ticker': ticker, 'company': company}
+		return results
+
+	def yahoo(self, jobs: List[Job]) -> Dict[int, Any]:
+		from batch_yahoofinance import fetch_tickers
+		from yahoofinance2data import stale_datasets
+		fetched = fetch_tickers([job.item for job in jobs], workers=self.workers, catalog=self.catalog)
+		results: Dict[int, Any] = {}
+		for job in jobs:
+			# キャッシュが有効で取得しなかったティッカーも成功とする
+			if job.item in fetched or not stale_datasets(os.path.join(BASE_DIR, 'data', job.item)):
+				results[job.id] = None
+			else:
+				results[job.id] = RuntimeError('Yahoo Finance取得失敗')
+		return results
+
+	def analyze(self, jobs: List[Job]) -> Dict[int, Any]:
+		import yyyymmddaifinanceanalysisfortickersymbol as analysis
+		from ai_analysis_engine import DEFAULT_MODEL
+		from prompt_builder import DEFAULT_TOKEN_BUDGET
+		model = self.model or DEFAULT_MODEL
+		results: Dict[int, Any] = {}
+		for date in dict.fromkeys(job.date for job in jobs):
+			batch = [job for job in jobs if job.date == date]
+			try:
+				analyzed = analysis.analyze_tickers([job.item for job in batch], workers=self.workers, model=model,
+					state=self.state, date=date, catalog=self.catalog)
+			except RuntimeError as e:
+				# 全件失敗（APIキー未設定等）は同じ日付のジョブをまとめて失敗にする（他の日付は続ける）
+				results.update((job.id, e) for job in batch)
+				continue
+			for job in batch:
+				ticker_dir = os.path.join(BASE_DIR, 'data', job.item)
+				# ディレクトリのないティッカー・前回から変更のないティッカーは分析しないが成功とする
+				if job.item in analyzed or not os.path.isdir(ticker_dir) or self.state.is_done(
+						analysis.STATE_STAGE, job.item, analysis.ticker_fingerprint(ticker_dir, model, DEFAULT_TOKEN_BUDGET, self.catalog)):
+					results[job.id] = None
+				else:
+					results[job.id] = RuntimeError('AI分析失敗')
+		return results
+
+	def close(self) -> None:
+		self.catalog.close()
+		self.state.close()
+
+
+def enqueue_day(queue: JobQueue, date: str, queues=(QUEUE_MAP,), placement: str = 'link',
+		max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Dict[str, int]:
+	"""1日分のジョブを登録する。mapはdata/yyyymmdd配下の書類、yahoo・analyzeはcompany_code_map.csvの銘柄"""
+	from filing_archive import list_filings
+	from batch_yahoofinance import load_tickers
+	added = {}
+	if QUEUE_MAP in queues:
+		day_dir = os.path.join(BASE_DIR, 'data', date)
+		if not os.path.isdir(day_dir):
+			raise FileNotFoundError(f'対象ディレクトリが見つかりません: {day_dir}')
+		added[QUEUE_MAP] = queue.enqueue(QUEUE_MAP, list_filings(day_dir), date=date,
+			payload={'placement': placement}, max_attempts=max_attempts)
+	ticker_queues = [q for q in (QUEUE_YAHOO, QUEUE_ANALYZE) if q in queues]
+	if ticker_queues:
+		tickers = load_tickers(date)
+		if tickers is None:
+			raise FileNotFoundError(f'company_code_map.csvが読めません: {date}')
+		for name in ticker_queues:
+			after = QUEUE_YAHOO if name == QUEUE_ANALYZE and QUEUE_YAHOO in ticker_queues else None
+			added[name] = queue.enqueue(name, tickers, date=date, after=after, max_attempts=max_attempts)
+	return added
+
+
+def write_code_map(queue: JobQueue, date: str) -> bool:
+	"""mapジョブが全て終わっていれば、その結果からcompany_code_map.csv等を出力する（どのワーカーが書いても同じ内容）。
+	各ワーカーはmapジョブの結果を記録するたびに呼ぶため、その日付の最後のmapジョブを終えたワーカーが書く"""
+	from yyyymmddallcsv2tickersymbol2data import write_day_outputs
+	if queue.unfinished([QUEUE_MAP], date):
+		return False
+	jobs = queue.jobs(QUEUE_MAP, date)
+	if not jobs:
+		return False
+	rows, unmatched = [], []
+	for job in jobs:
+		result = job['result'] or {}
+		if result.get('ticker'):
+			rows.append([result['ticker'][:-len('.T')], result['company']])
+		elif result.get('result') == 'unmatched':
+			unmatched.append((job['item'], result['company']))
+	write_day_outputs(os.path.join(BASE_DIR, 'data', date), rows, unmatched)
+	return True
+
+
+def work(db_path: str, queues, date: Optional[str] = None, shared: bool = False, workers: int = 4, batch: int = 4,
+		lease_seconds: float = DEFAULT_LEASE_SECONDS, retry_delay: float = DEFAULT_RETRY_DELAY, wait: bool = False,
+		model: Optional[str] = None) -> Dict[str, int]:
+	"""1ワーカー分の処理（複数プロセスで起動する場合もこの関数を各プロセスで実行する）"""
+	queue = JobQueue(db_path, shared=shared)
+	jobs = DayJobs(queue, workers=workers, model=model)
+
+	def after_batch(name: str, batch_jobs: List[Job]) -> None:
+		# 日付を指定しない場合も、mapジョブが終わった日付ごとにその時点で出力する
+		if name == QUEUE_MAP:
+			for job_date in dict.fromkeys(job.date for job in batch_jobs):
+				try:
+					write_code_map(queue, job_date)
+				except OSError as e:
+					logging.error(f'company_code_map.csvの出力失敗: {job_date}: {e}')
+
+	try:
+		summary = drain(queue, jobs.handlers, queues, date=date, batch=batch, lease_seconds=lease_seconds,
+			retry_delay=retry_delay, wait=wait, on_batch=after_batch)
+		if date and QUEUE_MAP in queues:
+			# 最後のmapジョブを終えたワーカーが出力前に止まった場合の取りこぼしを防ぐ
+			write_code_map(queue, date)
+		return summary
+	finally:
+		jobs.close()
+		queue.close()
+
+
+def print_status(queue: JobQueue, date: Optional[str] = None) -> None:
+	counts = queue.counts(date=date)
+	for name in sorted(counts, key=lambda q: QUEUES.index(q) if q in QUEUES else len(QUEUES)):
+		print(f'{name}: ' + ', '.join(f'{status} {counts[name][status]}' for status in STATUSES))
+		for job in queue.jobs(name, date, status='dead'):
+			print(f'  dead {job["date"]} {job["item"]} 試行 {job["attempts"]}: {job["error"]}')
+
+
+def main():
+	parser = argparse.ArgumentParser(description='証券コード割当・Yahoo Finance取得・AI分析をジョブキュー経由で複数ワーカーに分担させる')
+	parser.add_argument('command', choices=('enqueue', 'work', 'status', 'requeue'),
+		help='enqueue: ジョブ登録 / work: ワーカーとして処理 / status: 状態表示 / requeue: 打ち切ったジョブを再登録')
+	parser.add_argument('date', nargs='?', help='対象日 yyyymmdd（work・status・requeueでは省略時は全日付）')
+	parser.add_argument('--queues', default=None,
+		help=f'対象のキュー（カンマ区切り、既定: enqueueは{QUEUE_MAP}、それ以外は{",".join(QUEUES)}）')
+	parser.add_argument('--db', default=default_queue_path(BASE_DIR), help='ジョブキューのSQLiteファイル')
+	parser.add_argument('--shared', action='store_true', help='複数ホストで共有する（WALを使わない。共有ファイルシステムに置く）')
+	parser.add_argument('--placement', choices=('link', 'copy', 'manifest'), default='link', help='enqueue: CSVの配置方法')
+	parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='enqueue: 打ち切るまでの試行回数')
+	parser.add_argument('--processes', type=int, default=1, help='work: 起動するワーカープロセス数')
+	parser.add_argument('--workers', type=int, default=4, help='work: ワーカー内の同時取得数・同時リクエスト数')
+	parser.add_argument('--batch', type=int, default=4, help='work: 1回に取り出すジョブ数')
+	parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='work: リース期間（秒）')
+	parser.add_argument('--retry-delay', type=float, default=DEFAULT_RETRY_DELAY, help='work: 再試行までの初期間隔（秒）')
+	parser.add_argument('--wait', action='store_true', help='work: ジョブがなくなっても終了せず新しいジョブを待つ')
+	parser.add_argument('--model', default=None, help='work: AI分析のモデル名')
+	parser.add_argument('--status', dest='requeue_status', choices=('dead', 'done'), default='dead',
+		help='requeue: 再登録する状態')
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+	queues = tuple(args.queues.split(',')) if args.queues else ((QUEUE_MAP,) if args.command == 'enqueue' else QUEUES)
+	unknown = [q for q in queues if q not in QUEUES]
+	if unknown:
+		logging.error(f'不明なキュー: {",".join(unknown)}')
+		sys.exit(1)
+
+	if args.command == 'work':
+		kwargs = dict(date=args.date, shared=args.shared, workers=args.workers, batch=args.batch,
+			lease_seconds=args.lease, retry_delay=args.retry_delay, wait=args.wait, model=args.model)
+		if args.processes <= 1:
+			work(args.db, queues, **kwargs)
+		else:
+			procs = [multiprocessing.Process(target=work, args=(args.db, queues), kwargs=kwargs)
+				for _ in range(args.processes)]
+			for p in procs:
+				p.start()
+			for p in procs:
+				p.join()
+		instrumentation.log_summary()
+		return
+
+	queue = JobQueue(args.db, shared=args.shared)
+	try:
+		if args.command == 'enqueue':
+			if not args.date:
+				parser.error('enqueueには対象日を指定してください')
+			try:
+				added = enqueue_day(queue, args.date, queues, placement=args.placement, max_attempts=args.max_attempts)
+			except FileNotFoundError as e:
+				logging.error(str(e))
+				sys.exit(1)
+			logging.info('ジョブ登録: ' + ', '.join(f'{name} {n} 件' for name, n in added.items()))
+		elif args.command == 'requeue':
+			n = queue.requeue(queues, args.date, status=args.requeue_status)
+			logging.info(f'再登録: {n} 件')
+		else:
+			print_status(queue, args.date)
+	finally:
+		queue.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+
+# ステージごとに、処理済みの項目（docIDのフォルダ名・ティッカー等）と入力のフィンガープリントを記録する
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stage_items (
+	stage TEXT NOT NULL,
+	item TEXT NOT NULL,
+	date TEXT,
+	fingerprint TEXT NOT NULL,
+	output TEXT,
+	updated_at TEXT NOT NULL,
+	PRIMARY KEY (stage, item)
+)
+'''
+
+
+def default_state_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'stage_state.sqlite')
+
+
+def fingerprint_paths(paths: Iterable[str], extra: str = '') -> str:
+	"""ファイル・ディレクトリ配下のファイルの (パス, サイズ, 更新日時) から入力のフィンガープリントを求める（内容は読まない）"""
+	hasher = hashlib.sha1(extra.encode('utf-8'))
+	for root in sorted(paths):
+		if os.path.isfile(root):
+			entries = [(root, os.path.basename(root))]
+		elif os.path.isdir(root):
+			entries = sorted(
+				(os.path.join(cur, fn), os.path.relpath(os.path.join(cur, fn), root))
+				for cur, _dirs, files in os.walk(root) for fn in files)
+		else:
+			hasher.update(f'missing:{root}\n'.encode('utf-8'))
+			continue
+		for path, rel in entries:
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			hasher.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8'))
+	return hasher.hexdigest()
+
+
+class StageState:
+	"""ステージ単位の処理済み台帳（SQLite）。入力が変わっていない項目は再処理しない"""
+
+	def __init__(self, path: str):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute(SCHEMA)
+		self._conn.commit()
+
+	def get(self, stage: str, item: str) -> Optional[Dict[str, str]]:
+		with self._lock:
+			row = self._conn.execute(
+				'SELECT date, fingerprint, output, updated_at FROM stage_items WHERE stage = ? AND item = ?',
+				(stage, item)).fetchone()
+		if row is None:
+			return None
+		return dict(zip(['date', 'fingerprint', 'output', 'updated_at'], row))
+
+	def is_done(self, stage: str, item: str, fingerprint: str) -> bool:
+		"""前回と同じ入力で処理済みならTrue"""
+		entry = self.get(stage, item)
+		return entry is not None and entry['fingerprint'] == fingerprint
+
+	def mark(self, stage: str, item: str, fingerprint: str, date: Optional[str] = None,
+			output: Optional[str] = None) -> None:
+		now = datetime.now().isoformat(timespec='seconds')
+		with self._lock, self._conn:
+			self._conn.execute(
+				'INSERT OR REPLACE INTO stage_items (stage, item, date, fingerprint, output, updated_at) '
+				'VALUES (?, ?, ?, ?, ?, ?)', (stage, item, date, fingerprint, output, now))
+
+	def items(self, stage: str, date: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+		"""ステージの処理済み項目→記録（dateを指定した場合はその日付のみ）"""
+		sql = 'SELECT item, date, fingerprint, output, updated_at FROM stage_items WHERE stage = ?'
+		params = [stage]
+		if date:
+			sql += ' AND date = ?'
+			params.append(date)
+		with self._lock:
+			rows = self._conn.execute(sql, params).fetchall()
+		return {row[0]: dict(zip(['date', 'fingerprint', 'output', 'updated_at'], row[1:])) for row in rows}
+
+	def reset(self, stage: Optional[str] = None, date: Optional[str] = None) -> int:
+		"""記録を消して次回は再処理させる。消した件数を返す"""
+		where, params = [], []
+		if stage:
+			where.append('stage = ?')
+			params.append(stage)
+		if date:
+			where.append('date = ?')
+			params.append(date)
+		sql = 'DELETE FROM stage_items' + (' WHERE ' + ' AND '.join(where) if where else '')
+		with self._lock, self._conn:
+			return self._conn.execute(sql, params).rowcount
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
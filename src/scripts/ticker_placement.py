@@ -0,0 +1,176 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, Tuple
+
+import filing_archive
+
+
+# 配置方式: link（ハードリンク→reflink→コピーの順に試す） / copy / manifest（実体を置かず参照のみ記録）
+PLACEMENT_MODES = ('link', 'copy', 'manifest')
+MANIFEST_FILENAME = 'placement_manifest.jsonl'
+
+# Linux の FICLONE ioctl（btrfs/XFS等でのreflink）
+FICLONE = 0x40049409
+
+_manifest_lock = threading.Lock()
+
+
+def content_digest(path: str, block_size: int = 1024 * 1024) -> str:
+	hasher = hashlib.blake2b(digest_size=16)
+	with filing_archive.open_binary(path) as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			hasher.update(block)
+	return hasher.hexdigest()
+
+
+def content_addressed_name(filename: str, digest: str) -> str:
+	"""内容のハッシュを付けたファイル名（同名でも内容の異なる書類が衝突しない）"""
+	stem, ext = os.path.splitext(filename)
+	return f'{stem}.{digest[:12]}{ext}'
+
+
+def logical_name(filename: str) -> str:
+	"""content_addressed_nameで付けた内容ハッシュ（.<16進12桁>）を除いたファイル名（付いていなければそのまま）"""
+	stem, ext = os.path.splitext(os.path.basename(filename))
+	base, dot, suffix = stem.rpartition('.')
+	if dot and len(suffix) == 12 and all(c in '0123456789abcdef' for c in suffix):
+		return base + ext
+	return os.path.basename(filename)
+
+
+def _reflink(src: str, dst: str) -> bool:
+	try:
+		import fcntl
+	except ImportError:
+		return False
+	try:
+		with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+			fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+		shutil.copystat(src, dst)
+		return True
+	except OSError:
+		if os.path.exists(dst):
+			os.remove(dst)
+		return False
+
+
+def link_or_copy(src: str, dst: str) -> str:
+	"""ハードリンク→reflink→コピーの順に配置し、使った方式を返す"""
+	try:
+		os.link(src, dst)
+		return 'hardlink'
+	except OSError as e:
+		if e.errno == errno.EEXIST:
+			raise
+	if _reflink(src, dst):
+		return 'reflink'
+	shutil.copy2(src, dst)
+	return 'copy'
+
+
+def extract_member(src: str, dst: str) -> str:
+	"""ZIP内のメンバーを1件だけ書き出す（一時ファイルに書いてから差し替える）"""
+	tmp_path = dst + '.part'
+	with filing_archive.open_binary(src) as fsrc, open(tmp_path, 'wb') as fdst:
+		shutil.copyfileobj(fsrc, fdst, 256 * 1024)
+	os.replace(tmp_path, dst)
+	return 'extract'
+
+
+def load_manifest(ticker_dir: str) -> Dict[str, Dict[str, object]]:
+	"""配置名→マニフェストのエントリ"""
+	path = os.path.join(ticker_dir, MANIFEST_FILENAME)
+	entries: Dict[str, Dict[str, object]] = {}
+	if not os.path.exists(path):
+		return entries
+	with open(path, encoding='utf-8') as f:
+		for line in f:
+			line = line.strip()
+			if line:
+				entry = json.loads(line)
+				entries[entry['name']] = entry
+	return entries
+
+
+def _append_manifest(ticker_dir: str, entry: Dict[str, object]) -> None:
+	with _manifest_lock:
+		with open(os.path.join(ticker_dir, MANIFEST_FILENAME), 'a', encoding='utf-8') as f:
+			f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def remove_manifest_entries(ticker_dir: str, names: Iterable[str]) -> int:
+	"""マニフェストから指定した配置名の参照を取り除き、取り除いた件数を返す"""
+	names = set(names)
+	path = os.path.join(ticker_dir, MANIFEST_FILENAME)
+	with _manifest_lock:
+		entries = load_manifest(ticker_dir)
+		kept = [entry for name, entry in entries.items() if name not in names]
+		if len(kept) == len(entries):
+			return 0
+		tmp_path = path + '.part'
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			for entry in kept:
+				f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+		os.replace(tmp_path, path)
+	return len(entries) - len(kept)
+
+
+def iter_ticker_csvs(ticker_dir: str, catalog=None) -> Iterator[Tuple[str, str]]:
+	"""ティッカーディレクトリのCSVを (ファイル名, 実体のパス) で列挙する。マニフェストの参照も含む
+	（ZIP内のメンバーを参照する場合は filing_archive の仮想パス）。
+	ファイルシステムによらず同じ順序になるよう名前順で返す。catalog（DataCatalog）に載っていれば目録から返す"""
+	listed = catalog.ticker_csvs(ticker_dir) if catalog is not None else None
+	if listed is not None:
+		yield from listed
+		return
+	for fname in sorted(os.listdir(ticker_dir)):
+		if fname.lower().endswith('.csv'):
+			yield fname, os.path.join(ticker_dir, fname)
+	for name, entry in sorted(load_manifest(ticker_dir).items()):
+		path = str(entry['path'])
+		if not os.path.isabs(path):
+			path = os.path.normpath(os.path.join(ticker_dir, path))
+		if filing_archive.exists(path):
+			yield name, path
+
+
+def place_csv(csv_path: str, ticker_dir: str, mode: str = 'link') -> Tuple[bool, str]:
+	"""CSVを1件配置する。戻り値は (配置したか, 配置名)。同じ内容が配置済みならスキップ。
+	csv_pathがZIP内のメンバーの場合、manifestはZIP内を参照し、link/copyはメンバーだけを書き出す"""
+	fname = os.path.basename(csv_path)
+	digest = content_digest(csv_path)
+	name = content_addressed_name(fname, digest)
+	dst_path = os.path.join(ticker_dir, name)
+
+	# 配置済み（内容ハッシュ付きの名前、または従来のコピーで同じ内容）ならスキップ
+	if os.path.exists(dst_path):
+		return False, name
+	legacy_path = os.path.join(ticker_dir, fname)
+	size, _mtime_ns = filing_archive.stat(csv_path)
+	if os.path.exists(legacy_path) and os.path.getsize(legacy_path) == size \
+			and content_digest(legacy_path) == digest:
+		return False, fname
+
+	if mode == 'manifest':
+		if name in load_manifest(ticker_dir):
+			return False, name
+		_append_manifest(ticker_dir, {
+			'name': name,
+			'path': os.path.relpath(csv_path, ticker_dir),
+			'size': size,
+			'blake2b': digest,
+		})
+		return True, name
+	if filing_archive.is_member_path(csv_path):
+		extract_member(csv_path, dst_path)
+	elif mode == 'copy':
+		shutil.copy2(csv_path, dst_path)
+	else:
+		method = link_or_copy(csv_path, dst_path)
+		logging.debug(f'{method}: {csv_path} → {dst_path}')
+	return True, name
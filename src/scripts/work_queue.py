@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from instrumentation import REGISTRY
+
+
+# 状態: 'pending'（未処理・再試行待ち） / 'leased'（ワーカーが処理中） / 'done'（完了） / 'dead'（再試行上限で打ち切り）
+# lease_untilを過ぎたleasedのジョブは、ワーカーが停止したものとみなして他のワーカーが取り直す。
+# afterを指定したジョブは同じ日付・項目の after キューのジョブが、barrierを指定したジョブは同じ日付の
+# barrier キューの全ジョブが終わる（done/dead）まで取り出さない
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY,
+	queue TEXT NOT NULL,
+	date TEXT NOT NULL DEFAULT '',
+	item TEXT NOT NULL,
+	payload TEXT,
+	after TEXT,
+	barrier TEXT,
+	status TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	max_attempts INTEGER NOT NULL,
+	available_at REAL NOT NULL,
+	worker TEXT,
+	lease_until REAL,
+	error TEXT,
+	result TEXT,
+	updated_at TEXT NOT NULL,
+	UNIQUE (queue, date, item)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (queue, status, available_at);
+'''
+
+STATUSES = ('pending', 'leased', 'done', 'dead')
+
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 30.0
+MAX_RETRY_DELAY = 3600.0
+
+
+def default_queue_path(base_dir: str) -> str:
+	return os.path.join(base_dir, 'data', 'work_queue.sqlite')
+
+
+def default_worker_id() -> str:
+	return f'{socket.gethostname()}:{os.getpid()}'
+
+
+@dataclass
+class Job:
+	id: int
+	queue: str
+	date: str
+	item: str
+	payload: Any
+	attempts: int
+	max_attempts: int
+	worker: str
+
+
+class JobQueue:
+	"""複数のプロセス・ホストで共有するジョブキュー（SQLite）。
+	取り出し（claim）は書込みトランザクション内で行うため、同じジョブを2つのワーカーが同時に処理することはない。
+	ワーカーはリース期限を延長（heartbeat）しながら処理し、期限切れのジョブは他のワーカーが取り直す。
+	複数ホストから使う場合はファイルロックの効く共有ファイルシステムに置き、shared=True（WALを使わない）で開く"""
+
+	def __init__(self, path: str, shared: bool = False, timeout: float = 60.0):
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self._lock = threading.Lock()
+		# トランザクションは明示的に開始する（BEGIN IMMEDIATEで書込みロックを先に取る）
+		self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+		# WALは共有メモリを使うため同一ホスト内のみ。ホストをまたぐ場合はロールバックジャーナルにする
+		self._conn.execute('PRAGMA journal_mode=DELETE' if shared else 'PRAGMA journal_mode=WAL')
+		self._conn.executescript(SCHEMA)
+
+	def _write(self, func: Callable[[sqlite3.Connection, float], Any]) -> Any:
+		with self._lock:
+			self._conn.execute('BEGIN IMMEDIATE')
+			try:
+				value = func(self._conn, time.time())
+			except BaseException:
+				self._conn.execute('ROLLBACK')
+				raise
+			self._conn.execute('COMMIT')
+			return value
+
+	def enqueue(self, queue: str, items: Iterable[str], date: str = '', payload: Any = None,
+			after: Optional[str] = None, barrier: Optional[str] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+		"""ジョブを登録する。同じキュー・日付・項目のジョブが既にあれば登録しない。登録した件数を返す"""
+		now_text = datetime.now().isoformat(timespec='seconds')
+		payload_text = None if payload is None else json.dumps(payload, ensure_ascii=False)
+		items = list(items)
+
+		def insert(conn, now):
+			return sum(conn.execute(
+				'INSERT OR IGNORE INTO jobs (queue, date, item, payload, after, barrier, status, max_attempts, available_at, '
+				"updated_at) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?)",
+				(queue, date, item, payload_text, after, barrier, max_attempts, now, now_text)).rowcount for item in items)
+		return self._write(insert)
+
+	def _expire(self, conn: sqlite3.Connection, now: float, queues: Sequence[str]) -> None:
+		"""リース期限を過ぎたジョブを、再試行上限内なら未処理に戻し、上限に達していれば打ち切る"""
+		marks = ', '.join('?' * len(queues))
+		now_text = datetime.now().isoformat(timespec='seconds')
+		expired = conn.execute(
+			f"SELECT id, queue, worker, attempts, max_attempts FROM jobs WHERE queue IN ({marks}) "
+			"AND status = 'leased' AND lease_until < ?", (*queues, now)).fetchall()
+		for job_id, queue, worker, attempts, max_attempts in expired:
+			status = 'dead' if attempts >= max_attempts else 'pending'
+			conn.execute(
+				'UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, error = ?, updated_at = ? WHERE id = ?',
+				(status, f'リース期限切れ（ワーカー {worker} が停止した可能性）', now_text, job_id))
+			REGISTRY.inc('queue_jobs_total', queue=queue, result='expired')
+			logging.warning(f'リース期限切れのジョブを{"打ち切り" if status == "dead" else "取り直し"}: '
+				f'{queue} id={job_id} worker={worker} 試行 {attempts}/{max_attempts}')
+
+	def claim(self, queues: Sequence[str], worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+			date: Optional[str] = None, limit: int = 1) -> List[Job]:
+		"""キューを指定順に見て、最初に取り出せるジョブのあるキューから最大limit件をリースする"""
+		now_text = datetime.now().isoformat(timespec='seconds')
+
+		def take(conn, now):
+			self._expire(conn, now, queues)
+			for queue in queues:
+				sql = ("SELECT id, date, item, payload, attempts, max_attempts FROM jobs AS j "
+					"WHERE queue = ? AND status = 'pending' AND available_at <= ? "
+					"AND (after IS NULL OR NOT EXISTS (SELECT 1 FROM jobs AS d WHERE d.queue = j.after "
+					"AND d.date = j.date AND d.item = j.item AND d.status IN ('pending', 'leased'))) "
+					"AND (barrier IS NULL OR NOT EXISTS (SELECT 1 FROM jobs AS b WHERE b.queue = j.barrier "
+					"AND b.date = j.date AND b.status IN ('pending', 'leased')))")
+				params: List[Any] = [queue, now]
+				if date is not None:
+					sql += ' AND date = ?'
+					params.append(date)
+				rows = conn.execute(sql + ' ORDER BY available_at, id LIMIT ?', (*params, limit)).fetchall()
+				if not rows:
+					continue
+				jobs = []
+				for job_id, job_date, item, payload, attempts, max_attempts in rows:
+					conn.execute(
+						"UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+						'updated_at = ? WHERE id = ?', (worker, now + lease_seconds, now_text, job_id))
+					jobs.append(Job(job_id, queue, job_date, item, None if payload is None else json.loads(payload),
+						attempts + 1, max_attempts, worker))
+				return jobs
+			return []
+		return self._write(take)
+
+	def heartbeat(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+		"""ワーカーがリース中のジョブの期限を延長する。延長した件数を返す"""
+		def extend(conn, now):
+			return conn.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = 'leased'",
+				(now + lease_seconds, worker)).rowcount
+		return self._write(extend)
+
+	def complete(self, job: Job, result: Any = None) -> bool:
+		"""ジョブを完了にする。リースを失っていた（期限切れで他のワーカーが取り直した）場合はFalse"""
+		now_text = datetime.now().isoformat(timespec='seconds')
+		result_text = None if result is None else json.dumps(result, ensure_ascii=False)
+
+		def finish(conn, _now):
+			return conn.execute(
+				"UPDATE jobs SET status = 'done', worker = NULL, lease_until = NULL, error = NULL, result = ?, "
+				"updated_at = ? WHERE id = ? AND worker = ? AND attempts = ? AND status = 'leased'",
+				(result_text, now_text, job.id, job.worker, job.attempts)).rowcount == 1
+		ok = self._write(finish)
+		REGISTRY.inc('queue_jobs_total', queue=job.queue, result='done' if ok else 'lost')
+		return ok
+
+	def fail(self, job: Job, error: str, retry_delay: float = DEFAULT_RETRY_DELAY) -> str:
+		"""ジョブの失敗を記録する。再試行上限内なら指数的に間隔を空けて未処理に戻す。新しい状態を返す"""
+		now_text = datetime.now().isoformat(timespec='seconds')
+		status = 'dead' if job.attempts >= job.max_attempts else 'pending'
+		delay = min(retry_delay * 2 ** (job.attempts - 1), MAX_RETRY_DELAY) * random.uniform(0.8, 1.2)
+
+		def record(conn, now):
+			return conn.execute(
+				'UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, error = ?, available_at = ?, '
+				"updated_at = ? WHERE id = ? AND worker = ? AND attempts = ? AND status = 'leased'",
+				(status, error, now + delay, now_text, job.id, job.worker, job.attempts)).rowcount
+		if not self._write(record):
+			status = 'lost'
+		REGISTRY.inc('queue_jobs_total', queue=job.queue, result='retry' if status == 'pending' else status)
+		return status
+
+	def counts(self, queues: Optional[Sequence[str]] = None, date: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+		"""キュー→{状態: 件数}"""
+		sql = 'SELECT queue, status, COUNT(*) FROM jobs'
+		where, params = [], []
+		if queues:
+			where.append(f'queue IN ({", ".join("?" * len(queues))})')
+			params.extend(queues)
+		if date is not None:
+			where.append('date = ?')
+			params.append(date)
+		if where:
+			sql += ' WHERE ' + ' AND '.join(where)
+		with self._lock:
+			rows = self._conn.execute(sql + ' GROUP BY queue, status', params).fetchall()
+		counts: Dict[str, Dict[str, int]] = {}
+		for queue, status, n in rows:
+			counts.setdefault(queue, dict.fromkeys(STATUSES, 0))[status] = n
+		return counts
+
+	def unfinished(self, queues: Sequence[str], date: Optional[str] = None) -> int:
+		"""未処理・処理中のジョブ数（0なら全て完了か打ち切り）"""
+		return sum(c['pending'] + c['leased'] for c in self.counts(queues, date).values())
+
+	def jobs(self, queue: str, date: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
+		"""ジョブの一覧（登録順）"""
+		sql = 'SELECT item, date, status, attempts, worker, error, result FROM jobs WHERE queue = ?'
+		params: List[Any] = [queue]
+		if date is not None:
+			sql += ' AND date = ?'
+			params.append(date)
+		if status:
+			sql += ' AND status = ?'
+			params.append(status)
+		with self._lock:
+			rows = self._conn.execute(sql + ' ORDER BY id', params).fetchall()
+		keys = ['item', 'date', 'status', 'attempts', 'worker', 'error', 'result']
+		return [dict(zip(keys, row[:-1]), result=None if row[-1] is None else json.loads(row[-1])) for row in rows]
+
+	def requeue(self, queues: Sequence[str], date: Optional[str] = None, status: str = 'dead') -> int:
+		"""指定状態（既定は打ち切り）のジョブを試行回数を戻して未処理にする。件数を返す"""
+		now_text = datetime.now().isoformat(timespec='seconds')
+		sql = (f"UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, worker = NULL, lease_until = NULL, "
+			f"updated_at = ? WHERE status = ? AND queue IN ({', '.join('?' * len(queues))})")
+
+		def reset(conn, now):
+			params: List[Any] = [now, now_text, status, *queues]
+			if date is not None:
+				return conn.execute(sql + ' AND date = ?', (*params, date)).rowcount
+			return conn.execute(sql, params).rowcount
+		return self._write(reset)
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+class Heartbeat:
+	"""処理中のジョブのリースを別スレッドで定期的に延長する（with文で使う）"""
+
+	def __init__(self, queue: JobQueue, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+			interval: Optional[float] = None):
+		self.queue = queue
+		self.worker = worker
+		self.lease_seconds = lease_seconds
+		self.interval = interval or lease_seconds / 3
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			try:
+				self.queue.heartbeat(self.worker, self.lease_seconds)
+			except sqlite3.Error as e:
+				logging.warning(f'リース延長失敗: {e}')
+
+	def __enter__(self) -> 'Heartbeat':
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self._stop.set()
+		self._thread.join()
+
+
+def drain(queue: JobQueue, handlers: Dict[str, Callable[[List[Job]], Dict[int, Any]]], queues: Sequence[str],
+		worker: Optional[str] = None, date: Optional[str] = None, batch: int = 1,
+		lease_seconds: float = DEFAULT_LEASE_SECONDS, retry_delay: float = DEFAULT_RETRY_DELAY,
+		poll: float = 5.0, wait: bool = False,
+		on_batch: Optional[Callable[[str, List[Job]], None]] = None) -> Dict[str, int]:
+	"""キューのジョブを取り出して処理し続ける。handlers[キュー]はジョブのリストを受け取り、
+	{ジョブID: 結果} を返す（結果が例外のジョブ・含まれないジョブは失敗として再試行する）。
+	on_batch(キュー, ジョブ) は取り出した分の結果を記録した後に呼ぶ（キュー全体の完了を検知する等）。
+	未処理・処理中のジョブがなくなれば終わる（waitの場合は新しいジョブを待ち続ける）。結果別の件数を返す"""
+	worker = worker or default_worker_id()
+	summary = {'done': 0, 'retry': 0, 'dead': 0, 'lost': 0}
+	logging.info(f'ワーカー開始: {worker} キュー={",".join(queues)} 日付={date or "全て"}')
+	with Heartbeat(queue, worker, lease_seconds):
+		while True:
+			jobs = queue.claim(queues, worker, lease_seconds, date=date, limit=batch)
+			if not jobs:
+				if not wait and queue.unfinished(queues, date) == 0:
+					break
+				# 他のワーカーが処理中・再試行待ち・依存ジョブ待ちのジョブがある
+				time.sleep(poll)
+				continue
+			name = jobs[0].queue
+			start = time.perf_counter()
+			try:
+				results = handlers[name](jobs)
+			except Exception as e:
+				logging.error(f'ジョブ処理失敗: {name}: {e}')
+				results = {job.id: e for job in jobs}
+			REGISTRY.observe('item_seconds', (time.perf_counter() - start) / len(jobs), stage=f'キュー:{name}')
+			for job in jobs:
+				result = results.get(job.id, RuntimeError('結果なし'))
+				if isinstance(result, Exception):
+					status = queue.fail(job, f'{type(result).__name__}: {result}', retry_delay)
+					logging.warning(f'ジョブ失敗（{status}）: {name} {job.item} 試行 {job.attempts}/{job.max_attempts}: {result}')
+					summary['retry' if status == 'pending' else status] += 1
+				elif queue.complete(job, result):
+					summary['done'] += 1
+				else:
+					logging.warning(f'リースを失ったため結果を破棄: {name} {job.item}')
+					summary['lost'] += 1
+			if on_batch is not None:
+				on_batch(name, jobs)
+	logging.info(f'ワーカー終了: {worker} ' + ', '.join(f'{k} {v} 件' for k, v in summary.items()))
+	return summary
@@ -0,0 +1,323 @@
+import os
+import re
+import csv
+import sqlite3
+import tempfile
+import zipfile
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from document_metadata import load_document_metadata, doc_id_from_folder, code_from_metadata
+from csv_loader import detect_format
+import filing_archive
+from stage_state import StageState, fingerprint_paths
+import instrumentation
+from instrumentation import REGISTRY
+from pipeline import process_pool
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 処理済み台帳（stage_state）でのステージ名
+STATE_STAGE = 'facts'
+
+# ファクトの取込元: csv（type=5のXBRL_TO_CSV） / xbrl（type=1のインスタンス文書を直接解析）
+FACT_SOURCES = ('csv', 'xbrl')
+
+# XBRL_TO_CSVの列（要素ID, 項目名, コンテキストID, 相対年度, 連結・個別, 期間・時点, ユニットID, 単位, 値）
+FACT_COLUMNS = ['element_id', 'item_name', 'context_id', 'relative_year', 'consolidation',
+	'period_type', 'unit_id', 'unit', 'value_text']
+
+# 例: jpcrp030000-asr-001_E02104-000_2024-12-31_02_2025-04-02.csv
+XBRL_CSV_NAME = re.compile(r'^(?P<form>[^_]+)_(?P<edinet_code>[EG]\d{5})-\d{3}_(?P<period_end>\d{4}-\d{2}-\d{2})_\d+_(?P<submitted>\d{4}-\d{2}-\d{2})\.csv$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS filings (
+	doc_id TEXT PRIMARY KEY,
+	date TEXT NOT NULL,
+	edinet_code TEXT,
+	sec_code TEXT,
+	ticker TEXT,
+	folder TEXT NOT NULL,
+	ingested_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS filings_date ON filings(date);
+CREATE INDEX IF NOT EXISTS filings_edinet_code ON filings(edinet_code);
+CREATE INDEX IF NOT EXISTS filings_ticker ON filings(ticker);
+CREATE TABLE IF NOT EXISTS facts (
+	doc_id TEXT NOT NULL,
+	file_name TEXT NOT NULL,
+	period_end TEXT,
+	element_id TEXT NOT NULL,
+	item_name TEXT,
+	context_id TEXT,
+	relative_year TEXT,
+	consolidation TEXT,
+	period_type TEXT,
+	unit_id TEXT,
+	unit TEXT,
+	value REAL,
+	value_text TEXT
+);
+CREATE INDEX IF NOT EXISTS facts_doc_id ON facts(doc_id);
+CREATE INDEX IF NOT EXISTS facts_element_id ON facts(element_id);
+'''
+
+
+def default_store_path(base_dir: str = BASE_DIR) -> str:
+	return os.path.join(base_dir, 'data', 'xbrl_facts.sqlite')
+
+
+def to_number(value: str) -> Optional[float]:
+	"""数値として解釈できる値のみfloatに変換（テキストブロック・'－'等はNone）"""
+	s = value.strip().replace(',', '')
+	if not s or len(s) > 40:
+		return None
+	try:
+		return float(s)
+	except ValueError:
+		return None
+
+
+def iter_xbrl_csv_rows(path: str) -> Iterator[Dict[str, str]]:
+	"""XBRL_TO_CSV（通常はUTF-16・タブ区切り）の各行を FACT_COLUMNS のdictで返す"""
+	encoding, delimiter = detect_format(path)
+	with filing_archive.open_text(path, encoding) as f:
+		reader = csv.reader(f, delimiter=delimiter)
+		next(reader, None)  # ヘッダー
+		for row in reader:
+			if not row:
+				continue
+			row = (row + [''] * len(FACT_COLUMNS))[:len(FACT_COLUMNS)]
+			yield dict(zip(FACT_COLUMNS, row))
+
+
+class FactStore:
+	"""XBRL_TO_CSVのファクトを型付きで1つのSQLiteに集約するストア"""
+
+	def __init__(self, path: Optional[str] = None):
+		self.path = path or default_store_path()
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.conn = sqlite3.connect(self.path)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.executescript(SCHEMA)
+
+	def has_filing(self, doc_id: str) -> bool:
+		return self.conn.execute('SELECT 1 FROM filings WHERE doc_id = ?', (doc_id,)).fetchone() is not None
+
+	def ingest_filing(self, date: str, folder: str, meta: Optional[Dict[str, str]] = None,
+			ticker: Optional[str] = None, force: bool = False) -> int:
+		"""展開済みフォルダ（またはZIP）1件分のXBRL_TO_CSVを取り込み、ファクト件数を返す。
+		secCodeのない書類は名寄せで決まったtickerを使う。"""
+		name = filing_archive.filing_name(folder)
+		doc_id = doc_id_from_folder(name)
+		if not force and self.has_filing(doc_id):
+			return 0
+		csv_files = filing_archive.xbrl_csvs(folder)
+		if not csv_files:
+			return 0
+
+		edinet_code = (meta or {}).get('edinetCode') or None
+		rows = []
+		for fn, path in csv_files:
+			m = XBRL_CSV_NAME.match(fn)
+			if not m:
+				continue
+			edinet_code = edinet_code or m.group('edinet_code')
+			for fact in iter_xbrl_csv_rows(path):
+				rows.append((
+					fn, m.group('period_end'), fact['element_id'], fact['item_name'], fact['context_id'],
+					fact['relative_year'], fact['consolidation'], fact['period_type'], fact['unit_id'], fact['unit'],
+					to_number(fact['value_text']), fact['value_text'],
+				))
+		return self._write_filing(date, name, rows, edinet_code, meta, ticker)
+
+	def _write_filing(self, date: str, name: str, rows: Iterable[Tuple], edinet_code: Optional[str],
+			meta: Optional[Dict[str, str]], ticker: Optional[str]) -> int:
+		"""1書類分のファクト（doc_idを除くfactsテーブルの行）を置き換えて保存する（rowsは逐次読みでよい）"""
+		doc_id = doc_id_from_folder(name)
+		count = 0
+
+		def with_doc_id() -> Iterator[Tuple]:
+			nonlocal count
+			for row in rows:
+				count += 1
+				yield (doc_id,) + row
+
+		sec_code = code_from_metadata(meta)
+		if sec_code:
+			ticker = f'{sec_code}.T'
+		with self.conn:
+			self.conn.execute('DELETE FROM facts WHERE doc_id = ?', (doc_id,))
+			self.conn.executemany('INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+				with_doc_id())
+			self.conn.execute(
+				'INSERT OR REPLACE INTO filings (doc_id, date, edinet_code, sec_code, ticker, folder, ingested_at) '
+				'VALUES (?, ?, ?, ?, ?, ?, ?)',
+				(doc_id, date, (meta or {}).get('edinetCode') or edinet_code, (meta or {}).get('secCode') or None,
+					ticker, name, datetime.now().isoformat(timespec='seconds')))
+		return count
+
+	def ingest_day(self, date: str, base_dir: str = BASE_DIR, tickers: Optional[Dict[str, str]] = None,
+			force: bool = False, state: Optional[StageState] = None, source: str = 'csv',
+			workers: Optional[int] = None) -> int:
+		"""data/yyyymmdd配下の展開済みフォルダ（展開していない書類はZIP）をすべて取り込み、ファクト件数の合計を返す。
+		tickersはフォルダ名→ティッカー（stage 3の割当結果）。stateを渡すと、取込後に
+		中身の変わったフォルダ（再展開等）は取り込み直す。
+		source='xbrl' の場合は data/xbrl/yyyymmdd のtype=1のZIPのインスタンス文書をプロセスプールで解析する"""
+		day_dir = os.path.join(base_dir, 'data', date)
+		if source == 'xbrl':
+			from xbrl_instance import default_package_dir
+			source_dir = default_package_dir(date, base_dir)
+		else:
+			source_dir = day_dir
+		if not os.path.isdir(source_dir):
+			logging.error(f'対象ディレクトリが見つかりません: {source_dir}')
+			return 0
+		metadata = load_document_metadata(day_dir) if os.path.isdir(day_dir) else {}
+		pending = []
+		for name, folder in filing_archive.list_filings(source_dir).items():
+			ticker = (tickers or {}).get(name)
+			fingerprint = fingerprint_paths([folder], extra=ticker or '') if state else ''
+			previous = state.get(STATE_STAGE, name) if state else None
+			if previous and previous['fingerprint'] == fingerprint and not force:
+				continue
+			pending.append((name, folder, ticker, fingerprint, force or previous is not None))
+
+		total, filings = 0, 0
+		for name, folder, fingerprint, count in self._ingest(date, pending, metadata, source, workers):
+			if count is None:
+				continue
+			if state:
+				state.mark(STATE_STAGE, name, fingerprint, date=date)
+			if count:
+				filings += 1
+				total += count
+				REGISTRY.inc('facts_filings_total')
+				REGISTRY.inc('facts_rows_total', count)
+		logging.info(f'ファクト取込: {date}: 書類 {filings} 件, ファクト {total:,} 件 → {self.path}')
+		return total
+
+	def _ingest(self, date: str, pending: List[Tuple], metadata: Dict[str, Dict[str, str]], source: str,
+			workers: Optional[int]) -> Iterator[Tuple[str, str, str, Optional[int]]]:
+		"""取込対象を1件ずつ取り込み (書類名, パス, フィンガープリント, ファクト件数) を返す（失敗時の件数はNone）"""
+		if source != 'xbrl':
+			for name, folder, ticker, fingerprint, force in pending:
+				try:
+					count = self.ingest_filing(date, folder, metadata.get(doc_id_from_folder(name)),
+						ticker=ticker, force=force)
+				except (OSError, UnicodeError, csv.Error, zipfile.BadZipFile) as e:
+					logging.error(f'ファクト取込失敗: {folder}: {e}')
+					count = None
+				yield name, folder, fingerprint, count
+			return
+
+		from xbrl_instance import parse_package, iter_spool
+		# 取込済みの書類は解析しない（書き込みはSQLiteへの単一接続のため親プロセスで行う）
+		pending = [p for p in pending if p[4] or not self.has_filing(doc_id_from_folder(p[0]))]
+		if not pending:
+			return
+		workers = min(workers or os.cpu_count() or 1, len(pending))
+		# ワーカーは解析した行をチャンクごとに一時ファイルへ書き、親はそれを逐次読んで書き込む
+		with tempfile.TemporaryDirectory(prefix='xbrl_spool_', dir=os.path.dirname(self.path)) as spool_dir, \
+				process_pool(workers) as pool:
+			spools = [os.path.join(spool_dir, f'{i}.pickle') for i in range(len(pending))]
+			for (name, folder, ticker, fingerprint, _force), result in zip(
+					pending, pool.map(parse_package, [p[1] for p in pending], spools)):
+				REGISTRY.observe('item_seconds', result['elapsed'], stage='XBRL解析')
+				REGISTRY.inc('items_total', stage='XBRL解析', status='error' if result['error'] else 'ok')
+				try:
+					if result['error']:
+						logging.error(f'ファクト取込失敗: {folder}: {result["error"]}')
+						count = None
+					else:
+						count = self._write_filing(date, name, iter_spool(result['spool']), result['edinet_code'],
+							metadata.get(doc_id_from_folder(name)), ticker)
+				finally:
+					if os.path.exists(result['spool']):
+						os.remove(result['spool'])
+				yield name, folder, fingerprint, count
+
+	def query_facts(self, ticker: Optional[str] = None, edinet_code: Optional[str] = None,
+			element_ids: Optional[Sequence[str]] = None, numeric_only: bool = False):
+		"""ティッカー（またはEDINETコード）の全書類にわたるファクトをDataFrameで返す"""
+		import pandas as pd
+		where: List[str] = []
+		params: List[object] = []
+		if ticker:
+			where.append('f.ticker = ?')
+			params.append(ticker)
+		if edinet_code:
+			where.append('f.edinet_code = ?')
+			params.append(edinet_code)
+		if element_ids:
+			where.append(f'x.element_id IN ({",".join("?" * len(element_ids))})')
+			params.extend(element_ids)
+		if numeric_only:
+			where.append('x.value IS NOT NULL')
+		sql = (
+			'SELECT f.date, f.doc_id, f.edinet_code, f.ticker, x.period_end, x.element_id, x.item_name, '
+			'x.context_id, x.relative_year, x.consolidation, x.period_type, x.unit_id, x.value, x.value_text '
+			'FROM facts x JOIN filings f ON f.doc_id = x.doc_id'
+		)
+		if where:
+			sql += ' WHERE ' + ' AND '.join(where)
+		sql += ' ORDER BY f.date, f.doc_id, x.element_id, x.context_id'
+		return pd.read_sql_query(sql, self.conn, params=params)
+
+	def close(self) -> None:
+		self.conn.close()
+
+
+def resolve_folder_tickers(date: str, base_dir: str = BASE_DIR) -> Dict[str, str]:
+	"""単独実行時用: 書類メタデータのないフォルダのティッカーをstage 3と同じ名寄せで求める"""
+	import yyyymmddallcsv2tickersymbol2data as mapping
+	day_dir = os.path.join(base_dir, 'data', date)
+	if not os.path.isdir(day_dir):
+		return {}
+	index = mapping.CompanyNameIndex(mapping.load_company_code_map(mapping.default_code_map_path(base_dir)))
+	folders = list(filing_archive.list_filings(day_dir))
+	index.prepare(mapping.parse_company_from_folder(name) for name in folders)
+	tickers = {}
+	for name in folders:
+		code, _key, _ratio = index.resolve(mapping.parse_company_from_folder(name), threshold=0.5)
+		if code:
+			tickers[name] = f'{code}.T'
+	return tickers
+
+
+def main():
+	parser = argparse.ArgumentParser(description='XBRL_TO_CSVのファクトをSQLiteに集約・照会する')
+	sub = parser.add_subparsers(dest='command', required=True)
+	p_ingest = sub.add_parser('ingest', help='data/yyyymmdd配下の書類（展開済みフォルダまたはZIP）を取り込む')
+	p_ingest.add_argument('date', help='対象日 yyyymmdd')
+	p_ingest.add_argument('--force', action='store_true', help='取込済みの書類も取り込み直す')
+	p_ingest.add_argument('--source', choices=FACT_SOURCES, default='csv',
+		help='取込元（csv: XBRL_TO_CSV / xbrl: data/xbrl/yyyymmdd のtype=1のインスタンス文書）')
+	p_ingest.add_argument('--workers', type=int, default=None, help='xbrl取込時の解析プロセス数（既定: CPUコア数）')
+	p_query = sub.add_parser('query', help='ティッカーのファクトを表示する')
+	p_query.add_argument('ticker', help='ティッカー（例: 7420.T）')
+	p_query.add_argument('--element', action='append', help='要素ID（複数指定可）')
+	parser.add_argument('--db', default=None, help='ストアのパス（既定: data/xbrl_facts.sqlite）')
+	instrumentation.add_arguments(parser)
+	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
+
+	store = FactStore(args.db)
+	try:
+		if args.command == 'ingest':
+			store.ingest_day(args.date, tickers=resolve_folder_tickers(args.date), force=args.force,
+				source=args.source, workers=args.workers)
+		else:
+			df = store.query_facts(ticker=args.ticker, element_ids=args.element, numeric_only=bool(args.element))
+			print(df.to_string(index=False))
+	finally:
+		store.close()
+
+
+if __name__ == '__main__':
+	main()
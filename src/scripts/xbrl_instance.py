@@ -0,0 +1,216 @@
+import os
+import re
+import html
+import pickle
+import time
+import fnmatch
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from xbrl_facts_store import BASE_DIR, FACT_COLUMNS, XBRL_CSV_NAME, to_number
+
+
+# 書類取得API（type=1: 提出本文書及び監査報告書）のZIP内のインスタンス文書
+INSTANCE_PATTERNS = ('XBRL/PublicDoc/*.xbrl', 'XBRL/AuditDoc/*.xbrl')
+
+# 取得台帳（download_manifest）でtype=5の書類と区別するためdocIDに付ける接尾辞
+PACKAGE_TASK_SUFFIX = '@xbrl'
+
+# インスタンス文書のファイル名はXBRL_TO_CSVのCSVと同じ形式（拡張子のみ異なる）
+INSTANCE_NAME = re.compile(XBRL_CSV_NAME.pattern.replace(r'\.csv$', r'\.xbrl$'))
+
+XBRLI_NS = 'http://www.xbrl.org/2003/instance'
+LINK_NS = 'http://www.xbrl.org/2003/linkbase'
+XBRLDI_NS = 'http://xbrl.org/2006/xbrldi'
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+# ファクトではない最上位要素（コンテキスト・単位・スキーマ参照等）の名前空間
+NON_FACT_NS = (XBRLI_NS, LINK_NS, 'http://www.w3.org/1999/xlink')
+
+# コンテキストIDの先頭（期間部分）→ XBRL_TO_CSVの相対年度（期間, 時点）
+RELATIVE_YEARS = {
+	'FilingDate': ('提出日時点', '提出日時点'),
+	'CurrentYear': ('当期', '当期末'),
+	'Prior1Year': ('前期', '前期末'),
+	'Prior2Year': ('前々期', '前々期末'),
+	'Prior3Year': ('三期前', '三期前時点'),
+	'Prior4Year': ('四期前', '四期前時点'),
+}
+# 連結・個別の区別があるのは財務諸表本表のタクソノミ（他はXBRL_TO_CSVと同じく「その他」）
+FINANCIAL_STATEMENT_PREFIXES = ('jppfs_cor', 'jpigp_cor')
+NON_CONSOLIDATED_MEMBER = 'NonConsolidatedMember'
+# ユニットIDがない（非数値の）ファクトのユニットID・単位
+NO_UNIT = '－'
+UNIT_LABELS = {'JPY': '円'}
+
+# parse_package が一時ファイルへ書き出す1チャンクの行数（親・ワーカーが同時に持つ行数の上限）
+SPOOL_ROWS = 5000
+
+_TAG = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'\s+')
+
+
+def default_package_dir(date: str, base_dir: str = BASE_DIR) -> str:
+	"""type=1のZIPの保存先（data/yyyymmdd はtype=5の展開・配置に使うため分ける）"""
+	return os.path.join(base_dir, 'data', 'xbrl', date)
+
+
+def _split(tag: str) -> Tuple[str, str]:
+	"""'{名前空間}ローカル名' → (名前空間, ローカル名)"""
+	if tag.startswith('{'):
+		ns, _sep, local = tag[1:].partition('}')
+		return ns, local
+	return '', tag
+
+
+def _text_block(value: str) -> str:
+	"""テキストブロック（エスケープされたHTML）からタグを除いた本文"""
+	return _SPACES.sub(' ', html.unescape(_TAG.sub(' ', value))).strip()
+
+
+def _context(elem: ET.Element) -> Dict[str, object]:
+	period = elem.find(f'{{{XBRLI_NS}}}period')
+	instant = period is not None and period.find(f'{{{XBRLI_NS}}}instant') is not None
+	members = [m.text.strip() for m in elem.iter(f'{{{XBRLDI_NS}}}explicitMember') if m.text]
+	context_id = elem.get('id', '')
+	duration, point = RELATIVE_YEARS.get(re.sub(r'(Duration|Instant)$', '', context_id.split('_', 1)[0]), ('', ''))
+	return {
+		'period_type': '時点' if instant else '期間',
+		'relative_year': point if instant else duration,
+		'non_consolidated': any(m.endswith(':' + NON_CONSOLIDATED_MEMBER) or m == NON_CONSOLIDATED_MEMBER for m in members),
+	}
+
+
+def iter_instance_facts(source: IO[bytes]) -> Iterator[Dict[str, str]]:
+	"""インスタンス文書を逐次解析し、XBRL_TO_CSVと同じ FACT_COLUMNS のdict（＋decimals）を返す。
+	最上位の要素は処理し終えるたびに破棄するため、メモリ使用量はファクト数によらない（要素名の種類数のみに依存）。
+	項目名（ラベル）はタクソノミを読まないため空、テキストブロックはタグを除いた本文"""
+	prefixes: Dict[str, str] = {}
+	contexts: Dict[str, Dict[str, object]] = {}
+	units: Dict[str, str] = {}
+	pending: List[ET.Element] = []
+	root: Optional[ET.Element] = None
+	depth = 0
+
+	def fact(elem: ET.Element) -> Optional[Dict[str, str]]:
+		ns, local = _split(elem.tag)
+		prefix = prefixes.get(ns, '')
+		context = contexts.get(elem.get('contextRef', ''))
+		if context is None:
+			return None
+		if elem.get(XSI_NIL) == 'true':
+			value = NO_UNIT
+		elif local.endswith('TextBlock'):
+			value = _text_block(elem.text or '')
+		else:
+			value = (elem.text or '').strip()
+		unit_id = elem.get('unitRef') or NO_UNIT
+		if prefix in FINANCIAL_STATEMENT_PREFIXES:
+			consolidation = '個別' if context['non_consolidated'] else '連結'
+		else:
+			consolidation = 'その他'
+		return {
+			'element_id': f'{prefix}:{local}' if prefix else local,
+			'item_name': '',
+			'context_id': elem.get('contextRef', ''),
+			'relative_year': str(context['relative_year']),
+			'consolidation': consolidation,
+			'period_type': str(context['period_type']),
+			'unit_id': unit_id,
+			'unit': NO_UNIT if unit_id == NO_UNIT else UNIT_LABELS.get(units.get(unit_id, unit_id), ''),
+			'value_text': value,
+			'decimals': elem.get('decimals', ''),
+		}
+
+	for event, item in ET.iterparse(source, events=('start-ns', 'start', 'end')):
+		if event == 'start-ns':
+			prefix, uri = item
+			prefixes.setdefault(uri, prefix)
+			continue
+		if event == 'start':
+			if root is None:
+				root = item
+			depth += 1
+			continue
+		depth -= 1
+		if depth != 1 or root is None:
+			continue
+		ns, local = _split(item.tag)
+		if ns == XBRLI_NS and local == 'context':
+			contexts[item.get('id', '')] = _context(item)
+		elif ns == XBRLI_NS and local == 'unit':
+			measure = item.find(f'.//{{{XBRLI_NS}}}measure')
+			if measure is not None and measure.text and item.find(f'{{{XBRLI_NS}}}divide') is None:
+				units[item.get('id', '')] = measure.text.strip().rsplit(':', 1)[-1]
+		elif ns not in NON_FACT_NS and len(item) == 0:
+			record = fact(item)
+			if record is not None:
+				yield record
+			elif item.get('contextRef'):
+				# コンテキストより前に出現したファクトは最後にまとめて処理する（EDINETでは通常発生しない）
+				pending.append(item)
+				root.remove(item)
+				continue
+		# 処理済みの最上位要素を木から外してメモリを解放する
+		root.clear()
+	for item in pending:
+		record = fact(item)
+		if record is not None:
+			yield record
+
+
+def instance_members(zf: zipfile.ZipFile) -> List[str]:
+	return sorted(info.filename for info in zf.infolist()
+		if any(fnmatch.fnmatch(info.filename, pattern) for pattern in INSTANCE_PATTERNS))
+
+
+def iter_package_facts(zip_path: str) -> Iterator[Tuple[str, Optional[re.Match], Dict[str, str]]]:
+	"""type=1のZIP内のインスタンス文書を展開せずに読み、(ファイル名, ファイル名の照合結果, ファクト) を返す"""
+	with zipfile.ZipFile(zip_path) as zf:
+		for member in instance_members(zf):
+			file_name = member.rsplit('/', 1)[-1]
+			match = INSTANCE_NAME.match(file_name)
+			with zf.open(member) as f:
+				for record in iter_instance_facts(f):
+					yield file_name, match, record
+
+
+def parse_package(zip_path: str, spool_path: str) -> Dict[str, Any]:
+	"""1書類分のtype=1のZIPを解析し、factsテーブルの行（doc_idを除く）をSPOOL_ROWS件ずつspool_pathへ書き出す
+	（プロセスプールのワーカー）。全行を戻り値で親プロセスへ返さないため、ワーカー・親ともメモリ使用量は書類の大きさによらない"""
+	start = time.perf_counter()
+	result: Dict[str, Any] = {'pid': os.getpid(), 'zip': zip_path, 'spool': spool_path, 'rows': 0,
+		'edinet_code': None, 'error': None}
+	rows: List[Tuple] = []
+	try:
+		with open(spool_path, 'wb') as spool:
+			for file_name, match, fact in iter_package_facts(zip_path):
+				if match is not None and not result['edinet_code']:
+					result['edinet_code'] = match.group('edinet_code')
+				rows.append((
+					file_name, match.group('period_end') if match else None,
+					*(fact[col] for col in FACT_COLUMNS[:-1]),
+					to_number(fact['value_text']), fact['value_text'],
+				))
+				if len(rows) >= SPOOL_ROWS:
+					pickle.dump(rows, spool, protocol=pickle.HIGHEST_PROTOCOL)
+					result['rows'] += len(rows)
+					rows = []
+			if rows:
+				pickle.dump(rows, spool, protocol=pickle.HIGHEST_PROTOCOL)
+				result['rows'] += len(rows)
+	except (OSError, zipfile.BadZipFile, ET.ParseError) as e:
+		result['error'] = f'XBRL解析失敗: {e}'
+	result['elapsed'] = time.perf_counter() - start
+	return result
+
+
+def iter_spool(spool_path: str) -> Iterator[Tuple]:
+	"""parse_package が書き出した行を1チャンクずつ読み、1行ずつ返す"""
+	with open(spool_path, 'rb') as spool:
+		while True:
+			try:
+				chunk = pickle.load(spool)  # nosec B301: 同じ取込処理のワーカーが書き出した一時ファイル
+			except EOFError:
+				return
+			yield from chunk
@@ -1,41 +1,134 @@
+import os
+import time
+import logging
+from typing import Dict, Iterable, List, Optional
 
-import yfinance as yf
 import pandas as pd
-import os
-import sys
-
-def fetch_fundamentals(ticker: str, output_dir: str = 'data'):
-	# ティッカーからyfinanceでデータ取得
-	stock = yf.Ticker(ticker)
-	print(f"Fetching data for {ticker}...")
-	print(stock)
-	# 財務諸表（損益計算書、貸借対照表、キャッシュフロー）取得
-	financials = stock.financials
-	print(financials)
-	balance_sheet = stock.balance_sheet
-	cashflow = stock.cashflow
-	info = stock.info
-
-	# 保存先ディレクトリ（output_dir/ティッカー名）を作成
-	save_dir = os.path.join(output_dir, ticker)
+
+import instrumentation
+from instrumentation import REGISTRY
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 取得するデータセット（保存ファイル名は <dataset>.csv）
+DATASETS = ('financials', 'balance_sheet', 'cashflow', 'info')
+
+# データセットごとのキャッシュ有効期間（時間）。財務諸表は四半期ごとの更新なので長めにする
+DEFAULT_TTL_HOURS = {
+	'financials': 24 * 7,
+	'balance_sheet': 24 * 7,
+	'cashflow': 24 * 7,
+	'info': 24,
+}
+
+
+def create_session():
+	"""全銘柄で共有するHTTPセッション（yfinanceはcurl_cffiのセッションを推奨）"""
+	try:
+		from curl_cffi import requests as curl_requests
+		return curl_requests.Session(impersonate='chrome')
+	except ImportError:
+		import requests
+		return requests.Session()
+
+
+class YFinanceProvider:
+	"""yfinanceから財務データを取得するプロバイダ。テスト時は同じ fetch を持つ偽物に差し替えられる"""
+
+	def __init__(self, session=None):
+		self.session = session if session is not None else create_session()
+
+	def tickers(self, symbols: Iterable[str]) -> Dict[str, object]:
+		"""yf.Tickersで複数銘柄のTickerオブジェクトを共有セッションでまとめて作る"""
+		import yfinance as yf
+		symbols = list(symbols)
+		if not symbols:
+			return {}
+		return yf.Tickers(' '.join(symbols), session=self.session).tickers
+
+	def fetch(self, ticker: str, datasets: Iterable[str], stock=None) -> Dict[str, pd.DataFrame]:
+		if stock is None:
+			import yfinance as yf
+			stock = yf.Ticker(ticker, session=self.session)
+		frames = {}
+		for dataset in datasets:
+			value = getattr(stock, dataset)
+			# infoはdictなのでDataFrame化
+			frames[dataset] = pd.DataFrame([value]) if isinstance(value, dict) else value
+		return frames
+
+
+def stale_datasets(save_dir: str, ttl_hours: Optional[Dict[str, float]] = None, force: bool = False) -> List[str]:
+	"""保存済みCSVの更新日時がTTLを過ぎた（または未取得の）データセット"""
+	if force:
+		return list(DATASETS)
+	ttl = dict(DEFAULT_TTL_HOURS, **(ttl_hours or {}))
+	now = time.time()
+	stale = []
+	for dataset in DATASETS:
+		path = os.path.join(save_dir, f'{dataset}.csv')
+		if not os.path.exists(path) or now - os.path.getmtime(path) > ttl[dataset] * 3600:
+			stale.append(dataset)
+	return stale
+
+
+def save_frames(save_dir: str, frames: Dict[str, pd.DataFrame]) -> None:
 	os.makedirs(save_dir, exist_ok=True)
-	print(f"Saving data to {save_dir}...")
+	for dataset, df in frames.items():
+		path = os.path.join(save_dir, f'{dataset}.csv')
+		tmp_path = path + '.part'
+		# infoは列名=項目名の1行なのでインデックスは保存しない
+		df.to_csv(tmp_path, index=(dataset != 'info'))
+		os.replace(tmp_path, path)
+
+
+def fetch_fundamentals(ticker: str, output_dir: str = 'data', provider: Optional[YFinanceProvider] = None,
+		ttl_hours: Optional[Dict[str, float]] = None, force: bool = False, stock=None) -> List[str]:
+	"""TTLを過ぎたデータセットのみ取得して output_dir/<ticker>/<dataset>.csv に保存し、取得したデータセットを返す"""
+	save_dir = os.path.join(output_dir, ticker)
+	datasets = stale_datasets(save_dir, ttl_hours, force)
+	if len(datasets) < len(DATASETS):
+		REGISTRY.inc('yahoo_datasets_total', len(DATASETS) - len(datasets), result='cached')
+	if not datasets:
+		logging.info(f'{ticker}: キャッシュ有効のため取得をスキップ')
+		return []
+	provider = provider or YFinanceProvider()
+	frames = provider.fetch(ticker, datasets, stock=stock)
+	save_frames(save_dir, frames)
+	REGISTRY.inc('yahoo_datasets_total', len(frames), result='fetched')
+	logging.info(f'{ticker}の財務データ（{", ".join(datasets)}）を{save_dir}に保存しました。')
+	return datasets
+
 
-	# CSV保存（ティッカー名ディレクトリ内に格納）
-	financials.to_csv(os.path.join(save_dir, 'financials.csv'))
-	balance_sheet.to_csv(os.path.join(save_dir, 'balance_sheet.csv'))
-	cashflow.to_csv(os.path.join(save_dir, 'cashflow.csv'))
-	# infoはdictなのでDataFrame化
-	pd.DataFrame([info]).to_csv(os.path.join(save_dir, 'info.csv'), index=False)
+def parse_ttl(values: Optional[Iterable[str]]) -> Dict[str, float]:
+	"""'dataset=時間' 形式の指定をdictにする"""
+	ttl = {}
+	for value in values or []:
+		dataset, _, hours = value.partition('=')
+		if dataset not in DATASETS or not hours:
+			raise ValueError(f'TTLの指定が不正です: {value}（例: info=6）')
+		ttl[dataset] = float(hours)
+	return ttl
 
-	print(f"{ticker}の財務データを{output_dir}に保存しました。")
 
 if __name__ == "__main__":
 	import argparse
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 	parser = argparse.ArgumentParser(description="ヤフーファイナンスから財務データを取得してCSV保存")
 	parser.add_argument("ticker", type=str, help="取得したい銘柄のティッカー（例: 7203.T）")
 	parser.add_argument("--output_dir", type=str, default="data", help="CSV保存先ディレクトリ")
+	parser.add_argument("--force", action="store_true", help="キャッシュの有効期間内でも取得し直す")
+	parser.add_argument("--ttl", action="append", help="データセットごとのキャッシュ有効期間（時間） 例: info=6")
+	instrumentation.add_arguments(parser)
 	args = parser.parse_args()
-	fetch_fundamentals(args.ticker, output_dir=args.output_dir)
+	instrumentation.configure_from_args(args)
+	if fetch_fundamentals(args.ticker, output_dir=args.output_dir, ttl_hours=parse_ttl(args.ttl), force=args.force):
+		from data_catalog import DataCatalog, default_catalog_path
+		# data配下に保存した場合は目録に反映する（他のディレクトリは目録の対象外）
+		catalog = DataCatalog(default_catalog_path(BASE_DIR))
+		try:
+			catalog.sync_ticker(os.path.join(args.output_dir, args.ticker))
+		finally:
+			catalog.close()
     # uv run scripts\yahoo2finance.py 7203.T --output_dir data
-    # uv run scripts\yahoo2finance.py 7203.T
\ No newline at end of file
+    # uv run scripts\yahoo2finance.py 7203.T
@@ -1,36 +1,117 @@
 import os
-import pandas as pd
-import subprocess
 import sys
+import pandas as pd
+import argparse
 
-def main():
-    # 対象日付（引数で受け取る）
-    if len(sys.argv) > 1:
-        date = sys.argv[1]
-    else:
-        date = "20250820"
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    csv_path = os.path.join(base_dir, "data", date, "company_code_map.csv")
-    data_dir = os.path.join(base_dir, "data")
-    script_path = os.path.join(base_dir, "src", "scripts", "aifinanceanalysisfortickersymbol.py")
+import instrumentation
+from ai_analysis_engine import AnalysisEngine, AnalysisCache, DEFAULT_MODEL, default_cache_path
+from pipeline import map_parallel
+from prompt_builder import DEFAULT_TOKEN_BUDGET, token_counter
+from stage_state import StageState, default_state_path, fingerprint_paths
+from data_catalog import DataCatalog, default_catalog_path
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 処理済み台帳（stage_state）でのステージ名
+STATE_STAGE = "analyze"
+
+def load_tickers(date):
+    csv_path = os.path.join(BASE_DIR, "data", date, "company_code_map.csv")
     # 証券コード一覧を取得
     df = pd.read_csv(csv_path)
     codes = df["証券コード"].astype(str).unique()
+    return [f"{code}.T" for code in codes]
+
+def ticker_fingerprint(ticker_dir, model=DEFAULT_MODEL, token_budget=DEFAULT_TOKEN_BUDGET, catalog=None):
+    """分析の入力（ティッカーディレクトリの中身・モデル・トークン上限・トークンの数え方）のフィンガープリント。
+    catalogに載っていればディレクトリを走査せず目録から求める（値は同じ）"""
+    extra = f"{model}\0{token_budget}\0{token_counter()}"
+    fingerprint = catalog.fingerprint(ticker_dir, extra) if catalog is not None else None
+    return fingerprint or fingerprint_paths([ticker_dir], extra=extra)
 
-    for code in codes:
-        ticker = f"{code}.T"
+def analyze_tickers(tickers, workers=4, model=DEFAULT_MODEL, use_cache=True, token_budget=DEFAULT_TOKEN_BUDGET,
+                    state=None, date=None, catalog=None):
+    """各ティッカーのAI分析を非同期エンジンで並列実行し、{ticker: 分析結果} を返す。
+    同じモデル・プロンプトの分析結果はキャッシュから返す。stateを渡すと、前回の分析から
+    ディレクトリの中身が変わっていないティッカーは分析しない。
+    分析対象が1件も分析できなかった場合（APIキー未設定等）はRuntimeErrorを送出する（一部の失敗は結果から除くのみ）"""
+    from aifinanceanalysisfortickersymbol import load_ticker_prompt
+    data_dir = os.path.join(BASE_DIR, "data")
+
+    targets = []
+    fingerprints = {}
+    for ticker in tickers:
         ticker_dir = os.path.join(data_dir, ticker)
-        if os.path.isdir(ticker_dir):
-            print(f"分析実行: {ticker}")
-            # powershell用コマンド
-            cmd = [sys.executable, script_path, ticker]
-            try:
-                subprocess.run(cmd, check=True)
-            except Exception as e:
-                print(f"{ticker} の分析失敗: {e}")
-        else:
+        if not os.path.isdir(ticker_dir):
             print(f"ディレクトリなし: {ticker_dir}")
+            continue
+        if state:
+            fingerprints[ticker] = ticker_fingerprint(ticker_dir, model, token_budget, catalog)
+            if state.is_done(STATE_STAGE, ticker, fingerprints[ticker]):
+                continue
+        targets.append(ticker)
+    if len(targets) < len(tickers):
+        print(f"分析対象: {len(targets)}/{len(tickers)} 件（残りはディレクトリなし、または前回から変更なし）")
+
+    # CSVの読込（I/O）はスレッドプール、API呼び出しは非同期で並列化する
+    prompts = map_parallel(lambda t: load_ticker_prompt(t, data_dir=data_dir, token_budget=token_budget, model=model,
+                                                        catalog=catalog),
+                           targets, workers=workers,
+                           desc="分析プロンプト作成")
+    if not prompts:
+        if targets:
+            raise RuntimeError(f"分析プロンプトを1件も作成できませんでした: {len(targets)} 件")
+        return {}
+    cache = AnalysisCache(default_cache_path(BASE_DIR)) if use_cache else None
+    try:
+        engine = AnalysisEngine(model=model, concurrency=workers, cache=cache)
+        results = engine.run(prompts)
+    finally:
+        if cache:
+            cache.close()
+    if not results:
+        raise RuntimeError(f"AI分析が全件失敗しました: {len(prompts)} 件")
+    for ticker in targets:
+        if ticker in results:
+            print(f"--- {ticker} ---\n{results[ticker]}")
+            if state:
+                state.mark(STATE_STAGE, ticker, fingerprints[ticker], date=date)
+    return results
+
+def run(date, tickers=None, workers=4, model=DEFAULT_MODEL, use_cache=True, token_budget=DEFAULT_TOKEN_BUDGET,
+        state=None, catalog=None):
+    """指定日付の銘柄をAI分析する。tickersを渡した場合はcompany_code_map.csvを読まない"""
+    if tickers is None:
+        tickers = load_tickers(date)
+    return analyze_tickers(tickers, workers=workers, model=model, use_cache=use_cache, token_budget=token_budget,
+                           state=state, date=date, catalog=catalog)
+
+def main():
+    parser = argparse.ArgumentParser(description="指定日付の銘柄のCSVをChatGPTで一括財務分析")
+    # 対象日付（引数で受け取る）
+    parser.add_argument("date", nargs="?", default="20250820", help="対象日 yyyymmdd")
+    parser.add_argument("--workers", type=int, default=4, help="同時リクエスト数")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="モデル名")
+    parser.add_argument("--no-cache", action="store_true", help="分析結果のキャッシュを使わない")
+    parser.add_argument("--max-prompt-tokens", type=int, default=DEFAULT_TOKEN_BUDGET, help="1銘柄あたりのプロンプトのトークン上限")
+    parser.add_argument("--force", action="store_true", help="前回から変更のないティッカーも分析し直す")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    state = StageState(default_state_path(BASE_DIR))
+    catalog = DataCatalog(default_catalog_path(BASE_DIR))
+    try:
+        if args.force:
+            # 分析の記録は最後に分析した日付で残るため、日付によらず消す（結果はキャッシュされている）
+            state.reset(STATE_STAGE)
+        run(args.date, workers=args.workers, model=args.model, use_cache=not args.no_cache,
+            token_budget=args.max_prompt_tokens, state=state, catalog=catalog)
+    except RuntimeError as e:
+        print(f"AI分析失敗: {e}")
+        sys.exit(1)
+    finally:
+        catalog.close()
+        state.close()
 
 if __name__ == "__main__":
     main()
@@ -1,89 +1,27 @@
 import os
 import sys
 import csv
-import pandas as pd
-import shutil
 import logging
 import argparse
-import unicodedata
 import difflib
-from typing import Optional, Dict, Tuple
+from collections import Counter, defaultdict
+from typing import Optional, Dict, Iterable, List, Set, Tuple, Union
 
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+from document_metadata import load_document_metadata, doc_id_from_folder, code_from_metadata, is_fund
+# 会社名の正規化と証券コードマスタの読込は code_master に集約（従来のインポート先も維持）
+from code_master import normalize_name, normalize_names, normalize_code, load_company_code_map  # noqa: F401
+from ticker_placement import PLACEMENT_MODES, place_csv
+from filing_archive import iter_filing_csvs, list_filings
+from stage_state import StageState, default_state_path, fingerprint_paths
+from data_catalog import DataCatalog, default_catalog_path
+import instrumentation
+from instrumentation import REGISTRY
 
 
-def normalize_name(name: str) -> str:
-	"""会社名の比較用に正規化 (全角→半角、空白/記号除去、大小無視、(株)/株式会社の前後除去)"""
-	if name is None:
-		return ''
-	s = unicodedata.normalize('NFKC', str(name))
-	# 先頭/末尾の 株式会社 / (株) / （株） を除去
-	for mark in ['株式会社', '(株)', '（株）']:
-		if s.startswith(mark):
-			s = s[len(mark):]
-		if s.endswith(mark):
-			s = s[:-len(mark)]
-	# 空白類・アンダースコア・中点などを除去
-	remove_chars = [' ', '\t', '\n', '\r', '_', '･', '・', '　']
-	for ch in remove_chars:
-		s = s.replace(ch, '')
-	# ドットやスラッシュ等の記号も広く除去
-	for ch in ['.', '．', '-', '−', '/', '／']:
-		s = s.replace(ch, '')
-	return s.lower()
-
-
-def normalize_code(code: str) -> Optional[str]:
-	"""コード文字列から最初の4桁の数字を抽出（全角数字にも対応）。"""
-	if not code:
-		return None
-	s = unicodedata.normalize('NFKC', str(code))
-	digits = ''.join(ch for ch in s if ch.isdigit())
-	if len(digits) >= 4:
-		return digits[:4]
-	return None
-
-
-def load_company_code_map(xls_path: str) -> Dict[str, str]:
-	"""会社名→4桁証券コードのマッピングをExcelから読み込む。
-	列名は自動判定（証券コード・会社名）。"""
-	if not os.path.exists(xls_path):
-		raise FileNotFoundError(f"マッピングExcelが見つかりません: {xls_path}")
-
-	# Excel読み込み（JPX公式は1枚目のシート）
-	df = pd.read_excel(xls_path, sheet_name=0)
-	headers = [str(h).strip() for h in df.columns]
-
-	name_keys = [
-		'company', 'Company', 'company_name', 'CompanyName', 'name', 'Name', 'filerName', 'issuerName',
-		'発行体名', '提出者名', '銘柄名', '企業名', '会社名', '上場会社名', '上場銘柄名', '正式名称', '正式名', 'Company Name'
-	]
-	code_keys = [
-		'code', 'Code', 'secCode', '証券コード', '銘柄コード', 'コード', 'Local Code', '証券コード(4桁)'
-	]
-
-	def find_key(candidates):
-		for c in candidates:
-			for h in headers:
-				if c == h or c in h:
-					return h
-		return None
-
-	name_col = find_key(name_keys)
-	code_col = find_key(code_keys)
-	if not name_col or not code_col:
-		raise ValueError(f"Excelの列名が解釈できません。ヘッダー: {headers}")
-
-	mapping: Dict[str, str] = {}
-	for _, row in df.iterrows():
-		company = str(row.get(name_col, '')).strip()
-		code_raw = str(row.get(code_col, '')).strip()
-		code = normalize_code(code_raw)
-		if company and code:
-			mapping[normalize_name(company)] = code
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-	return mapping
+# 処理済み台帳（stage_state）でのステージ名
+STATE_STAGE = 'map'
 
 
 def parse_company_from_folder(folder_name: str) -> str:
@@ -127,104 +65,288 @@ def resolve_code_with_similarity(company2code: Dict[str, str], extracted_company
 	return None, None, best_ratio
 
 
-def find_csvs_recursively(root_dir: str):
-	for cur, _dirs, files in os.walk(root_dir):
-		for fn in files:
-			if fn.lower().endswith('.csv'):
-				yield os.path.join(cur, fn)
-
-
-def copy_csvs_to_ticker_dir(src_folder: str, ticker_dir: str) -> Tuple[int, int]:
+class CompanyNameIndex:
+	"""resolve_code_with_similarity と同じ結果を返す事前計算済みの会社名インデックス。
+	厳密一致はdict参照、部分一致は部分文字列/2文字n-gramの転置インデックス、
+	類似度は共通文字数による上限値（quick_ratio相当）で候補を絞り込んでから計算する。
+	同じ会社名の解決結果はメモ化する。"""
+
+	def __init__(self, company2code: Dict[str, str]):
+		self.company2code = company2code
+		self.keys = list(company2code.keys())
+		self.order = {k: i for i, k in enumerate(self.keys)}
+		self.char_counts = [Counter(k) for k in self.keys]
+		self.empty_keys = [i for i, k in enumerate(self.keys) if not k]
+		self.char_postings: Dict[str, List[int]] = defaultdict(list)
+		self.bigram_postings: Dict[str, Set[int]] = defaultdict(set)
+		for i, k in enumerate(self.keys):
+			for ch in self.char_counts[i]:
+				self.char_postings[ch].append(i)
+			for j in range(len(k) - 1):
+				self.bigram_postings[k[j:j + 2]].add(i)
+		self._cache: Dict[Tuple[str, float], Tuple[Optional[str], Optional[str], float]] = {}
+		self._normalized: Dict[str, str] = {}
+
+	def prepare(self, names: Iterable[str]) -> None:
+		"""解決する予定の会社名をまとめて正規化しておく（resolveで1件ずつ正規化しない）"""
+		import pandas as pd
+		pending = [n for n in dict.fromkeys(names) if n not in self._normalized]
+		if pending:
+			self._normalized.update(zip(pending, normalize_names(pd.Series(pending, dtype=object))))
+
+	def _first_partial_match(self, key: str) -> Optional[int]:
+		"""len(k)>=3 かつ (k in key または key in k) を満たす最初のkの位置"""
+		found: List[int] = []
+		# k in key: keyの部分文字列（3文字以上）を直接引く
+		for start in range(len(key)):
+			for end in range(start + 3, len(key) + 1):
+				i = self.order.get(key[start:end])
+				if i is not None:
+					found.append(i)
+		# key in k: n-gramの転置インデックスで候補を絞ってから確認
+		if not key:
+			candidates: Iterable[int] = range(len(self.keys))
+		elif len(key) == 1:
+			candidates = self.char_postings.get(key, [])
+		else:
+			postings = sorted((self.bigram_postings.get(key[j:j + 2], set()) for j in range(len(key) - 1)), key=len)
+			candidates = set.intersection(*postings)
+		for i in candidates:
+			k = self.keys[i]
+			if len(k) >= 3 and key in k:
+				found.append(i)
+		found = [i for i in found if len(self.keys[i]) >= 3]
+		return min(found) if found else None
+
+	def _best_similarity(self, key: str) -> Tuple[Optional[int], float]:
+		"""SequenceMatcher.ratio() が最大となる最初のkの位置と類似度"""
+		key_counts = Counter(key)
+		common: Dict[int, int] = defaultdict(int)
+		for ch, n in key_counts.items():
+			for i in self.char_postings.get(ch, []):
+				common[i] += min(n, self.char_counts[i][ch])
+		for i in self.empty_keys:
+			common.setdefault(i, 0)
+
+		def upper_bound(i: int) -> float:
+			length = len(key) + len(self.keys[i])
+			return 2.0 * common[i] / length if length else 1.0
+
+		# 共通文字のない候補の類似度は0で、初期値0.0を更新しないため除外できる
+		candidates = sorted(((upper_bound(i), i) for i in common), key=lambda t: (-t[0], t[1]))
+		best_ratio = 0.0
+		best_index: Optional[int] = None
+		# ratio()は引数の順序で結果が変わるため、元の実装と同じく a=key, b=k とする
+		matcher = difflib.SequenceMatcher(None)
+		matcher.set_seq1(key)
+		for bound, i in candidates:
+			if bound < best_ratio:
+				break
+			matcher.set_seq2(self.keys[i])
+			ratio = matcher.ratio()
+			if ratio > best_ratio or (ratio == best_ratio and best_index is not None and i < best_index):
+				best_ratio = ratio
+				best_index = i
+		return best_index, best_ratio
+
+	def resolve(self, extracted_company: str, threshold: float = 0.5) -> Tuple[Optional[str], Optional[str], float]:
+		cache_key = (extracted_company, threshold)
+		if cache_key in self._cache:
+			return self._cache[cache_key]
+		key = self._normalized.get(extracted_company)
+		if key is None:
+			key = normalize_name(extracted_company)
+		if key in self.company2code:
+			result = (self.company2code[key], key, 1.0)
+		else:
+			i = self._first_partial_match(key)
+			if i is not None:
+				result = (self.company2code[self.keys[i]], self.keys[i], 1.0)
+			else:
+				i, ratio = self._best_similarity(key)
+				if i is not None and ratio >= threshold:
+					result = (self.company2code[self.keys[i]], self.keys[i], ratio)
+				else:
+					result = (None, None, ratio)
+		self._cache[cache_key] = result
+		return result
+
+
+def copy_csvs_to_ticker_dir(src_folder: str, ticker_dir: str, placement: str = 'link',
+		catalog: Optional[DataCatalog] = None) -> Tuple[int, int]:
+	"""src_folder（展開済みフォルダまたはZIP）配下のCSVをticker_dirに配置する。placementは link（ハードリンク、
+	不可ならreflink/コピー）/ copy / manifest（実体を置かずマニフェストに参照を記録）。配置名は内容ハッシュ付き。
+	catalogを渡すと配置後のticker_dirを目録に反映する"""
 	os.makedirs(ticker_dir, exist_ok=True)
 	copied, skipped = 0, 0
-	for csv_path in find_csvs_recursively(src_folder):
-		dst_path = os.path.join(ticker_dir, os.path.basename(csv_path))
-		if os.path.exists(dst_path):
-			logging.info(f"既存CSVのためスキップ: {dst_path}")
-			skipped += 1
-			continue
+	for csv_path in iter_filing_csvs(src_folder):
 		try:
-			shutil.copy2(csv_path, dst_path)
-			copied += 1
+			placed, name = place_csv(csv_path, ticker_dir, placement)
 		except Exception as e:
-			logging.error(f"コピー失敗: {csv_path} → {dst_path}: {e}")
+			logging.error(f"配置失敗: {csv_path} → {ticker_dir}: {e}")
+			continue
+		REGISTRY.inc('placement_files_total', mode=placement, result='placed' if placed else 'skipped')
+		if placed:
+			copied += 1
+		else:
+			logging.info(f"既存CSVのためスキップ: {os.path.join(ticker_dir, name)}")
+			skipped += 1
+	if catalog is not None and copied:
+		catalog.sync_ticker(ticker_dir)
 	return copied, skipped
 
 
+def default_code_map_path(base_dir: str) -> str:
+	# マッピングExcelは固定パス
+	return os.path.join(base_dir, 'src', 'scripts', 'samples', 'data_j.xls')
+
+
+def map_filing(base_dir: str, date: str, name: str, src_path: str, index: CompanyNameIndex,
+		meta: Optional[Dict[str, str]] = None, placement: str = 'link',
+		state: Optional[StageState] = None, catalog: Optional[DataCatalog] = None) -> Tuple[str, Optional[str], str]:
+	"""1書類（展開済みフォルダまたはZIP）に証券コードを割当て、data/<code>.T にCSVを配置する。
+	(結果, ティッカー, 会社名) を返す。結果は fund / unchanged / unmatched / metadata / name / similarity"""
+	extracted_company = parse_company_from_folder(name)
+	if is_fund(meta):
+		logging.info(f'ファンドの書類のためスキップ: folder={name} fundCode={meta["fundCode"]}')
+		return 'fund', None, extracted_company
+	fingerprint = fingerprint_paths([src_path], extra=f'{placement}\0{(meta or {}).get("secCode", "")}')
+	previous = state.get(STATE_STAGE, name) if state else None
+	if previous and previous['fingerprint'] == fingerprint and previous['output'] \
+			and os.path.isdir(os.path.join(base_dir, 'data', previous['output'])):
+		REGISTRY.inc('map_folders_total', method='unchanged')
+		return 'unchanged', previous['output'], extracted_company
+
+	code = code_from_metadata(meta)
+	if code:
+		matched_key, ratio = None, 1.0
+	else:
+		# secCodeのない書類のみ会社名の類似度で解決する
+		code, matched_key, ratio = index.resolve(extracted_company, threshold=0.5)
+	if not code:
+		logging.warning(f'証券コード不明のためスキップ: folder={name} company={extracted_company} 類似度最大={ratio:.2f}')
+		REGISTRY.inc('map_folders_total', method='unmatched')
+		return 'unmatched', None, extracted_company
+	method = 'metadata' if matched_key is None else 'name' if ratio >= 1.0 else 'similarity'
+	REGISTRY.inc('map_folders_total', method=method)
+	if ratio < 1.0:
+		logging.info(f'類似度で採用: folder={name} company={extracted_company} → matched={matched_key} 類似度={ratio:.2f}')
+
+	ticker = f'{code}.T'
+	ticker_dir = os.path.join(base_dir, 'data', ticker)
+	copied, skipped = copy_csvs_to_ticker_dir(src_path, ticker_dir, placement, catalog)
+	logging.info(f'{name} → {ticker}: 配置 {copied} 件, スキップ {skipped} 件')
+	if state:
+		state.mark(STATE_STAGE, name, fingerprint, date=date, output=ticker)
+	return method, ticker, extracted_company
+
+
+def _write_csv(path: str, header: List[str], rows: Iterable[Iterable[str]]) -> None:
+	# 複数のワーカーが同じ日付の一覧を書く場合があるため、一時ファイルに書いて置き換える
+	tmp_path = f'{path}.{os.getpid()}.tmp'
+	with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+		w = csv.writer(f)
+		w.writerow(header)
+		w.writerows(rows)
+	os.replace(tmp_path, path)
+
+
+def write_day_outputs(day_dir: str, company_code_rows: List[List[str]], unmatched_log: List[Tuple[str, str]]) -> None:
+	"""未一致の会社名（unmatched_companies.csv）と証券コード・会社名一覧（company_code_map.csv）を出力する"""
+	# 未一致ログを残す
+	if unmatched_log:
+		out_path = os.path.join(day_dir, 'unmatched_companies.csv')
+		try:
+			_write_csv(out_path, ['folder_name', 'parsed_company'], unmatched_log)
+			logging.info(f'未一致の会社名を出力: {out_path}')
+		except Exception as e:
+			logging.error(f'未一致ログ出力失敗: {e}')
+
+	# 会社名と証券コードのペアをCSVにまとめて保存（gettickersymbol2csv.py形式）
+	out_path2 = os.path.join(day_dir, 'company_code_map.csv')
+	try:
+		_write_csv(out_path2, ['証券コード', '会社名'], company_code_rows)
+		logging.info(f'証券コード・会社名一覧を出力: {out_path2}')
+	except Exception as e:
+		logging.error(f'証券コード・会社名CSV出力失敗: {e}')
+
+
+def map_day(base_dir: str, date: str, company2code: Union[Dict[str, str], CompanyNameIndex],
+		assignments: Optional[Dict[str, str]] = None, placement: str = 'link',
+		state: Optional[StageState] = None, catalog: Optional[DataCatalog] = None) -> Optional[List[str]]:
+	"""data/yyyymmdd配下の各フォルダに証券コードを割当て、data/<code>.T にCSVを配置する。
+	割当てたティッカー一覧（company_code_map.csvと同じ順序・重複なし）を返す。
+	assignmentsを渡すとフォルダ名→ティッカーの割当結果を格納する。
+	stateを渡すと、前回から中身の変わっていないフォルダは前回の割当結果を使い配置をスキップする。
+	catalogを渡すと書類の一覧を目録から引き、配置したティッカーディレクトリを目録に反映する。"""
+	day_dir = os.path.join(base_dir, 'data', date)
+	if not os.path.isdir(day_dir):
+		logging.error(f'対象ディレクトリが見つかりません: {day_dir}')
+		return None
+	index = company2code if isinstance(company2code, CompanyNameIndex) else CompanyNameIndex(company2code)
+	# ダウンロード時に保存した書類メタデータ（secCode）があれば名寄せせずに割当てる
+	metadata = load_document_metadata(day_dir)
+
+	unmatched_log = []  # (folder, extracted_company)
+	company_code_rows = []  # [code, extracted_company]
+	unchanged = 0
+
+	# yyyymmdd配下の直下フォルダ（展開せずに読む場合はZIP）を処理（会社名は全書類分をまとめて正規化しておく）
+	filings = (catalog.filings(date) if catalog is not None else None) or list_filings(day_dir)
+	index.prepare(parse_company_from_folder(name) for name in filings)
+	for name, src_path in filings.items():
+		result, ticker, extracted_company = map_filing(base_dir, date, name, src_path, index,
+			metadata.get(doc_id_from_folder(name)), placement, state, catalog)
+		if result == 'unmatched':
+			unmatched_log.append((name, extracted_company))
+		if ticker is None:
+			continue
+		if result == 'unchanged':
+			unchanged += 1
+		company_code_rows.append([ticker[:-len('.T')], extracted_company])
+		if assignments is not None:
+			assignments[name] = ticker
+
+	if unchanged:
+		logging.info(f'前回から変更のないフォルダ {unchanged} 件は配置をスキップしました')
+
+	write_day_outputs(day_dir, company_code_rows, unmatched_log)
+	return list(dict.fromkeys(f'{code}.T' for code, _company in company_code_rows))
+
+
 def main():
 
-	parser = argparse.ArgumentParser(description='data/yyyymmdd配下の各フォルダから会社名→証券コードを割当て、data/<code>.T にCSVをコピーする')
+	parser = argparse.ArgumentParser(description='data/yyyymmdd配下の各フォルダから会社名→証券コードを割当て、data/<code>.T にCSVを配置する')
 	parser.add_argument('date', help='対象日 yyyymmdd 例: 20240517')
+	parser.add_argument('--placement', choices=PLACEMENT_MODES, default='link',
+		help='CSVの配置方法（link: ハードリンク / copy: コピー / manifest: 参照のみ記録）')
+	parser.add_argument('--force', action='store_true', help='処理済みのフォルダも配置し直す')
+	instrumentation.add_arguments(parser)
 	args = parser.parse_args()
+	instrumentation.configure_from_args(args)
 
-	base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+	base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 	day_dir = os.path.join(base_dir, 'data', args.date)
 	if not os.path.isdir(day_dir):
 		logging.error(f'対象ディレクトリが見つかりません: {day_dir}')
 		sys.exit(1)
 
-	# マッピングExcelは固定パス
-	map_xls = os.path.join(base_dir, 'src', 'scripts', 'samples', 'data_j.xls')
 	try:
-		company2code = load_company_code_map(map_xls)
+		company2code = load_company_code_map(default_code_map_path(base_dir))
 	except Exception as e:
 		logging.error(f'マッピングExcel読込失敗: {e}')
 		sys.exit(1)
 
-	unmatched_log = []  # (folder, extracted_company)
-
-	# yyyymmdd配下の直下フォルダを処理
-	for name in os.listdir(day_dir):
-		src_path = os.path.join(day_dir, name)
-		if not os.path.isdir(src_path):
-			continue
-
-		extracted_company = parse_company_from_folder(name)
-		code, matched_key, ratio = resolve_code_with_similarity(company2code, extracted_company, threshold=0.5)
-		if not code:
-			logging.warning(f'証券コード不明のためスキップ: folder={name} company={extracted_company} 類似度最大={ratio:.2f}')
-			unmatched_log.append((name, extracted_company))
-			continue
-
-		if ratio < 1.0:
-			logging.info(f'類似度で採用: folder={name} company={extracted_company} → matched={matched_key} 類似度={ratio:.2f}')
-
-		ticker = f'{code}.T'
-		ticker_dir = os.path.join(base_dir, 'data', ticker)
-		copied, skipped = copy_csvs_to_ticker_dir(src_path, ticker_dir)
-		logging.info(f'{name} → {ticker}: コピー {copied} 件, スキップ {skipped} 件')
-
-	# 未一致ログを残す
-	if unmatched_log:
-		out_path = os.path.join(day_dir, 'unmatched_companies.csv')
-		try:
-			with open(out_path, 'w', encoding='utf-8-sig', newline='') as f:
-				w = csv.writer(f)
-				w.writerow(['folder_name', 'parsed_company'])
-				w.writerows(unmatched_log)
-			logging.info(f'未一致の会社名を出力: {out_path}')
-		except Exception as e:
-			logging.error(f'未一致ログ出力失敗: {e}')
-
-	# 会社名と証券コードのペアをCSVにまとめて保存（gettickersymbol2csv.py形式）
-	company_code_rows = []
-	for name in os.listdir(day_dir):
-		src_path = os.path.join(day_dir, name)
-		if not os.path.isdir(src_path):
-			continue
-		extracted_company = parse_company_from_folder(name)
-		code, matched_key, ratio = resolve_code_with_similarity(company2code, extracted_company, threshold=0.5)
-		if code:
-			company_code_rows.append([code, extracted_company])
-	out_path2 = os.path.join(day_dir, 'company_code_map.csv')
+	state = StageState(default_state_path(base_dir))
+	catalog = DataCatalog(default_catalog_path(base_dir))
 	try:
-		with open(out_path2, 'w', encoding='utf-8-sig', newline='') as f:
-			w = csv.writer(f)
-			w.writerow(['証券コード', '会社名'])
-			w.writerows(company_code_rows)
-		logging.info(f'証券コード・会社名一覧を出力: {out_path2}')
-	except Exception as e:
-		logging.error(f'証券コード・会社名CSV出力失敗: {e}')
+		if args.force:
+			state.reset(STATE_STAGE, args.date)
+		if map_day(base_dir, args.date, company2code, placement=args.placement, state=state, catalog=catalog) is None:
+			sys.exit(1)
+	finally:
+		catalog.close()
+		state.close()
 
 
 if __name__ == '__main__':
@@ -1,38 +1,170 @@
 import os
-import sys
+import time
+import shutil
+import fnmatch
 import zipfile
 import logging
+import argparse
+
+import instrumentation
+from instrumentation import REGISTRY
+from pipeline import process_pool
 
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-def main(date_str):
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# 後続処理で使うのはXBRL→CSV変換結果のみ
+DEFAULT_MEMBER_PATTERN = 'XBRL_TO_CSV/*.csv'
+
+
+def extract_members(zip_ref, extract_dir, pattern=DEFAULT_MEMBER_PATTERN):
+    """パターンに一致するメンバーのみをストリーミングで展開し、展開したファイル数を返す"""
+    count, _ = _extract_members(zip_ref, extract_dir, pattern)
+    return count
+
+
+def _extract_members(zip_ref, extract_dir, pattern):
+    count, total = 0, 0
+    for info in zip_ref.infolist():
+        if info.is_dir() or not fnmatch.fnmatch(info.filename, pattern):
+            continue
+        # ZIP内のパスを展開先配下に限定する
+        dest = os.path.realpath(os.path.join(extract_dir, info.filename))
+        if not dest.startswith(os.path.realpath(extract_dir) + os.sep):
+            raise zipfile.BadZipFile(f'不正なメンバーパス: {info.filename}')
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # 最後まで読み切るとZipExtFileがCRCを検証し、不一致ならBadZipFileを送出する
+        with zip_ref.open(info) as src, open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 256 * 1024)
+        if os.path.getsize(dest) != info.file_size:
+            raise zipfile.BadZipFile(f'展開サイズ不一致: {info.filename}')
+        count += 1
+        total += info.file_size
+    return count, total
+
+
+def extract_zip(zip_path, extract_dir, pattern=DEFAULT_MEMBER_PATTERN):
+    """1つのZIPを検証付きで展開し、成功した場合のみZIPを削除する（プロセスプールのワーカー）"""
+    start = time.perf_counter()
+    result = {'pid': os.getpid(), 'zip': zip_path, 'files': 0, 'bytes': 0, 'error': None}
+    part_dir = extract_dir + '.part'
+    try:
+        shutil.rmtree(part_dir, ignore_errors=True)
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            result['files'], result['bytes'] = _extract_members(zip_ref, part_dir, pattern)
+        # 展開が完了してから差し替える（途中で失敗しても中途半端なフォルダを残さない）
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        if os.path.isdir(part_dir):
+            os.replace(part_dir, extract_dir)
+        else:
+            os.makedirs(extract_dir, exist_ok=True)
+    except Exception as e:
+        shutil.rmtree(part_dir, ignore_errors=True)
+        result['error'] = f'解凍失敗: {e}'
+        result['elapsed'] = time.perf_counter() - start
+        return result
+    # 解凍後にZIPファイルを削除
+    try:
+        os.remove(zip_path)
+    except Exception as e:
+        result['error'] = f'ZIPファイル削除失敗: {e}'
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+def verify_zip(zip_path, extract_dir=None, pattern=DEFAULT_MEMBER_PATTERN):
+    """展開せずに読む場合の検証（プロセスプールのワーカー）。対象メンバーを読み切ってCRCを確かめ、何も書き出さない"""
+    start = time.perf_counter()
+    result = {'pid': os.getpid(), 'zip': zip_path, 'files': 0, 'bytes': 0, 'error': None}
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or not fnmatch.fnmatch(info.filename, pattern):
+                    continue
+                size = 0
+                with zip_ref.open(info) as src:
+                    for block in iter(lambda: src.read(256 * 1024), b''):
+                        size += len(block)
+                if size != info.file_size:
+                    raise zipfile.BadZipFile(f'サイズ不一致: {info.filename}')
+                result['files'] += 1
+                result['bytes'] += size
+    except Exception as e:
+        result['error'] = f'ZIP検証失敗: {e}'
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+def main(date_str, workers=None, pattern=DEFAULT_MEMBER_PATTERN, in_place=False, catalog=None):
+    """in_place=Trueの場合は展開せずZIPを残す（後続処理はZIP内のCSVを直接読む）。
+    catalog（DataCatalog）を渡すと処理後の書類の一覧を目録に反映する"""
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     target_dir = os.path.join(base_dir, 'data', date_str)
     if not os.path.exists(target_dir):
         logging.error(f'ディレクトリが存在しません: {target_dir}')
         return
 
+    jobs = []
     for file in os.listdir(target_dir):
         if file.lower().endswith('.zip'):
             zip_path = os.path.join(target_dir, file)
             extract_dir = os.path.join(target_dir, os.path.splitext(file)[0])
-            os.makedirs(extract_dir, exist_ok=True)
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                logging.info(f'解凍完了: {zip_path} → {extract_dir}')
-                # 解凍後にZIPファイルを削除
-                try:
-                    os.remove(zip_path)
-                    logging.info(f'ZIPファイル削除: {zip_path}')
-                except Exception as e:
-                    logging.error(f'ZIPファイル削除失敗: {zip_path} : {e}')
-            except Exception as e:
-                logging.error(f'解凍失敗: {zip_path} : {e}')
+            jobs.append((zip_path, extract_dir))
+    if not jobs:
+        if catalog is not None:
+            catalog.sync_day(date_str)
+        return
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('使い方: python zip2csv.py yyyymmdd')
+    start = time.perf_counter()
+    worker = verify_zip if in_place else extract_zip
+    stage = 'ZIP検証' if in_place else 'ZIP解凍'
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers == 1:
+        results = [worker(zip_path, extract_dir, pattern) for zip_path, extract_dir in jobs]
     else:
-        main(sys.argv[1])
\ No newline at end of file
+        with process_pool(workers) as pool:
+            results = list(pool.map(worker, *zip(*jobs), [pattern] * len(jobs)))
+
+    per_worker = {}
+    for (zip_path, extract_dir), result in zip(jobs, results):
+        # ワーカープロセス内のメトリクスは親に届かないため、戻り値から記録する
+        REGISTRY.observe('item_seconds', result['elapsed'], stage=stage)
+        REGISTRY.inc('items_total', stage=stage, status='error' if result['error'] else 'ok')
+        if not in_place:
+            REGISTRY.inc('extract_files_total', result['files'])
+            REGISTRY.inc('extract_bytes_total', result['bytes'])
+        if result['error']:
+            logging.error(f'{result["error"]}: {zip_path}')
+        elif in_place:
+            logging.info(f'検証完了（展開なし）: {zip_path} ({result["files"]} ファイル)')
+        else:
+            logging.info(f'解凍完了: {zip_path} → {extract_dir} ({result["files"]} ファイル)')
+            logging.info(f'ZIPファイル削除: {zip_path}')
+        stats = per_worker.setdefault(result['pid'], {'zips': 0, 'files': 0, 'bytes': 0, 'elapsed': 0.0})
+        stats['zips'] += 1
+        stats['files'] += result['files']
+        stats['bytes'] += result['bytes']
+        stats['elapsed'] += result['elapsed']
+    for pid, stats in sorted(per_worker.items()):
+        logging.info(f'ワーカー {pid}: ZIP {stats["zips"]} 件, {stats["files"]} ファイル, '
+                     f'{stats["bytes"]:,} bytes, {stats["elapsed"]:.2f} 秒')
+    logging.info(f'{"検証" if in_place else "解凍"}合計: ZIP {len(jobs)} 件, 失敗 {sum(1 for r in results if r["error"])} 件, '
+                 f'{time.perf_counter() - start:.2f} 秒 (ワーカー {workers})')
+    if catalog is not None:
+        catalog.sync_day(date_str)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='data/yyyymmdd配下のZIPを解凍して削除する')
+    parser.add_argument('date', help='対象日 yyyymmdd')
+    parser.add_argument('--workers', type=int, default=None, help='解凍プロセス数（既定: CPUコア数）')
+    parser.add_argument('--pattern', default=DEFAULT_MEMBER_PATTERN, help='展開するメンバーのパターン（全て展開する場合は "*"）')
+    parser.add_argument('--in-place', action='store_true', help='展開せずにZIPを検証のみ行い残す（後続処理はZIP内を直接読む）')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    from data_catalog import DataCatalog, default_catalog_path
+    catalog = DataCatalog(default_catalog_path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+    try:
+        main(args.date, workers=args.workers, pattern=args.pattern, in_place=args.in_place, catalog=catalog)
+    finally:
+        catalog.close()